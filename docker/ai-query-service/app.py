@@ -4,29 +4,90 @@ AI Query Service for Pan-Dashboard
 Converts natural language questions to ClickHouse SQL queries using Ollama
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
 import clickhouse_connect
+import pyarrow as pa
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily
 import httpx
 import json
-from typing import Optional, Dict, Any
+import asyncio
+import hashlib
+import math
+import os
+import re
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from queue import Queue
+from typing import Optional, Dict, Any, Literal, Union
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Pan-Dashboard AI Query Service")
-
 # Configuration
 CLICKHOUSE_HOST = "localhost"
 CLICKHOUSE_PORT = 8123
-CLICKHOUSE_USER = "default"
+CLICKHOUSE_USER = "ai_query"  # Low-priority, read-only profile (docker/clickhouse/users.d/ai_query.xml)
 CLICKHOUSE_PASSWORD = "clickhouse"
+QUERY_LOG_USER = "ai_query_log"  # Granted SELECT on system.query_log only; generated SQL never runs as it
+QUERY_LOG_PASSWORD = "clickhouse"
+CLICKHOUSE_POOL_SIZE = 8  # Concurrent ClickHouse queries; requests beyond this wait for a free client
 DATABASE = "file_share"
 TABLE = "file_scan"
 
 OLLAMA_URL = "http://192.168.33.197:11434"
 OLLAMA_MODEL = "mistral-nemo:12b-instruct-2407-q8_0"
+OLLAMA_CONCURRENCY = 2  # Generations sent to Ollama at once; the rest wait in the admission queue
+OLLAMA_QUEUE_SIZE = 16  # Waiting generations before new ones are turned away with 503
+OLLAMA_RETRY_AFTER = 15  # Seconds suggested to clients turned away
+BATCH_MAX_QUESTIONS = 50  # Questions accepted by one /query/batch call
+BATCH_CONCURRENCY = 8  # Questions of one batch in flight at once, so a batch can't fill the Ollama queue by itself
+
+DUPLICATE_TABLE = f"{DATABASE}.duplicate_groups"  # Built by import_data.py after each import
+DUPLICATES_MAX_PAGE = 1000  # Largest /duplicates page
+TREE_TABLE = f"{DATABASE}.file_scan_by_directory"  # Recursive per-directory rollup filled on import
+TREE_MAX_CHILDREN = 1000  # Most subdirectories one /tree call returns
+# Rollup rows of the latest full scan of each share; delta imports only hold churn, so they are left out
+LATEST_SCAN_FILTER = f"(share, scan_date) IN (SELECT share, scan_date FROM {DATABASE}.latest_scans)"
+
+# Cost guard for generated SQL
+QUERY_MAX_READ_ROWS = 500_000_000  # Budget checked with EXPLAIN ESTIMATE before running, and enforced server-side
+QUERY_MAX_READ_BYTES = 50 * 1024**3  # Uncompressed bytes; server-side only, EXPLAIN ESTIMATE has no byte figure
+QUERY_MAX_SECONDS = 60
+QUERY_MAX_MEMORY = 4 * 1024**3
+QUERY_SETTINGS = {  # Sent with every generated query; the ai_query profile caps them at the same values
+    "readonly": 1,
+    "max_execution_time": QUERY_MAX_SECONDS,
+    "max_memory_usage": QUERY_MAX_MEMORY,
+    "max_rows_to_read": QUERY_MAX_READ_ROWS,
+    "max_bytes_to_read": QUERY_MAX_READ_BYTES,
+    "max_result_rows": 1_000_000,
+    "result_overflow_mode": "break"
+}
+
+# Monitoring
+HEALTH_CACHE_SECONDS = 10  # /health answers from its last check for this long
+QUERY_LOG_INTERVAL = 15  # Seconds between system.query_log reads (the server flushes it every ~7.5 s)
+QUERY_LOG_MAX_AGE = 300  # Give up on a query_id that hasn't reached system.query_log after this long
+
+# Generated-SQL cache
+SQL_CACHE_FILE = "/app/cache/sql_cache.json"
+SQL_CACHE_SIZE = 1000  # Questions kept; least recently used are evicted first
+SQL_CACHE_TTL = 7 * 24 * 3600  # Seconds before a cached answer is regenerated
+SQL_CACHE_EMBED_MODEL = None  # Ollama embedding model (e.g. "nomic-embed-text") to reuse SQL for paraphrased questions
+SQL_CACHE_SIMILARITY = 0.95  # Minimum cosine similarity for a paraphrase hit
+SQL_CACHE_SAVE_SECONDS = 30  # Changes are written to SQL_CACHE_FILE at most this often, in a thread
+
+# Query-result cache
+RESULT_CACHE_MAX_BYTES = 256 * 1024 * 1024  # Estimated memory for cached result sets
+DATA_VERSION_TTL = 30  # Seconds between checks of the latest scan_date and row count
 
 # Database schema for the model
 SCHEMA_INFO = """
@@ -43,9 +104,12 @@ Columns:
 - modify_date (DateTime): When file was last modified
 - last_accessed_date (DateTime): When file was last accessed
 - owner (String): File owner in format 'DOMAIN\\username'
-- acl (String): Access control list
+- acl_id (UInt64): Id of the file's access control list in the acl_dict dictionary
+- acl (String ALIAS): Access control list text. An alias that does one acl_dict lookup per row,
+  so only select it for a few rows; never filter or group on it over the whole table
 - duplicate_hash (String): Hash for duplicate detection
 - scan_date (Date): When scan was performed
+- share (String): Share the scan came from (the Source: line of the scan file)
 
 Computed expressions (use these in queries):
 - splitByChar('\\\\', owner)[1] AS domain
@@ -61,18 +125,566 @@ Important notes:
 - Use formatReadableQuantity(COUNT(*)) for large numbers
 - Owner format requires double backslash: splitByChar('\\\\', owner)
 - Always use appropriate aggregations for summary queries
+- The table holds every scan, and some scans are partial (delta) imports. For the current state of
+  the shares add: (share, scan_date) IN (SELECT share, scan_date FROM file_share.latest_scans)
+- Filter on ACL properties through the dictionary flags instead of the acl text, e.g.
+  dictGet('file_share.acl_dict', 'everyone_access', acl_id) = 1 or
+  dictGet('file_share.acl_dict', 'has_orphaned_sid', acl_id) = 1
 """
 
+SQL_PROMPT = """### Task
+Generate a ClickHouse SQL query for: {question}
+
+### Database Schema
+Table: file_share.file_scan
+Columns: path, filename, extension, size, migrated, creation_date, modify_date, last_accessed_date, owner (format: DOMAIN\\username), acl_id, acl, duplicate_hash, scan_date
+acl is an ALIAS that looks up acl_dict once per row: never filter or group on it; use
+dictGet('file_share.acl_dict', 'everyone_access', acl_id) or 'has_orphaned_sid' instead
+
+Computed expressions:
+- Domain: splitByChar('\\\\', owner)[1]
+- Username: splitByChar('\\\\', owner)[2]
+- Days since modified: dateDiff('day', modify_date, now())
+- Days since accessed: dateDiff('day', last_accessed_date, now())
+- File age: dateDiff('day', creation_date, now())
+
+### Response Format
+Return ONLY the SQL SELECT statement. No explanations, no markdown, no comments.
+Do not include any text before or after the query.
+
+SQL Query:"""
+
+# Prometheus metrics (GET /metrics)
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 180)
+LLM_SECONDS = Histogram("ai_query_llm_seconds", "Ollama SQL generation time", ["mode"], buckets=SECONDS_BUCKETS)
+LLM_QUEUE_SECONDS = Histogram("ai_query_llm_queue_seconds", "Time waiting for an Ollama slot", buckets=SECONDS_BUCKETS)
+GUARD_SECONDS = Histogram("ai_query_guard_seconds", "EXPLAIN cost check time", buckets=SECONDS_BUCKETS)
+SQL_SECONDS = Histogram("ai_query_sql_seconds", "ClickHouse execution time seen by the service", ["format"],
+                        buckets=SECONDS_BUCKETS)
+SERIALIZE_SECONDS = Histogram("ai_query_serialize_seconds", "Result formatting time", ["format"], buckets=SECONDS_BUCKETS)
+REQUEST_SECONDS = Histogram("ai_query_request_seconds", "End-to-end /query time", ["path"], buckets=SECONDS_BUCKETS)
+CLICKHOUSE_SECONDS = Histogram("ai_query_clickhouse_seconds", "query_duration_ms from system.query_log",
+                               buckets=SECONDS_BUCKETS)
+CLICKHOUSE_READ_ROWS = Histogram("ai_query_clickhouse_read_rows", "Rows read per generated query (system.query_log)",
+                                 buckets=(1e3, 1e4, 1e5, 1e6, 1e7, 5e7, 1e8, 5e8, 1e9))
+CLICKHOUSE_READ_BYTES = Histogram("ai_query_clickhouse_read_bytes", "Bytes read per generated query (system.query_log)",
+                                  buckets=(1e6, 1e7, 1e8, 1e9, 1e10, 5e10, 1e11))
+CLICKHOUSE_MEMORY_BYTES = Histogram("ai_query_clickhouse_memory_bytes", "Peak memory per generated query (system.query_log)",
+                                    buckets=(1e6, 1e7, 1e8, 5e8, 1e9, 4e9, 1e10))
+LLM_QUEUE_WAITING = Gauge("ai_query_llm_queue_waiting", "Generations waiting for an Ollama slot")
+LLM_RUNNING = Gauge("ai_query_llm_running", "Generations running on Ollama")
+
+pending_query_ids: Dict[str, float] = {}  # Generated queries not yet seen in system.query_log -> issue time
+
+def generated_query_settings() -> Dict[str, Any]:
+    """QUERY_SETTINGS plus a query_id so the query's server-side cost can be read back from system.query_log"""
+    query_id = uuid.uuid4().hex
+    pending_query_ids[query_id] = time.time()
+    return {**QUERY_SETTINGS, "query_id": query_id}
+
+# ClickHouse clients live for the whole process; created at startup, closed at shutdown
+clickhouse_pool: Optional[Queue] = None
+query_executor: Optional[ThreadPoolExecutor] = None
+query_log_client = None  # Separate QUERY_LOG_USER client for collect_query_log
+clickhouse_slots = asyncio.Semaphore(CLICKHOUSE_POOL_SIZE)  # Held while a client is borrowed, so pool.get never blocks a thread
+
+def open_clickhouse_pool(size: int) -> Queue:
+    """Open `size` ClickHouse clients and put them in a queue"""
+    pool = Queue(maxsize=size)
+    for _ in range(size):
+        pool.put(clickhouse_connect.get_client(
+            host=CLICKHOUSE_HOST,
+            port=CLICKHOUSE_PORT,
+            username=CLICKHOUSE_USER,
+            password=CLICKHOUSE_PASSWORD,
+            autogenerate_session_id=False
+        ))
+    return pool
+
+def close_clickhouse_pool(pool: Queue):
+    """Close every client in the pool"""
+    while not pool.empty():
+        pool.get_nowait().close()
+
+@contextmanager
+def pooled_client():
+    """Borrow a client from the pool; blocks until one is free"""
+    client = clickhouse_pool.get()
+    try:
+        yield client
+    finally:
+        clickhouse_pool.put(client)
+
+def run_query(sql: str, settings: Optional[Dict[str, Any]] = None):
+    """Run a query on a pooled client (blocking, call from the executor)"""
+    with pooled_client() as client:
+        return client.query(sql, settings=settings)
+
+def run_arrow_query(sql: str) -> pa.Table:
+    """Run a generated query on a pooled client and return an Arrow table (blocking, call from the executor)"""
+    with pooled_client() as client:
+        return client.query_arrow(sql, settings=generated_query_settings(), use_strings=True)
+
+async def execute_query(sql: str, settings: Optional[Dict[str, Any]] = None):
+    """Run a query in the executor so slow aggregations don't block the event loop"""
+    loop = asyncio.get_running_loop()
+    async with clickhouse_slots:
+        return await loop.run_in_executor(query_executor, run_query, sql, settings)
+
+async def execute_arrow_query(sql: str) -> pa.Table:
+    loop = asyncio.get_running_loop()
+    async with clickhouse_slots:
+        return await loop.run_in_executor(query_executor, run_arrow_query, sql)
+
+LIMIT_ERRORS = ("TOO_MANY_ROWS", "TOO_MANY_BYTES", "TIMEOUT_EXCEEDED", "MEMORY_LIMIT_EXCEEDED")  # QUERY_SETTINGS tripped
+
+JOIN_TYPE_PATTERN = re.compile(r"\bType:\s*(\w+)", re.IGNORECASE)  # Join type line of EXPLAIN PLAN actions = 1
+CROSS_JOIN_PATTERN = re.compile(r"\bCROSS\s+JOIN\b", re.IGNORECASE)
+
+async def check_query_cost(sql: str):
+    """
+    Reject generated SQL whose estimated read exceeds QUERY_MAX_READ_ROWS before it reaches ClickHouse.
+    EXPLAIN ESTIMATE gives the rows each table will read. A cross join is costed as (rows / 2)^2,
+    the largest product two sides sharing that many rows can have. The QUERY_SETTINGS limits
+    still apply when the estimate is wrong.
+    """
+    with GUARD_SECONDS.time():
+        estimate = await execute_query(f"EXPLAIN ESTIMATE {sql}", QUERY_SETTINGS)
+        plan = await execute_query(f"EXPLAIN PLAN actions = 1 {sql}", QUERY_SETTINGS)
+    read_rows = sum(row[3] for row in estimate.result_rows)
+    plan_text = "\n".join(row[0] for row in plan.result_rows)
+
+    join_types = [join_type.lower() for join_type in JOIN_TYPE_PATTERN.findall(plan_text)]
+    if join_types:
+        # The plan has the type after rewrites, so a comma join with a WHERE key shows up as inner
+        cross_join = "cross" in join_types
+    else:
+        cross_join = "Join" in plan_text and CROSS_JOIN_PATTERN.search(sql) is not None
+    estimated_rows = (read_rows // 2) ** 2 if cross_join else read_rows
+    
+    logger.info(f"Estimated rows: {estimated_rows:,} (read: {read_rows:,}, cross join: {cross_join})")
+    if estimated_rows > QUERY_MAX_READ_ROWS:
+        kind = "cross join producing" if cross_join else "reading"
+        raise HTTPException(status_code=400, detail=f"Query too expensive: {kind} an estimated {estimated_rows:,} rows "
+                                                    f"(limit {QUERY_MAX_READ_ROWS:,}). Try a narrower question.")
+
+async def stream_query_blocks(sql: str):
+    """
+    Yield (column_names, rows) blocks from query_row_block_stream without materializing the result.
+    The pooled client stays borrowed until the stream ends or the consumer goes away.
+    """
+    loop = asyncio.get_running_loop()
+    async with clickhouse_slots:
+        with pooled_client() as client:
+            stream = await loop.run_in_executor(
+                query_executor, lambda: client.query_row_block_stream(sql, settings=generated_query_settings()))
+            with stream:
+                columns = stream.source.column_names
+                while True:
+                    block = await loop.run_in_executor(query_executor, next, stream, None)
+                    if block is None:
+                        return
+                    yield columns, block
+
+def json_default(value):
+    """JSON for ClickHouse values the json module can't encode (dates, decimals, UUIDs)"""
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+def normalize_sql(sql: str) -> str:
+    return " ".join(sql.split()).rstrip(";").strip()
+
+def estimate_result_bytes(columns: list, rows: list) -> int:
+    """Rough in-memory size of a result set: strings by length, everything else as 16 bytes"""
+    size = 64 * (len(rows) + len(columns))
+    for row in rows:
+        for value in row:
+            size += len(value) if isinstance(value, (str, bytes)) else 16
+    return size
+
+class ResultCache:
+    """Query results keyed by (normalized SQL, data version), evicted LRU by estimated size"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (columns, rows, size)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0], entry[1]
+
+    def put(self, key, columns: list, rows: list):
+        size = estimate_result_bytes(columns, rows)
+        if size > self.max_bytes:
+            return  # Never cache a result that would flush everything else
+        if key in self.entries:
+            self.bytes -= self.entries.pop(key)[2]
+        self.entries[key] = (columns, rows, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            self.bytes -= self.entries.popitem(last=False)[1][2]
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0
+        }
+
+result_cache = ResultCache(RESULT_CACHE_MAX_BYTES)
+data_version = {"value": None, "checked": 0.0}
+data_version_lock = asyncio.Lock()
+inflight_queries: Dict[Any, asyncio.Future] = {}
+
+async def get_data_version():
+    """Latest scan_date and row count; any import changes it, which retires every cached result"""
+    async with data_version_lock:
+        if data_version["value"] is None or time.time() - data_version["checked"] > DATA_VERSION_TTL:
+            result = await execute_query(f"SELECT max(scan_date), count() FROM {DATABASE}.{TABLE}")
+            scan_date, rows = result.result_rows[0]
+            data_version["value"] = (str(scan_date), rows)
+            data_version["checked"] = time.time()
+        return data_version["value"]
+
+def invalidate_results():
+    result_cache.clear()
+    data_version["value"] = None
+
+async def execute_cached_query(sql: str):
+    """
+    Return (columns, rows, cached). Identical SQL against the same data version is served
+    from the result cache, and concurrent callers of an uncached query share one execution.
+    """
+    key = (normalize_sql(sql), await get_data_version())
+    hit = result_cache.get(key)
+    if hit:
+        return hit[0], hit[1], True
+    if key in inflight_queries:
+        result_cache.hits += 1
+        columns, rows = await asyncio.shield(inflight_queries[key])
+        return columns, rows, True
+
+    result_cache.misses += 1
+    future = asyncio.get_running_loop().create_future()
+    inflight_queries[key] = future
+    try:
+        await check_query_cost(sql)
+        with SQL_SECONDS.labels("json").time():
+            result = await execute_query(sql, generated_query_settings())
+        columns, rows = list(result.column_names), result.result_rows
+        result_cache.put(key, columns, rows)
+        future.set_result((columns, rows))
+        return columns, rows, False
+    except BaseException as e:
+        # A cancelled owner (e.g. a /query/batch client that disconnected) must still release coalesced waiters
+        future.set_exception(e if isinstance(e, Exception) else RuntimeError("Query was cancelled"))
+        future.exception()  # Mark retrieved when nobody else was waiting
+        raise
+    finally:
+        del inflight_queries[key]
+
+def normalize_question(question: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace so trivial rewordings share a key"""
+    return " ".join(re.sub(r"[^\w\s]", " ", question.lower()).split())
+
+def cosine_similarity(a: list, b: list) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+class SqlCache:
+    """
+    LRU/TTL cache of generated SQL keyed by normalized question, persisted as JSON.
+    The file records a fingerprint of the schema, prompt and model; a mismatch on load
+    discards every entry so SQL written against an old schema is never reused.
+    Changes only mark the cache dirty; persist_sql_cache writes it in the background.
+    """
+
+    def __init__(self, path: str, fingerprint: str, max_entries: int, ttl: float):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> {"sql", "created", "numbers", "embedding"}
+        self.hits = {"exact": 0, "similar": 0}
+        self.misses = 0
+        self.dirty = False
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("fingerprint") != self.fingerprint:
+            logger.info("SQL cache discarded: schema, prompt or model changed")
+            return
+        for key, entry in data.get("entries", []):
+            self.entries[key] = entry
+        self.evict()
+        logger.info(f"SQL cache loaded ({len(self.entries)} questions)")
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Copy of the entries to write; taken on the event loop so a writer thread never sees them change"""
+        self.dirty = False
+        return {"fingerprint": self.fingerprint, "entries": list(self.entries.items())}
+
+    def write(self, data: Dict[str, Any]):
+        """Atomically replace the cache file (blocking; persist_sql_cache runs it in a thread)"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+
+    def save(self):
+        self.write(self.snapshot())
+
+    def evict(self):
+        now = time.time()
+        for key in [k for k, e in self.entries.items() if now - e["created"] > self.ttl]:
+            del self.entries[key]
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self.entries.get(key)
+        if entry is None or time.time() - entry["created"] > self.ttl:
+            return None
+        self.entries.move_to_end(key)
+        self.hits["exact"] += 1
+        return entry["sql"]
+
+    def get_similar(self, key: str, embedding: list) -> Optional[str]:
+        """Best paraphrase above SQL_CACHE_SIMILARITY; numbers must match so 'top 10' never reuses 'top 20'"""
+        numbers = re.findall(r"\d+", key)
+        now = time.time()
+        best_key, best_score = None, SQL_CACHE_SIMILARITY
+        for other, entry in self.entries.items():
+            if not entry.get("embedding") or entry["numbers"] != numbers or now - entry["created"] > self.ttl:
+                continue
+            score = cosine_similarity(embedding, entry["embedding"])
+            if score >= best_score:
+                best_key, best_score = other, score
+        if best_key is None:
+            return None
+        self.entries.move_to_end(best_key)
+        self.hits["similar"] += 1
+        return self.entries[best_key]["sql"]
+
+    def put(self, key: str, sql: str, embedding: Optional[list] = None):
+        self.entries[key] = {"sql": sql, "created": time.time(), "numbers": re.findall(r"\d+", key),
+                             "embedding": embedding}
+        self.entries.move_to_end(key)
+        self.evict()
+        self.dirty = True
+
+    def discard(self, sql: str):
+        """Drop every question cached with this SQL, e.g. after it failed or was rejected"""
+        for key in [k for k, e in self.entries.items() if e["sql"] == sql]:
+            del self.entries[key]
+            self.dirty = True
+
+    def clear(self):
+        self.entries.clear()
+        self.dirty = True
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits["exact"] + self.hits["similar"] + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits_exact": self.hits["exact"],
+            "hits_similar": self.hits["similar"],
+            "misses": self.misses,
+            "hit_rate": round((lookups - self.misses) / lookups, 3) if lookups else 0.0
+        }
+
+sql_cache = SqlCache(
+    SQL_CACHE_FILE,
+    hashlib.sha256(f"{SCHEMA_INFO}\n{SQL_PROMPT}\n{OLLAMA_MODEL}\n{SQL_CACHE_EMBED_MODEL}".encode()).hexdigest(),
+    SQL_CACHE_SIZE,
+    SQL_CACHE_TTL
+)
+
+async def embed_question(question: str) -> Optional[list]:
+    """Embedding for the similarity tier; None when disabled or Ollama can't provide one"""
+    if not SQL_CACHE_EMBED_MODEL:
+        return None
+    try:
+        response = await ollama_client.post(
+            f"{OLLAMA_URL}/api/embeddings",
+            json={"model": SQL_CACHE_EMBED_MODEL, "prompt": question},
+            timeout=10.0
+        )
+        response.raise_for_status()
+        return response.json().get("embedding") or None
+    except Exception as e:
+        logger.warning(f"Question embedding failed: {str(e)}")
+        return None
+
+async def lookup_cached_sql(question: str):
+    """Return (sql, tier, embedding); sql is None on a miss and the embedding is reused when storing"""
+    key = normalize_question(question)
+    sql = sql_cache.get(key)
+    if sql:
+        return sql, "exact", None
+    embedding = await embed_question(key)
+    if embedding:
+        sql = sql_cache.get_similar(key, embedding)
+        if sql:
+            sql_cache.put(key, sql, embedding)  # The paraphrase becomes an exact hit next time
+            return sql, "similar", embedding
+    sql_cache.misses += 1
+    return None, "miss", embedding
+
+# One keep-alive connection pool to Ollama for the whole process
+ollama_client: Optional[httpx.AsyncClient] = None
+ollama_slots = asyncio.Semaphore(OLLAMA_CONCURRENCY)
+ollama_waiting = 0
+LLM_QUEUE_WAITING.set_function(lambda: ollama_waiting)
+inflight_generations: Dict[str, asyncio.Future] = {}
+
+@asynccontextmanager
+async def ollama_slot():
+    """Admission queue for generations: wait for one of OLLAMA_CONCURRENCY slots, or fail fast when the queue is full"""
+    global ollama_waiting
+    if ollama_slots.locked() and ollama_waiting >= OLLAMA_QUEUE_SIZE:
+        raise HTTPException(status_code=503, detail="SQL generation queue is full, try again shortly",
+                            headers={"Retry-After": str(OLLAMA_RETRY_AFTER)})
+    ollama_waiting += 1
+    try:
+        with LLM_QUEUE_SECONDS.time():
+            await ollama_slots.acquire()
+    finally:
+        ollama_waiting -= 1
+    try:
+        with LLM_RUNNING.track_inprogress():
+            yield
+    finally:
+        ollama_slots.release()
+
+class CacheCollector:
+    """Exposes the SQL and result cache counters, which the caches keep themselves"""
+
+    def collect(self):
+        lookups = CounterMetricFamily("ai_query_cache_lookups", "Cache lookups by cache and outcome",
+                                      labels=["cache", "result"])
+        sql_stats = sql_cache.stats()
+        lookups.add_metric(["sql", "hit_exact"], sql_stats["hits_exact"])
+        lookups.add_metric(["sql", "hit_similar"], sql_stats["hits_similar"])
+        lookups.add_metric(["sql", "miss"], sql_stats["misses"])
+        lookups.add_metric(["results", "hit"], result_cache.hits)
+        lookups.add_metric(["results", "miss"], result_cache.misses)
+        yield lookups
+
+REGISTRY.register(CacheCollector())
+
+async def collect_query_log():
+    """Read server-side duration, rows, bytes and memory of generated queries back from system.query_log"""
+    while True:
+        await asyncio.sleep(QUERY_LOG_INTERVAL)
+        now = time.time()
+        for query_id in [q for q, issued in pending_query_ids.items() if now - issued > QUERY_LOG_MAX_AGE]:
+            del pending_query_ids[query_id]
+        if not pending_query_ids:
+            continue
+        ids = ", ".join(f"'{query_id}'" for query_id in pending_query_ids)
+        try:
+            result = await asyncio.to_thread(
+                query_log_client.query,
+                "SELECT query_id, query_duration_ms, read_rows, read_bytes, memory_usage FROM system.query_log "
+                f"WHERE event_date >= yesterday() AND type != 'QueryStart' AND query_id IN ({ids})")
+        except Exception as e:
+            logger.warning(f"Could not read system.query_log: {str(e)}")
+            continue
+        for query_id, duration_ms, read_rows, read_bytes, memory in result.result_rows:
+            if pending_query_ids.pop(query_id, None) is None:
+                continue
+            CLICKHOUSE_SECONDS.observe(duration_ms / 1000)
+            CLICKHOUSE_READ_ROWS.observe(read_rows)
+            CLICKHOUSE_READ_BYTES.observe(read_bytes)
+            CLICKHOUSE_MEMORY_BYTES.observe(memory)
+
+async def persist_sql_cache():
+    """Write the SQL cache every SQL_CACHE_SAVE_SECONDS when it changed, off the event loop"""
+    while True:
+        await asyncio.sleep(SQL_CACHE_SAVE_SECONDS)
+        if not sql_cache.dirty:
+            continue
+        try:
+            await asyncio.to_thread(sql_cache.write, sql_cache.snapshot())
+        except OSError as e:
+            sql_cache.dirty = True
+            logger.warning(f"Could not persist SQL cache: {e}")
+
+def remember_sql(sql_result: Dict[str, Any]):
+    """Cache SQL from the model once it has run; SQL that fails or is rejected is never stored"""
+    if sql_result["path"] == "llm":
+        sql_cache.put(sql_result["question_key"], sql_result["sql"], sql_result["embedding"])
+
+def forget_sql(sql_result: Optional[Dict[str, Any]]):
+    """Drop cached SQL that failed or was rejected, so the question is generated afresh next time"""
+    if sql_result is not None and sql_result["path"] == "sql_cache":
+        sql_cache.discard(sql_result["sql"])
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global clickhouse_pool, query_executor, ollama_client, query_log_client
+    sql_cache.load()
+    ollama_client = httpx.AsyncClient(timeout=180.0, limits=httpx.Limits(max_keepalive_connections=OLLAMA_CONCURRENCY * 2))
+    clickhouse_pool = open_clickhouse_pool(CLICKHOUSE_POOL_SIZE)
+    query_executor = ThreadPoolExecutor(max_workers=CLICKHOUSE_POOL_SIZE, thread_name_prefix="clickhouse")
+    logger.info(f"ClickHouse pool ready ({CLICKHOUSE_POOL_SIZE} clients)")
+    query_log_client = clickhouse_connect.get_client(host=CLICKHOUSE_HOST, port=CLICKHOUSE_PORT, username=QUERY_LOG_USER,
+                                                     password=QUERY_LOG_PASSWORD, autogenerate_session_id=False)
+    background = [asyncio.create_task(collect_query_log()), asyncio.create_task(persist_sql_cache())]
+    yield
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    query_log_client.close()
+    query_executor.shutdown(wait=True)
+    close_clickhouse_pool(clickhouse_pool)
+    await ollama_client.aclose()
+    try:
+        sql_cache.save()
+    except OSError as e:
+        logger.warning(f"Could not persist SQL cache: {e}")
+
+app = FastAPI(title="Pan-Dashboard AI Query Service", lifespan=lifespan)
+
 class QueryRequest(BaseModel):
     question: str
     max_rows: Optional[int] = 100
+    stream: Optional[bool] = False  # NDJSON: {"sql": ..., "path": ...}, then one {"row": {...}} per row, then {"row_count": ...}
+    # json_rows: list of row dicts, json_columns: {column: [values]}, arrow: Arrow IPC stream body
+    format: Literal["json_rows", "json_columns", "arrow"] = "json_rows"
+
+class BatchQueryRequest(BaseModel):
+    questions: list[str]
+    max_rows: Optional[int] = 100
 
 class QueryResponse(BaseModel):
     question: str
     sql: str
-    results: list
+    results: Union[list, Dict[str, list]]
     row_count: int
     explanation: str
+    path: str = "llm"  # How the SQL was produced: "rule" (fast path), "sql_cache" or "llm"
 
 @app.get("/")
 async def root():
@@ -84,137 +696,364 @@ async def root():
         "database": f"{DATABASE}.{TABLE}"
     }
 
+health_status = {"value": None, "checked": 0.0}
+
 @app.get("/health")
 async def health():
-    """Detailed health check"""
+    """Detailed health check; probes within HEALTH_CACHE_SECONDS reuse the last result"""
+    if health_status["value"] and time.time() - health_status["checked"] < HEALTH_CACHE_SECONDS:
+        return health_status["value"]
     status = {"service": "ok"}
     
-    # Check ClickHouse
+    # Check ClickHouse (row count comes from the cached data version, not a fresh COUNT(*))
     try:
-        client = clickhouse_connect.get_client(
-            host=CLICKHOUSE_HOST,
-            port=CLICKHOUSE_PORT,
-            username=CLICKHOUSE_USER,
-            password=CLICKHOUSE_PASSWORD
-        )
-        result = client.query("SELECT COUNT(*) FROM file_share.file_scan")
-        status["clickhouse"] = f"ok ({result.result_rows[0][0]:,} rows)"
-        client.close()
+        _, rows = await get_data_version()
+        status["clickhouse"] = f"ok ({rows:,} rows)"
     except Exception as e:
         status["clickhouse"] = f"error: {str(e)}"
     
     # Check Ollama
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.get(f"{OLLAMA_URL}/api/tags")
-            if response.status_code == 200:
-                models = response.json().get("models", [])
-                model_names = [m["name"] for m in models]
-                if OLLAMA_MODEL in model_names:
-                    status["ollama"] = f"ok (model: {OLLAMA_MODEL})"
-                else:
-                    status["ollama"] = f"warning: {OLLAMA_MODEL} not found"
+        response = await ollama_client.get(f"{OLLAMA_URL}/api/tags", timeout=5.0)
+        if response.status_code == 200:
+            models = response.json().get("models", [])
+            model_names = [m["name"] for m in models]
+            if OLLAMA_MODEL in model_names:
+                status["ollama"] = f"ok (model: {OLLAMA_MODEL})"
             else:
-                status["ollama"] = f"error: status {response.status_code}"
+                status["ollama"] = f"warning: {OLLAMA_MODEL} not found"
+        else:
+            status["ollama"] = f"error: status {response.status_code}"
     except Exception as e:
         status["ollama"] = f"error: {str(e)}"
     
+    health_status["value"] = status
+    health_status["checked"] = time.time()
     return status
 
-async def generate_sql(question: str) -> Dict[str, str]:
-    """Generate SQL query from natural language using Ollama"""
-    
-    prompt = f"""### Task
-Generate a ClickHouse SQL query for: {question}
+# Fast path: common questions answered from the dashboard rollups without calling Ollama.
+# Like the dashboards, they count the latest full scan of each share (LATEST_SCAN_FILTER).
+# Patterns match the whole normalized question (see normalize_question) so anything more
+# specific, e.g. "how many files does CORP\\jsmith own", still goes to the LLM.
+BUCKET_TABLE = f"{DATABASE}.file_scan_by_bucket"
+OWNER_TABLE = f"{DATABASE}.file_scan_by_owner"
+EXTENSION_TABLE = f"{DATABASE}.file_scan_by_extension"
+AGE_BUCKET_DAYS = [30, 90, 180, 365, 730, 1095]  # age_bucket N starts at AGE_BUCKET_DAYS[N - 1] days
+NUMBER_WORDS = {"a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "six": 6, "twelve": 12}
+TOP = r"(?:show me |list |what are |who are |which are )?(?:the )?(?:top|largest|biggest)(?: (?P<n>\d+))?"
 
-### Database Schema
-Table: file_share.file_scan
-Columns: path, filename, extension, size, migrated, creation_date, modify_date, last_accessed_date, owner (format: DOMAIN\\username), acl, duplicate_hash, scan_date
+def age_bucket_for(amount: str, unit: str) -> Optional[int]:
+    """Rollup age bucket for 'N years/months', or None if N doesn't line up with a bucket boundary"""
+    n = int(amount) if amount.isdigit() else NUMBER_WORDS.get(amount)
+    if n is None:
+        return None
+    days = n * 365 if unit.startswith("year") else n * 30
+    days = 365 if days == 360 else days  # "12 months"
+    return AGE_BUCKET_DAYS.index(days) + 1 if days in AGE_BUCKET_DAYS else None
 
-Computed expressions:
-- Domain: splitByChar('\\\\', owner)[1]
-- Username: splitByChar('\\\\', owner)[2]
-- Days since modified: dateDiff('day', modify_date, now())
-- Days since accessed: dateDiff('day', last_accessed_date, now())
-- File age: dateDiff('day', creation_date, now())
+def top_owners_sql(m) -> str:
+    order = "SUM(files)" if m.group("metric") in ("file count", "files", "count", "number of files") else "SUM(bytes)"
+    return (f"SELECT owner, SUM(files) AS file_count, formatReadableSize(SUM(bytes)) AS total_size "
+            f"FROM {OWNER_TABLE} WHERE {LATEST_SCAN_FILTER} AND is_directory = 0 AND owner != '' "
+            f"GROUP BY owner ORDER BY {order} DESC LIMIT {int(m.group('n') or 10)}")
 
-### Response Format
-Return ONLY the SQL SELECT statement. No explanations, no markdown, no comments.
-Do not include any text before or after the query.
+def top_extensions_sql(m) -> str:
+    order = "SUM(files)" if m.group("metric") in ("file count", "files", "count", "number of files") else "SUM(bytes)"
+    return (f"SELECT if(extension = '', '(no extension)', extension) AS extension, SUM(files) AS file_count, "
+            f"formatReadableSize(SUM(bytes)) AS total_size FROM {EXTENSION_TABLE} WHERE {LATEST_SCAN_FILTER} AND is_directory = 0 "
+            f"GROUP BY extension ORDER BY {order} DESC LIMIT {int(m.group('n') or 10)}")
 
-SQL Query:"""
+def stale_files_sql(verb: str, amount: str, unit: str) -> Optional[str]:
+    bucket = age_bucket_for(amount, unit)
+    if bucket is None:
+        return None
+    if verb in ("accessed", "used", "opened", "unused", "unaccessed"):
+        return (f"SELECT SUM(files) AS file_count, formatReadableSize(SUM(bytes)) AS total_size "
+                f"FROM {EXTENSION_TABLE} WHERE {LATEST_SCAN_FILTER} AND access_age_bucket >= {bucket} AND is_directory = 0")
+    return (f"SELECT SUM(files) AS file_count, formatReadableSize(SUM(bytes)) AS total_size "
+            f"FROM {BUCKET_TABLE} WHERE {LATEST_SCAN_FILTER} AND age_bucket >= {bucket} AND is_directory = 0")
 
+STALE_PERIOD = r"(?: in| for)?(?: the)?(?: last| past| over| more than| at least)? (?P<amount>\d+|an?|one|two|three|six|twelve) (?P<unit>years?|months?)"
+METRIC = r"(?: by (?P<metric>storage|size|space|storage size|disk space|file count|files|count|number of files))?"
+INTENTS = [
+    ("total_files",
+     r"(?:how many|total|total number of|number of|count of|count) files(?: are there| do we have| in total| total)?",
+     lambda m: f"SELECT SUM(files) AS total_files FROM {BUCKET_TABLE} WHERE {LATEST_SCAN_FILTER} AND is_directory = 0"),
+    ("total_directories",
+     r"(?:how many|total|total number of|number of|count of|count) (?:directories|folders)(?: are there| do we have| in total| total)?",
+     lambda m: f"SELECT SUM(files) AS total_directories FROM {BUCKET_TABLE} WHERE {LATEST_SCAN_FILTER} AND is_directory = 1"),
+    ("total_size",
+     r"(?:what is |whats )?(?:the )?(?:total (?:storage|size|space|disk space|storage used|space used|data)"
+     r"|how much (?:storage|space|data|disk space)(?: is used| is there| do we use| are we using| is in use)?"
+     r"|total size of (?:all )?files)",
+     lambda m: f"SELECT formatReadableSize(SUM(bytes)) AS total_size FROM {BUCKET_TABLE} WHERE {LATEST_SCAN_FILTER} AND is_directory = 0"),
+    ("average_file_size",
+     r"(?:what is |whats )?(?:the )?(?:average|avg|mean) file size",
+     lambda m: f"SELECT formatReadableSize(SUM(bytes) / SUM(files)) AS average_file_size FROM {BUCKET_TABLE} "
+               f"WHERE {LATEST_SCAN_FILTER} AND is_directory = 0"),
+    ("top_owners", TOP + r" (?:owners|users|file owners)" + METRIC, top_owners_sql),
+    ("top_extensions",
+     TOP + r" (?:file )?(?:extensions|file types|types)" + METRIC
+     + r"|which (?:file )?(?:extensions|file types) use the most (?:storage|space)",
+     top_extensions_sql),
+    ("stale_files",
+     r"(?:how many |show |count |list )?(?:the )?(?:files )?(?:that )?(?:have not been|havent been|were not|not|never) "
+     r"(?P<verb>modified|changed|touched|accessed|used|opened)" + STALE_PERIOD,
+     lambda m: stale_files_sql(m.group("verb"), m.group("amount"), m.group("unit"))),
+    ("stale_files",
+     r"(?:how many |show |count |list )?(?:the )?(?:stale )?(?:files )?(?P<verb>unmodified|untouched|unchanged|stale|older than|unused|unaccessed)"
+     r"(?: files)?" + STALE_PERIOD,
+     lambda m: stale_files_sql(m.group("verb"), m.group("amount"), m.group("unit"))),
+    ("orphaned_sids",
+     r"(?:how many )?(?:files )?(?:owned by )?(?:orphaned|orphan|unresolved)(?: sids?| owners| sid owners| accounts)?(?: files)?"
+     r"|(?:how many )?files (?:owned by|with) (?:sids|sid owners|orphaned sids|orphaned owners|unknown sids)",
+     lambda m: f"SELECT SUM(files) AS file_count, formatReadableSize(SUM(bytes)) AS total_size "
+               f"FROM {OWNER_TABLE} WHERE {LATEST_SCAN_FILTER} AND owner LIKE 'S-1-%' AND is_directory = 0"),
+    ("empty_files",
+     r"(?:how many |show |count )?(?:the )?(?:empty|zero byte|0 byte|zero size) files(?: are there| do we have)?",
+     lambda m: f"SELECT SUM(files) AS empty_files FROM {BUCKET_TABLE} WHERE {LATEST_SCAN_FILTER} AND size_bucket = 0 AND is_directory = 0"),
+    ("recycle_bin",
+     r"(?:how many |how much |what is in |whats in )?(?:files |storage |space |data )?(?:is |are )?(?:in )?(?:the )?recycle bin(?: files| storage| usage| size)?",
+     lambda m: f"SELECT SUM(files) AS file_count, formatReadableSize(SUM(bytes)) AS total_size FROM {BUCKET_TABLE} "
+               f"WHERE {LATEST_SCAN_FILTER} AND in_recycle_bin = 1 AND is_directory = 0"),
+]
+INTENT_PATTERNS = [(name, re.compile(pattern), build) for name, pattern, build in INTENTS]
+
+def match_intent(question: str) -> Optional[Dict[str, str]]:
+    """SQL for a question the rules recognise, or None to fall back to the LLM"""
+    text = normalize_question(question)
+    for name, pattern, build in INTENT_PATTERNS:
+        m = pattern.fullmatch(text)
+        if m:
+            sql = build(m)
+            if sql:
+                return {"sql": sql, "model_used": None, "cache": None, "path": "rule", "intent": name}
+    return None
+
+def sql_generation_request(question: str, stream: bool) -> Dict[str, Any]:
+    """Ollama /api/generate payload for a question"""
+    return {
+        "model": OLLAMA_MODEL,
+        "prompt": SQL_PROMPT.format(question=question),
+        "stream": stream,
+        "system": "You are a SQL code generator. Output only SQL queries, nothing else.",
+        "options": {
+            "temperature": 0.0,
+            "top_p": 0.1,
+            "stop": ["\n\n", "###", "---", "Note:", "Explanation:"]
+        }
+    }
+
+def clean_sql(sql: str) -> str:
+    """Strip markdown and preamble from the model output and check it is a single SELECT"""
+    sql = sql.strip()
+    
+    # Log the raw response for debugging
+    logger.debug(f"Raw SQL response ({len(sql)} chars): {sql[:1000]}")
+    
+    # Clean up the SQL (remove markdown formatting if present)
+    if sql.startswith("```sql"):
+        sql = sql.replace("```sql", "").replace("```", "").strip()
+    elif sql.startswith("```"):
+        sql = sql.replace("```", "").strip()
+    
+    # Extract SQL if there's explanatory text before it
+    if "SELECT" in sql.upper() and not sql.upper().startswith("SELECT"):
+        # Find the SELECT statement
+        lines = sql.split('\n')
+        for i, line in enumerate(lines):
+            if line.strip().upper().startswith("SELECT"):
+                sql = '\n'.join(lines[i:])
+                break
+    
+    sql = sql.strip()
+    logger.info(f"Cleaned SQL: {sql}")
+    
+    # Basic validation
+    sql_upper = sql.upper()
+    if not sql_upper.startswith("SELECT"):
+        logger.error(f"Invalid SQL generated: {sql}")
+        raise HTTPException(status_code=400, detail=f"Generated query must be a SELECT statement. Got: {sql[:100]}")
+    
+    if any(keyword in sql_upper for keyword in ["DROP", "DELETE", "INSERT", "UPDATE", "ALTER", "CREATE"]):
+        raise HTTPException(status_code=400, detail="Only SELECT queries are allowed")
+    
+    return sql
+
+def fail_generation(future: asyncio.Future, error: BaseException):
+    """Pass a failed generation to coalesced waiters; a cancelled or disconnected caller becomes a 500 for them"""
+    if not isinstance(error, HTTPException):
+        error = HTTPException(status_code=500, detail="SQL generation was cancelled")
+    future.set_exception(error)
+    future.exception()  # Mark retrieved when nobody else was waiting
+
+async def generate_sql(question: str) -> Dict[str, Any]:
+    """Generate SQL query from natural language using Ollama"""
+    
+    rule = match_intent(question)
+    if rule:
+        logger.info(f"Rule match ({rule['intent']}): {question}")
+        return rule
+    
+    cached_sql, cache_tier, embedding = await lookup_cached_sql(question)
+    if cached_sql:
+        logger.info(f"SQL cache hit ({cache_tier}): {question}")
+        return {"sql": cached_sql, "model_used": OLLAMA_MODEL, "cache": cache_tier, "path": "sql_cache"}
+    
+    # Identical questions already being generated share that generation
+    key = normalize_question(question)
+    if key in inflight_generations:
+        result = await asyncio.shield(inflight_generations[key])
+        return {**result, "cache": "coalesced"}
+    
+    future = asyncio.get_running_loop().create_future()
+    inflight_generations[key] = future
     try:
-        async with httpx.AsyncClient(timeout=180.0) as client:
-            response = await client.post(
-                f"{OLLAMA_URL}/api/generate",
-                json={
-                    "model": OLLAMA_MODEL,
-                    "prompt": prompt,
-                    "stream": False,
-                    "system": "You are a SQL code generator. Output only SQL queries, nothing else.",
-                    "options": {
-                        "temperature": 0.0,
-                        "top_p": 0.1,
-                        "stop": ["\n\n", "###", "---", "Note:", "Explanation:"]
-                    }
-                }
-            )
+        try:
+            async with ollama_slot():
+                with LLM_SECONDS.labels("blocking").time():
+                    response = await ollama_client.post(f"{OLLAMA_URL}/api/generate",
+                                                        json=sql_generation_request(question, stream=False))
             
             if response.status_code != 200:
                 raise HTTPException(status_code=500, detail=f"Ollama error: {response.status_code}")
             
-            result = response.json()
-            sql = result.get("response", "").strip()
-            
-            # Log the raw response for debugging
-            print(f"DEBUG: Raw SQL response length: {len(sql)}")
-            print(f"DEBUG: Raw SQL first 1000 chars: {sql[:1000]}")
-            logger.info(f"Raw SQL response: {sql[:500]}")
-            
-            # Clean up the SQL (remove markdown formatting if present)
-            if sql.startswith("```sql"):
-                sql = sql.replace("```sql", "").replace("```", "").strip()
-            elif sql.startswith("```"):
-                sql = sql.replace("```", "").strip()
-            
-            # Extract SQL if there's explanatory text before it
-            if "SELECT" in sql.upper() and not sql.upper().startswith("SELECT"):
-                # Find the SELECT statement
-                lines = sql.split('\n')
-                for i, line in enumerate(lines):
-                    if line.strip().upper().startswith("SELECT"):
-                        sql = '\n'.join(lines[i:])
-                        break
-            
-            sql = sql.strip()
-            logger.info(f"Cleaned SQL: {sql}")
-            
-            # Basic validation
-            sql_upper = sql.upper()
-            if not sql_upper.startswith("SELECT"):
-                logger.error(f"Invalid SQL generated: {sql}")
-                raise HTTPException(status_code=400, detail=f"Generated query must be a SELECT statement. Got: {sql[:100]}")
-            
-            if any(keyword in sql_upper for keyword in ["DROP", "DELETE", "INSERT", "UPDATE", "ALTER", "CREATE"]):
-                raise HTTPException(status_code=400, detail="Only SELECT queries are allowed")
-            
-            return {"sql": sql, "model_used": OLLAMA_MODEL}
-            
-    except HTTPException:
-        # Re-raise HTTP exceptions (validation errors)
+            sql = clean_sql(response.json().get("response", ""))
+        except HTTPException:
+            # Re-raise HTTP exceptions (validation errors, queue full)
+            raise
+        except httpx.TimeoutException:
+            raise HTTPException(status_code=504, detail="Ollama request timed out")
+        except Exception as e:
+            logger.error(f"Unexpected error generating SQL: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+    except BaseException as e:
+        fail_generation(future, e)
+        raise
+    finally:
+        del inflight_generations[key]
+    
+    # Cached by remember_sql once the query has run
+    result = {"sql": sql, "model_used": OLLAMA_MODEL, "cache": "miss", "path": "llm",
+              "question_key": key, "embedding": embedding}
+    future.set_result(result)
+    return result
+
+async def stream_sql(question: str):
+    """
+    Like generate_sql, but relays the model output as it is produced.
+    Yields ("token", text) items, then one ("sql", generate_sql-style dict) once the SQL is validated.
+    """
+    rule = match_intent(question)
+    if rule:
+        logger.info(f"Rule match ({rule['intent']}): {question}")
+        yield "token", rule["sql"]
+        yield "sql", rule
+        return
+    
+    cached_sql, cache_tier, embedding = await lookup_cached_sql(question)
+    if cached_sql:
+        logger.info(f"SQL cache hit ({cache_tier}): {question}")
+        yield "token", cached_sql
+        yield "sql", {"sql": cached_sql, "model_used": OLLAMA_MODEL, "cache": cache_tier, "path": "sql_cache"}
+        return
+    
+    key = normalize_question(question)
+    if key in inflight_generations:
+        result = await asyncio.shield(inflight_generations[key])
+        yield "token", result["sql"]
+        yield "sql", {**result, "cache": "coalesced"}
+        return
+    
+    future = asyncio.get_running_loop().create_future()
+    inflight_generations[key] = future
+    raw = []
+    try:
+        try:
+            async with ollama_slot():
+                started = time.perf_counter()
+                async with ollama_client.stream("POST", f"{OLLAMA_URL}/api/generate",
+                                                json=sql_generation_request(question, stream=True)) as response:
+                    if response.status_code != 200:
+                        raise HTTPException(status_code=500, detail=f"Ollama error: {response.status_code}")
+                    async for line in response.aiter_lines():
+                        if not line:
+                            continue
+                        token = json.loads(line).get("response", "")
+                        if token:
+                            raw.append(token)
+                            yield "token", token
+                LLM_SECONDS.labels("stream").observe(time.perf_counter() - started)
+            sql = clean_sql("".join(raw))
+        except HTTPException:
+            raise
+        except httpx.TimeoutException:
+            raise HTTPException(status_code=504, detail="Ollama request timed out")
+        except Exception as e:
+            logger.error(f"Unexpected error generating SQL: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+    except BaseException as e:
+        fail_generation(future, e)
         raise
-    except httpx.TimeoutException:
-        raise HTTPException(status_code=504, detail="Ollama request timed out")
+    finally:
+        del inflight_generations[key]
+    
+    result = {"sql": sql, "model_used": OLLAMA_MODEL, "cache": "miss", "path": "llm",
+              "question_key": key, "embedding": embedding}
+    future.set_result(result)
+    yield "sql", result
+
+def apply_row_limit(sql: str, max_rows: int) -> str:
+    """Add LIMIT if not present"""
+    if "LIMIT" not in sql.upper():
+        sql = f"{sql} LIMIT {max_rows}"
+    return sql
+
+def result_explanation(row_count: int, max_rows: int) -> str:
+    explanation = f"Found {row_count} result(s)"
+    if row_count == max_rows:
+        explanation += f" (limited to {max_rows})"
+    return explanation
+
+def arrow_response(question: str, sql: str, path: str, table: pa.Table) -> Response:
+    """Arrow IPC stream body; question, SQL and path travel in the schema metadata"""
+    table = table.replace_schema_metadata({"question": question, "sql": sql, "path": path})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return Response(content=sink.getvalue().to_pybytes(), media_type="application/vnd.apache.arrow.stream",
+                    headers={"X-Row-Count": str(table.num_rows), "X-Query-Path": path})
+
+async def stream_query_response(question: str, sql: str, sql_result: Dict[str, Any], max_rows: int):
+    """NDJSON body for /query with stream=true; rows go out block by block as ClickHouse returns them"""
+    yield json.dumps({"question": question, "sql": sql, "path": sql_result["path"]}) + "\n"
+    row_count = 0
+    started = time.perf_counter()
+    try:
+        async for columns, block in stream_query_blocks(sql):
+            row_count += len(block)
+            with SERIALIZE_SECONDS.labels("ndjson").time():
+                body = "".join(json.dumps({"row": dict(zip(columns, row))}, default=json_default) + "\n"
+                               for row in block)
+            yield body
+        SQL_SECONDS.labels("ndjson").observe(time.perf_counter() - started)
     except Exception as e:
-        logger.error(f"Unexpected error generating SQL: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+        logger.error(f"Error streaming query: {str(e)}")
+        forget_sql(sql_result)
+        yield json.dumps({"error": f"Error executing query: {str(e)}"}) + "\n"
+        return
+    remember_sql(sql_result)
+    yield json.dumps({"row_count": row_count, "explanation": result_explanation(row_count, max_rows)}) + "\n"
 
 @app.post("/query", response_model=QueryResponse)
 async def query(request: QueryRequest):
     """
     Main endpoint: Convert natural language question to SQL and execute
     """
+    started = time.perf_counter()
+    if request.stream and request.format != "json_rows":
+        raise HTTPException(status_code=400, detail="stream=true only supports format=json_rows")
+    sql_result = None
     try:
         # Generate SQL from natural language
         logger.info(f"Question: {request.question}")
@@ -222,49 +1061,194 @@ async def query(request: QueryRequest):
         sql = sql_result["sql"]
         logger.info(f"Generated SQL: {sql}")
         
-        # Execute query on ClickHouse
-        client = clickhouse_connect.get_client(
-            host=CLICKHOUSE_HOST,
-            port=CLICKHOUSE_PORT,
-            username=CLICKHOUSE_USER,
-            password=CLICKHOUSE_PASSWORD
-        )
+        sql = apply_row_limit(sql, request.max_rows)
         
-        # Add LIMIT if not present
-        if "LIMIT" not in sql.upper():
-            sql = f"{sql} LIMIT {request.max_rows}"
+        if request.stream:
+            await check_query_cost(sql)
+            return StreamingResponse(stream_query_response(request.question, sql, sql_result, request.max_rows),
+                                     media_type="application/x-ndjson")
         
-        result = client.query(sql)
+        if request.format == "arrow":
+            await check_query_cost(sql)
+            with SQL_SECONDS.labels("arrow").time():
+                table = await execute_arrow_query(sql)
+            remember_sql(sql_result)
+            with SERIALIZE_SECONDS.labels("arrow").time():
+                response = arrow_response(request.question, sql, sql_result["path"], table)
+            REQUEST_SECONDS.labels(sql_result["path"]).observe(time.perf_counter() - started)
+            return response
         
-        # Format results
-        columns = result.column_names
-        rows = result.result_rows
+        # Execute query on ClickHouse (or reuse the result of an identical query on the same scan data)
+        columns, rows, cached = await execute_cached_query(sql)
+        remember_sql(sql_result)
         
-        results = []
-        for row in rows:
-            results.append(dict(zip(columns, row)))
+        # Format results
+        serialize_started = time.perf_counter()
+        if request.format == "json_columns":
+            values = list(zip(*rows)) if rows else [()] * len(columns)
+            results = {column: list(column_values) for column, column_values in zip(columns, values)}
+        else:
+            results = []
+            for row in rows:
+                results.append(dict(zip(columns, row)))
+        SERIALIZE_SECONDS.labels(request.format).observe(time.perf_counter() - serialize_started)
         
         # Generate explanation
-        explanation = f"Found {len(results)} result(s)"
-        if len(results) == request.max_rows:
-            explanation += f" (limited to {request.max_rows})"
-        
-        client.close()
+        explanation = result_explanation(len(rows), request.max_rows)
+        if cached:
+            explanation += " (cached result)"
         
+        REQUEST_SECONDS.labels(sql_result["path"]).observe(time.perf_counter() - started)
         return QueryResponse(
             question=request.question,
             sql=sql,
             results=results,
-            row_count=len(results),
-            explanation=explanation
+            row_count=len(rows),
+            explanation=explanation,
+            path=sql_result["path"]
         )
         
     except HTTPException:
+        # Generation errors leave sql_result unset; cost rejections drop the cached SQL
+        forget_sql(sql_result)
         raise
     except Exception as e:
         logger.error(f"Error executing query: {str(e)}")
+        forget_sql(sql_result)
+        if any(code in str(e) for code in LIMIT_ERRORS):
+            raise HTTPException(status_code=400, detail=f"Query stopped by resource limits: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error executing query: {str(e)}")
 
+async def answer_indexed(index: int, question: str, max_rows: int, slots: asyncio.Semaphore) -> Dict[str, Any]:
+    """One /query/batch answer, with failures reported in place of raising"""
+    try:
+        if match_intent(question):
+            # Rule answers never touch Ollama, so they don't wait behind the batch's LLM questions
+            result = await query(QueryRequest(question=question, max_rows=max_rows))
+        else:
+            async with slots:
+                result = await query(QueryRequest(question=question, max_rows=max_rows))
+        return {"index": index, **jsonable_encoder(result)}
+    except HTTPException as e:
+        return {"index": index, "question": question, "error": e.detail, "status_code": e.status_code}
+
+async def stream_batch_response(questions: list, max_rows: int):
+    """NDJSON body for /query/batch: one line per question as soon as it finishes, then a summary line"""
+    slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+    tasks = [asyncio.create_task(answer_indexed(i, q, max_rows, slots)) for i, q in enumerate(questions)]
+    failed = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            answer = await next_done
+            failed += "error" in answer
+            yield json.dumps(answer, default=json_default) + "\n"
+    finally:
+        # The client went away: stop generating and querying for it
+        for task in tasks:
+            task.cancel()
+    yield json.dumps({"completed": len(questions) - failed, "failed": failed}) + "\n"
+
+@app.post("/query/batch")
+async def query_batch(request: BatchQueryRequest):
+    """
+    Answer several questions in one call. SQL generation runs concurrently under the Ollama
+    admission limit and queries run in parallel on the ClickHouse pool; answers stream back
+    as NDJSON in completion order, each tagged with its index in the request.
+    """
+    if not request.questions:
+        raise HTTPException(status_code=400, detail="No questions given")
+    if len(request.questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_QUESTIONS} questions per batch")
+    return StreamingResponse(stream_batch_response(request.questions, request.max_rows),
+                             media_type="application/x-ndjson")
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics"""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/cache")
+async def cache_stats():
+    """Generated-SQL and query-result cache hit/miss counts"""
+    return {"sql": sql_cache.stats(), "results": result_cache.stats()}
+
+@app.delete("/cache")
+async def clear_cache():
+    """Drop every cached question and result"""
+    sql_cache.clear()
+    invalidate_results()
+    return {"sql": sql_cache.stats(), "results": result_cache.stats()}
+
+@app.post("/cache/invalidate")
+async def invalidate_cache():
+    """Drop cached results after an import (import_data.py --notify calls this)"""
+    invalidate_results()
+    return {"results": result_cache.stats()}
+
+@app.get("/duplicates")
+async def duplicates(limit: int = Query(50, ge=1, le=DUPLICATES_MAX_PAGE), offset: int = Query(0, ge=0),
+                     min_copies: int = Query(2, ge=2)):
+    """Duplicate sets of every share's latest scan, most reclaimable bytes first; page with offset"""
+    current = f"{LATEST_SCAN_FILTER} AND copies >= {min_copies}"
+    summary_sql = (f"SELECT count() AS groups, sum(reclaimable_bytes) AS reclaimable_bytes "
+                   f"FROM {DUPLICATE_TABLE} FINAL WHERE {current}")
+    page_sql = (f"SELECT share, scan_date, duplicate_hash, copies, file_size, total_bytes, reclaimable_bytes, "
+                f"owners, sample_paths FROM {DUPLICATE_TABLE} FINAL WHERE {current} "
+                f"ORDER BY reclaimable_bytes DESC, share, duplicate_hash LIMIT {limit} OFFSET {offset}")
+    try:
+        (_, summary, _), (columns, rows, _) = await asyncio.gather(execute_cached_query(summary_sql),
+                                                                   execute_cached_query(page_sql))
+    except Exception as e:
+        logger.error(f"Error reading duplicate groups: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error reading duplicate groups: {str(e)}")
+    groups, reclaimable = summary[0] if summary else (0, 0)
+    return jsonable_encoder({
+        "groups": groups,
+        "reclaimable_bytes": reclaimable,
+        "offset": offset,
+        "limit": limit,
+        "results": [dict(zip(columns, row)) for row in rows]
+    })
+
+def sql_string(value: str) -> str:
+    """Quote a value as a ClickHouse string literal"""
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+TREE_SORT = {"bytes": "total_bytes DESC", "files": "file_count DESC", "oldest": "last_modified", "name": "directory"}
+TREE_COLUMNS = ("directory, sum(files) AS file_count, sum(bytes) AS total_bytes, max(last_modified) AS last_modified, "
+                "sumForEach(arrayMap(b -> if(age_bucket = b, files, 0), range(7))) AS files_by_age")
+AGE_BUCKET_LABELS = ["0-30 days", "30-90 days", "90-180 days", "6-12 months", "1-2 years", "2-3 years", "3+ years"]
+
+@app.get("/tree")
+async def tree(path: str = "/", sort: Literal["bytes", "files", "oldest", "name"] = "bytes",
+               limit: int = Query(100, ge=1, le=TREE_MAX_CHILDREN)):
+    """
+    Recursive size, file count and modification-age histogram of a directory and its
+    subdirectories in the latest full scan of each share. Paths use / separators, e.g. /share/Finance/
+    """
+    parts = [part for part in path.split("/") if part]
+    directory = "/" + "".join(f"{part}/" for part in parts)
+    parent = "" if not parts else "/" + "".join(f"{part}/" for part in parts[:-1])
+    node_sql = (f"SELECT {TREE_COLUMNS} FROM {TREE_TABLE} WHERE {LATEST_SCAN_FILTER} "
+                f"AND parent_path = {sql_string(parent)} AND directory = {sql_string(directory)} GROUP BY directory")
+    children_sql = (f"SELECT {TREE_COLUMNS} FROM {TREE_TABLE} WHERE {LATEST_SCAN_FILTER} "
+                    f"AND parent_path = {sql_string(directory)} GROUP BY directory "
+                    f"ORDER BY {TREE_SORT[sort]} LIMIT {limit}")
+    try:
+        (columns, node, _), (_, children, _) = await asyncio.gather(execute_cached_query(node_sql),
+                                                                    execute_cached_query(children_sql))
+    except Exception as e:
+        logger.error(f"Error reading directory tree: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error reading directory tree: {str(e)}")
+    if not node:
+        raise HTTPException(status_code=404, detail=f"No files under {directory}")
+    return jsonable_encoder({
+        **dict(zip(columns, node[0])),
+        "depth": len(parts),
+        "age_buckets": AGE_BUCKET_LABELS,
+        "children": [dict(zip(columns, row)) for row in children]
+    })
+
 @app.get("/schema")
 async def get_schema():
     """Return database schema information"""
@@ -297,6 +1281,74 @@ class ChatCompletionRequest(BaseModel):
     messages: list[ChatMessage]
     stream: Optional[bool] = False
 
+def chat_chunk(completion_id: str, model: str, delta: Dict[str, str], finish_reason: Optional[str] = None) -> str:
+    """One OpenAI chat.completion.chunk as an SSE event"""
+    return "data: " + json.dumps({
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "delta": delta,
+            "finish_reason": finish_reason
+        }]
+    }) + "\n\n"
+
+async def stream_chat_completion(question: str, model: str):
+    """
+    SSE body for stream=true: the SQL is relayed token by token while Ollama writes it,
+    then result rows are formatted as they arrive from ClickHouse
+    """
+    completion_id = "chatcmpl-pan-" + str(hash(question))
+    max_rows = 50
+    
+    def chunk(content: str) -> str:
+        return chat_chunk(completion_id, model, {"content": content})
+    
+    yield chat_chunk(completion_id, model, {"role": "assistant", "content": ""})
+    yield chunk("I queried the file share database for you.\n\n**SQL Query Generated:**\n```sql\n")
+    in_sql_block = True
+    sql_result = None
+    try:
+        async for kind, value in stream_sql(question):
+            if kind == "token":
+                yield chunk(value)
+            else:
+                sql_result = value
+                sql = apply_row_limit(value["sql"], max_rows)
+        yield chunk("\n```\n\n**Results:**\n\n")
+        in_sql_block = False
+        await check_query_cost(sql)
+        
+        row_count = 0
+        async for columns, block in stream_query_blocks(sql):
+            lines = []
+            for row in block:
+                row_count += 1
+                if row_count <= 10:
+                    # Format first few results as a readable list
+                    lines.append(f"{row_count}. " + ", ".join(f"{k}: {v}" for k, v in zip(columns, row)) + "\n")
+            if lines:
+                yield chunk("".join(lines))
+        
+        if row_count == 0:
+            yield chunk("_No results found_")
+        elif row_count > 10:
+            yield chunk(f"\n_(Showing 10 of {row_count} results)_")
+        yield chunk(f"\n\n{result_explanation(row_count, max_rows)}")
+        remember_sql(sql_result)
+    except HTTPException as e:
+        forget_sql(sql_result)
+        yield chunk(("\n```" if in_sql_block else "") + f"\n\n_Error: {e.detail}_")
+    except Exception as e:
+        logger.error(f"Chat completion error: {str(e)}")
+        forget_sql(sql_result)
+        yield chunk(f"\n\n_Error: {str(e)}_")
+    
+    yield chat_chunk(completion_id, model, {}, finish_reason="stop")
+    yield "data: [DONE]\n\n"
+
 @app.post("/v1/chat/completions")
 async def chat_completions(request: ChatCompletionRequest):
     """
@@ -310,6 +1362,10 @@ async def chat_completions(request: ChatCompletionRequest):
         
         question = user_messages[-1].content
         
+        if request.stream:
+            return StreamingResponse(stream_chat_completion(question, request.model),
+                                     media_type="text/event-stream")
+        
         # Query the database using our AI service
         query_request = QueryRequest(question=question, max_rows=50)
         result = await query(query_request)
@@ -37,39 +37,86 @@ class Tools:
             
             data = response.json()
             
-            # Format the response
-            result = f"**Question:** {data['question']}\n\n"
-            result += f"**Generated SQL:**\n```sql\n{data['sql']}\n```\n\n"
-            result += f"**Results ({data['row_count']} rows):**\n\n"
+            return self._format_result(data)
             
-            if data['results']:
-                # Format as table
-                if len(data['results']) > 0:
-                    # Get column names
-                    cols = list(data['results'][0].keys())
-                    
-                    # Create table header
-                    result += "| " + " | ".join(cols) + " |\n"
-                    result += "| " + " | ".join(["---"] * len(cols)) + " |\n"
-                    
-                    # Add rows
-                    for row in data['results'][:20]:  # Limit display to 20 rows
-                        values = [str(row.get(col, "")) for col in cols]
-                        result += "| " + " | ".join(values) + " |\n"
-                    
-                    if len(data['results']) > 20:
-                        result += f"\n*Showing 20 of {len(data['results'])} results*\n"
-            else:
-                result += "*No results found*\n"
+        except requests.exceptions.Timeout:
+            return "⚠️ Query timed out (took longer than 3 minutes). Try a simpler query."
+        except requests.exceptions.RequestException as e:
+            return f"❌ Error connecting to query service: {str(e)}"
+        except Exception as e:
+            return f"❌ Error: {str(e)}"
+
+    def _format_result(self, data: dict) -> str:
+        """Markdown for one /query response"""
+        # Format the response
+        result = f"**Question:** {data['question']}\n\n"
+        result += f"**Generated SQL:**\n```sql\n{data['sql']}\n```\n\n"
+        result += f"**Results ({data['row_count']} rows):**\n\n"
+        
+        if data['results']:
+            # Format as table
+            if len(data['results']) > 0:
+                # Get column names
+                cols = list(data['results'][0].keys())
+                
+                # Create table header
+                result += "| " + " | ".join(cols) + " |\n"
+                result += "| " + " | ".join(["---"] * len(cols)) + " |\n"
+                
+                # Add rows
+                for row in data['results'][:20]:  # Limit display to 20 rows
+                    values = [str(row.get(col, "")) for col in cols]
+                    result += "| " + " | ".join(values) + " |\n"
+                
+                if len(data['results']) > 20:
+                    result += f"\n*Showing 20 of {len(data['results'])} results*\n"
+        else:
+            result += "*No results found*\n"
+        
+        result += f"\n_{data['explanation']}_"
+        
+        return result
+
+    def query_file_data_batch(self, questions: list[str], __user__: dict = {}) -> str:
+        """
+        Answer several related questions about the file share in one call, e.g. one per department or owner.
+        Questions are answered in parallel, so this is much faster than asking them one at a time.
+        
+        :param questions: List of natural language questions (e.g., ["How many PDF files does CORP\\alice own?", "How many PDF files does CORP\\bob own?"])
+        :return: Query results for each question as formatted text, in the order asked
+        """
+        try:
+            url = f"{self.valves.API_BASE_URL}/query/batch"
+            payload = {
+                "questions": questions,
+                "max_rows": 100
+            }
+            
+            # Answers arrive one NDJSON line at a time as each question finishes
+            answers = {}
+            with requests.post(url, json=payload, timeout=600, stream=True) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if line:
+                        data = json.loads(line)
+                        if "index" in data:
+                            answers[data["index"]] = data
             
-            result += f"\n_{data['explanation']}_"
+            sections = []
+            for i, question in enumerate(questions):
+                data = answers.get(i)
+                if data is None:
+                    sections.append(f"**Question:** {question}\n\n❌ No answer received")
+                elif "error" in data:
+                    sections.append(f"**Question:** {question}\n\n❌ {data['error']}")
+                else:
+                    sections.append(self._format_result(data))
             
-            return result
+            return "\n\n---\n\n".join(sections)
             
         except requests.exceptions.Timeout:
-            return "⚠️ Query timed out (took longer than 3 minutes). Try a simpler query."
+            return "⚠️ Batch query timed out (took longer than 10 minutes). Try fewer questions."
         except requests.exceptions.RequestException as e:
             return f"❌ Error connecting to query service: {str(e)}"
         except Exception as e:
             return f"❌ Error: {str(e)}"
-
@@ -0,0 +1,115 @@
+-- Rebuild the dashboard rollups from the rows already in file_scan
+-- The materialized views only see new inserts, so run this once after adding
+-- the rollups to a database that already holds scans:
+--   cat scripts/backfill_rollups.sql | docker exec -i pan-clickhouse clickhouse-client --password clickhouse
+-- Don't import while this runs, rows inserted meanwhile would be counted twice.
+
+USE file_share;
+
+TRUNCATE TABLE file_scan_by_bucket;
+INSERT INTO file_scan_by_bucket
+SELECT
+    scan_date,
+    share,
+    if(filename = '.', 1, 0) AS is_directory,
+    if(position(path, '$RECYCLE.BIN') > 0, 1, 0) AS in_recycle_bin,
+    multiIf(dateDiff('day', modify_date, scan_date) < 30, 0,
+            dateDiff('day', modify_date, scan_date) < 90, 1,
+            dateDiff('day', modify_date, scan_date) < 180, 2,
+            dateDiff('day', modify_date, scan_date) < 365, 3,
+            dateDiff('day', modify_date, scan_date) < 730, 4,
+            dateDiff('day', modify_date, scan_date) < 1095, 5, 6) AS age_bucket,
+    multiIf(size = 0, 0, size < 1024, 1, size < 1048576, 2, size < 10485760, 3,
+            size < 104857600, 4, size < 1073741824, 5, 6) AS size_bucket,
+    count() AS files,
+    sum(size) AS bytes
+FROM file_scan
+GROUP BY scan_date, share, is_directory, in_recycle_bin, age_bucket, size_bucket;
+
+TRUNCATE TABLE file_scan_by_owner;
+INSERT INTO file_scan_by_owner
+SELECT
+    scan_date,
+    share,
+    if(filename = '.', 1, 0) AS is_directory,
+    owner,
+    count() AS files,
+    sum(size) AS bytes
+FROM file_scan
+GROUP BY scan_date, share, is_directory, owner;
+
+TRUNCATE TABLE file_scan_by_extension;
+INSERT INTO file_scan_by_extension
+SELECT
+    scan_date,
+    share,
+    if(filename = '.', 1, 0) AS is_directory,
+    extension,
+    multiIf(dateDiff('day', last_accessed_date, scan_date) < 30, 0,
+            dateDiff('day', last_accessed_date, scan_date) < 90, 1,
+            dateDiff('day', last_accessed_date, scan_date) < 180, 2,
+            dateDiff('day', last_accessed_date, scan_date) < 365, 3,
+            dateDiff('day', last_accessed_date, scan_date) < 730, 4,
+            dateDiff('day', last_accessed_date, scan_date) < 1095, 5, 6) AS access_age_bucket,
+    count() AS files,
+    sum(size) AS bytes
+FROM file_scan
+GROUP BY scan_date, share, is_directory, extension, access_age_bucket;
+
+TRUNCATE TABLE file_scan_by_acl;
+INSERT INTO file_scan_by_acl
+SELECT
+    scan_date,
+    share,
+    if(filename = '.', 1, 0) AS is_directory,
+    acl_id,
+    count() AS files,
+    sum(size) AS bytes
+FROM file_scan
+GROUP BY scan_date, share, is_directory, acl_id;
+
+TRUNCATE TABLE file_scan_by_directory;
+INSERT INTO file_scan_by_directory
+SELECT
+    scan_date,
+    share,
+    if(depth <= 1, if(depth = 0, '', '/'),
+       concat('/', arrayStringConcat(arraySlice(parts, 1, depth - 1), '/'), '/')) AS parent_path,
+    depth,
+    if(depth = 0, '/', concat('/', arrayStringConcat(arraySlice(parts, 1, depth), '/'), '/')) AS directory,
+    age_bucket,
+    count() AS files,
+    sum(size) AS bytes,
+    max(modify_date) AS last_modified
+FROM (
+    SELECT
+        scan_date,
+        share,
+        size,
+        modify_date,
+        multiIf(dateDiff('day', modify_date, scan_date) < 30, 0,
+                dateDiff('day', modify_date, scan_date) < 90, 1,
+                dateDiff('day', modify_date, scan_date) < 180, 2,
+                dateDiff('day', modify_date, scan_date) < 365, 3,
+                dateDiff('day', modify_date, scan_date) < 730, 4,
+                dateDiff('day', modify_date, scan_date) < 1095, 5, 6) AS age_bucket,
+        arrayFilter(x -> x != '', splitByChar('/', path)) AS parts
+    FROM file_scan
+    WHERE filename != '.'
+)
+ARRAY JOIN range(toUInt16(length(parts) + 1)) AS depth
+GROUP BY scan_date, share, parent_path, depth, directory, age_bucket;
+
+TRUNCATE TABLE owner_dim;
+INSERT INTO owner_dim
+SELECT DISTINCT
+    toString(owner) AS owner,
+    splitByChar('\\', owner)[1] AS domain,
+    multiIf(owner = '', 'Unknown',
+            owner LIKE 'S-1-%', 'Orphaned (SID)',
+            owner LIKE 'BUILTIN%', 'System (BUILTIN)',
+            owner LIKE 'NT AUTHORITY%', 'System (NT AUTHORITY)',
+            owner LIKE '%-adm', 'Admin Account', 'Regular User') AS owner_type
+FROM file_scan;
+
+SYSTEM RELOAD DICTIONARY owner_dict;
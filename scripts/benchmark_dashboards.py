@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Benchmark the Grafana dashboard queries on synthetic Symphony scans
+Loads each scale into a scratch database built from create_schema.sql, runs
+every panel's rawSql concurrently and reads latency, rows, bytes and memory
+from system.query_log; --compare checks a run against an earlier report
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import clickhouse_connect
+
+import import_data
+from generate_scan import generate
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DASHBOARD_DIR = os.path.join(SCRIPT_DIR, '..', 'docker', 'grafana', 'provisioning', 'dashboards', 'json')
+SCHEMA_FILE = os.path.join(SCRIPT_DIR, 'create_schema.sql')
+BENCH_DATABASE = 'file_share_bench'  # Scratch database; the dashboards' file_share references are pointed here
+REGRESSION_RATIO = 1.5  # A panel regresses when p50 latency or rows read grow by more than this factor
+NOISE_FLOOR_MS = 5  # ... and its p50 grew by more than this, so sub-millisecond jitter isn't flagged
+
+def iter_panels(panels):
+    """Panels in dashboard order, including those nested in collapsed rows"""
+    for panel in panels:
+        yield panel
+        yield from iter_panels(panel.get('panels', []))
+
+def substitute_variables(sql, variables):
+    """Replace $name and ${name} with the variable's value, as Grafana does for a textbox"""
+    for name, value in variables.items():
+        sql = re.sub(r'\$\{' + re.escape(name) + r'\}|\$' + re.escape(name) + r'\b', lambda m: value, sql)
+    return sql
+
+def load_panels(dashboard_dir, database, overrides):
+    """Every rawSql target as a dict, with template variables filled in and file_share pointed at database"""
+    panels = []
+    for path in sorted(glob.glob(os.path.join(dashboard_dir, '*.json'))):
+        with open(path) as f:
+            dashboard = json.load(f)
+        variables = {v['name']: str(v.get('current', {}).get('value', v.get('query', '')))
+                     for v in dashboard.get('templating', {}).get('list', [])}
+        variables.update(overrides)
+        for panel in iter_panels(dashboard.get('panels', [])):
+            for target in panel.get('targets', []):
+                if not target.get('rawSql'):
+                    continue
+                sql = substitute_variables(target['rawSql'], variables)
+                panels.append({
+                    'dashboard': os.path.basename(path),
+                    'panel_id': panel.get('id'),
+                    'ref_id': target.get('refId', 'A'),
+                    'title': panel.get('title', ''),
+                    'sql': re.sub(r'\bfile_share\.', f'{database}.', sql),
+                })
+    return panels
+
+def panel_key(panel):
+    return f"{panel['dashboard']}#{panel['panel_id']}{panel['ref_id']}"
+
+def create_database(database):
+    """Drop and recreate database from create_schema.sql, renamed from file_share"""
+    client = import_data.get_client()
+    client.command(f'DROP DATABASE IF EXISTS {database} SYNC')
+    client.command(f'CREATE DATABASE {database}')
+    client.close()
+
+    with open(SCHEMA_FILE) as f:
+        schema = re.sub(r'\bfile_share\b', database, f.read())
+    client = clickhouse_connect.get_client(host=import_data.CLICKHOUSE_HOST, port=import_data.CLICKHOUSE_PORT,
+                                           username='default', password='clickhouse', database=database)
+    for statement in re.split(r';[ \t]*(?:\n|$)', schema):
+        body = '\n'.join(line for line in statement.splitlines() if not line.strip().startswith('--')).strip()
+        if body and not body.upper().startswith(('USE ', 'CREATE DATABASE')):
+            client.command(body)
+    client.close()
+
+def load_scale(path, database):
+    """Fresh schema, then a full import (rollups, dictionaries, duplicate groups) of one scan"""
+    create_database(database)
+    import_data.DATABASE = database
+    import_data.CSV_FILE = path
+    start = time.perf_counter()
+    import_data.import_data(columnar=import_data.pa is not None)
+    return time.perf_counter() - start
+
+def percentile(values, q):
+    """Nearest-rank percentile of a non-empty list"""
+    values = sorted(values)
+    return values[min(int(round(q * (len(values) - 1))), len(values) - 1)]
+
+def run_queries(panels, run_id, repeat, concurrency):
+    """
+    Run every panel `repeat` times from `concurrency` threads in shuffled order,
+    like several people opening dashboards at once. Each query carries a
+    log_comment of run_id and the panel key so system.query_log can be read back.
+    Returns {panel key: {'seconds': [...], 'error': str or None}}
+    """
+    local = threading.local()
+    clients = []
+    results = {panel_key(p): {'seconds': [], 'error': None} for p in panels}
+
+    def client():
+        if not hasattr(local, 'client'):
+            local.client = import_data.get_client()
+            clients.append(local.client)
+        return local.client
+
+    def run(panel, measured):
+        key = panel_key(panel)
+        comment = f'{run_id}:{key}' if measured else f'{run_id}-warmup'
+        start = time.perf_counter()
+        try:
+            client().query(panel['sql'], settings={'log_comment': comment})
+        except Exception as e:
+            results[key]['error'] = str(e).strip().splitlines()[0][:300]
+            return
+        if measured:
+            results[key]['seconds'].append(time.perf_counter() - start)
+
+    # One unmeasured pass loads dictionaries and warms the mark and page caches
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda p: run(p, False), panels))
+
+    work = [p for p in panels for _ in range(repeat)]
+    random.Random(0).shuffle(work)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda p: run(p, True), work))
+
+    for c in clients:
+        c.close()
+    return results
+
+def read_query_log(client, run_id):
+    """Server-side statistics per panel from system.query_log"""
+    client.command('SYSTEM FLUSH LOGS')
+    rows = client.query("""
+        SELECT
+            substring(log_comment, length({run_id:String}) + 2) AS key,
+            quantiles(0.5, 0.9, 0.99)(query_duration_ms) AS latency_ms,
+            avg(read_rows) AS read_rows,
+            avg(read_bytes) AS read_bytes,
+            max(memory_usage) AS memory_bytes
+        FROM system.query_log
+        WHERE event_date >= yesterday() AND type = 'QueryFinish' AND startsWith(log_comment, {prefix:String})
+        GROUP BY key""", parameters={'run_id': run_id, 'prefix': f'{run_id}:'}).result_rows
+    return {key: {'p50_ms': latency[0], 'p90_ms': latency[1], 'p99_ms': latency[2],
+                  'read_rows': int(read_rows), 'read_bytes': int(read_bytes), 'memory_bytes': int(memory)}
+            for key, latency, read_rows, read_bytes, memory in rows}
+
+def benchmark(panels, database, repeat, concurrency):
+    """Run the panels once against the loaded database and merge client and server timings"""
+    client = import_data.get_client()
+    file_scan_rows = client.query(f'SELECT count() FROM {database}.{import_data.TABLE}').result_rows[0][0]
+    run_id = uuid.uuid4().hex
+    start = time.perf_counter()
+    timings = run_queries(panels, run_id, repeat, concurrency)
+    wall_seconds = time.perf_counter() - start
+    server = read_query_log(client, run_id)
+    client.close()
+
+    results = []
+    for panel in panels:
+        key = panel_key(panel)
+        seconds = timings[key]['seconds']
+        result = {'key': key, 'dashboard': panel['dashboard'], 'panel_id': panel['panel_id'], 'title': panel['title'],
+                  'runs': len(seconds), 'error': timings[key]['error']}
+        if seconds:
+            result['client_p50_ms'] = percentile(seconds, 0.5) * 1000
+            result['client_p99_ms'] = percentile(seconds, 0.99) * 1000
+        result.update(server.get(key, {}))
+        results.append(result)
+    return {'file_scan_rows': file_scan_rows, 'wall_seconds': wall_seconds,
+            'queries_per_sec': len(panels) * repeat / wall_seconds if wall_seconds > 0 else 0, 'panels': results}
+
+def print_scale(scale):
+    """Per-dashboard totals and the slowest panels of one scale"""
+    print(f"\n{scale['file_scan_rows']:,} rows: {scale['queries_per_sec']:.1f} queries/sec")
+    dashboards = {}
+    for panel in scale['panels']:
+        totals = dashboards.setdefault(panel['dashboard'], {'p50_ms': 0.0, 'read_rows': 0, 'errors': 0})
+        totals['p50_ms'] += panel.get('p50_ms', 0)
+        totals['read_rows'] += panel.get('read_rows', 0)
+        totals['errors'] += panel['error'] is not None
+    for name, totals in sorted(dashboards.items()):
+        print(f"  {name:<32} sum p50 {totals['p50_ms']:>8.0f} ms  read {totals['read_rows']:>14,} rows"
+              + (f"  {totals['errors']} failing" if totals['errors'] else ''))
+    print("  Slowest panels (p50 / p99):")
+    for panel in sorted(scale['panels'], key=lambda p: p.get('p50_ms', 0), reverse=True)[:5]:
+        print(f"    {panel.get('p50_ms', 0):>7.0f} / {panel.get('p99_ms', 0):>7.0f} ms  {panel['key']}  {panel['title']}")
+    for panel in scale['panels']:
+        if panel['error']:
+            print(f"  Error in {panel['key']} ({panel['title']}): {panel['error']}")
+
+def compare(report, baseline, ratio):
+    """Print panels that got slower or read more rows than in baseline; returns the number of regressions"""
+    regressions = 0
+    baseline_scales = {scale['scale']: scale for scale in baseline['scales']}
+    for scale in report['scales']:
+        before = baseline_scales.get(scale['scale'])
+        if before is None:
+            print(f"\nScale {scale['scale']:,}: not in baseline")
+            continue
+        print(f"\nScale {scale['scale']:,} vs baseline from {baseline['generated_at']}:")
+        old = {panel['key']: panel for panel in before['panels']}
+        for panel in scale['panels']:
+            prev = old.pop(panel['key'], None)
+            if prev is None:
+                print(f"  new      {panel['key']}  {panel['title']}")
+                continue
+            if panel['error'] and not prev['error']:
+                print(f"  FAILING  {panel['key']}  {panel['error']}")
+                regressions += 1
+                continue
+            p50, prev_p50 = panel.get('p50_ms', 0), prev.get('p50_ms', 0)
+            rows, prev_rows = panel.get('read_rows', 0), prev.get('read_rows', 0)
+            slower = p50 > prev_p50 * ratio and p50 - prev_p50 > NOISE_FLOOR_MS
+            more_rows = rows > max(prev_rows, 1) * ratio
+            faster = prev_p50 > p50 * ratio and prev_p50 - p50 > NOISE_FLOOR_MS
+            if slower or more_rows:
+                regressions += 1
+                label = 'SLOWER'
+            elif faster:
+                label = 'faster'
+            else:
+                continue
+            print(f"  {label:<8} {panel['key']}  p50 {prev_p50:.0f} -> {p50:.0f} ms, "
+                  f"read {prev_rows:,} -> {rows:,} rows  {panel['title']}")
+        for key in old:
+            print(f"  removed  {key}")
+    print(f"\n{regressions} regression(s) beyond {ratio}x")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the dashboard panel queries on synthetic scans')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000_000],
+                        help='Scan sizes to load and benchmark, e.g. --rows 1000000 10000000 (default: 1000000)')
+    parser.add_argument('--no-load', action='store_true',
+                        help='Benchmark whatever --database holds instead of loading synthetic scans')
+    parser.add_argument('--database', default=BENCH_DATABASE,
+                        help=f'Database the panels run against; dropped and recreated per scale (default: {BENCH_DATABASE})')
+    parser.add_argument('--workdir', default='/tmp', help='Where generated scans are kept (default: /tmp)')
+    parser.add_argument('--dashboards', default=DASHBOARD_DIR, help='Directory of provisioned dashboard JSON')
+    parser.add_argument('--var', action='append', default=[], metavar='NAME=VALUE',
+                        help='Dashboard variable value, e.g. --var path=/share/Finance/ (default: the saved value)')
+    parser.add_argument('--host', default=import_data.CLICKHOUSE_HOST)
+    parser.add_argument('--port', type=int, default=import_data.CLICKHOUSE_PORT)
+    parser.add_argument('--repeat', type=int, default=5, help='Measured runs per panel (default: 5)')
+    parser.add_argument('--concurrency', type=int, default=8, help='Queries in flight at once (default: 8)')
+    parser.add_argument('--report', default='dashboard_benchmark.json', help='JSON report path')
+    parser.add_argument('--compare', help='Earlier report to compare with; exits 1 if any panel regressed')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_RATIO,
+                        help=f'Slowdown or rows-read factor counted as a regression (default: {REGRESSION_RATIO})')
+    args = parser.parse_args()
+
+    if args.database == import_data.DATABASE and not args.no_load:
+        parser.error(f'loading drops --database; use --no-load to benchmark {import_data.DATABASE} as it is')
+    overrides = {}
+    for item in args.var:
+        name, sep, value = item.partition('=')
+        if not sep:
+            parser.error(f'--var expects NAME=VALUE, got {item}')
+        overrides[name] = value
+
+    import_data.CLICKHOUSE_HOST = args.host
+    import_data.CLICKHOUSE_PORT = args.port
+    panels = load_panels(args.dashboards, args.database, overrides)
+    print(f"{len(panels)} panel queries in {len({p['dashboard'] for p in panels})} dashboards")
+
+    client = import_data.get_client()
+    server_version = client.server_version
+    client.close()
+
+    scales = []
+    for rows in ([None] if args.no_load else args.rows):
+        load_seconds = None
+        if rows is not None:
+            path = os.path.join(args.workdir, f'synthetic_scan_{rows}.csv')
+            if not os.path.exists(path):
+                print(f"Generating {rows:,} rows -> {path}")
+                generate(path, rows)
+            print(f"Loading {path} into {args.database}")
+            load_seconds = load_scale(path, args.database)
+
+        scale = benchmark(panels, args.database, args.repeat, args.concurrency)
+        scale['scale'] = rows if rows is not None else scale['file_scan_rows']
+        scale['load_seconds'] = load_seconds
+        scales.append(scale)
+        print_scale(scale)
+
+    report = {
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'host': platform.node(),
+        'clickhouse_version': server_version,
+        'database': args.database,
+        'repeat': args.repeat,
+        'concurrency': args.concurrency,
+        'scales': scales,
+    }
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport written to {args.report}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
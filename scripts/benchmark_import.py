@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Benchmark the CSV importer on synthetic Symphony scans
+Times the parse, batch-build and insert stages separately for each import
+path and writes a JSON report
+"""
+
+import argparse
+import csv
+import json
+import os
+import platform
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+
+import import_data
+from generate_scan import generate
+
+BENCH_TABLE = 'file_scan_bench'  # Scratch copy of file_scan so benchmarks never touch real data
+BENCH_ACL_TABLE = 'acl_dim_bench'  # Scratch copy of acl_dim for the synthetic ACLs
+MODES = ['tuple', 'columnar', 'parallel']
+
+def bench_tuple(path, sink):
+    """Row path: csv.DictReader (parse), parse_row into tuples (build), client.insert (insert)"""
+    stats = {'parse_seconds': 0.0, 'build_seconds': 0.0, 'insert_seconds': 0.0, 'rows': 0}
+
+    with import_data.open_scan(path) as f:
+        for _ in range(import_data.PREAMBLE_LINES):
+            f.readline()
+        reader = csv.DictReader(import_data.read_lines(f, [0]), fieldnames=import_data.FIELDNAMES)
+
+        while True:
+            t0 = time.perf_counter()
+            rows = list(islice(reader, import_data.BATCH_SIZE))
+            if not rows:
+                break
+            t1 = time.perf_counter()
+            batch = [import_data.parse_row(row) for row in rows]
+            t2 = time.perf_counter()
+            if sink is not None:
+                import_data.insert_batch(sink, batch)
+            stats['parse_seconds'] += t1 - t0
+            stats['build_seconds'] += t2 - t1
+            stats['insert_seconds'] += time.perf_counter() - t2
+            stats['rows'] += len(batch)
+
+    return stats
+
+def bench_columnar(path, sink):
+    """Arrow path: CSV block read (parse), build_arrow_table (build), insert_arrow (insert)"""
+    pa, pa_csv = import_data.pa, import_data.pa_csv
+    if pa is None:
+        raise RuntimeError("columnar mode requires pyarrow (pip install pyarrow)")
+
+    stats = {'parse_seconds': 0.0, 'build_seconds': 0.0, 'insert_seconds': 0.0, 'rows': 0}
+    reader = pa_csv.open_csv(
+        import_data.open_scan(path),
+        read_options=pa_csv.ReadOptions(skip_rows=import_data.PREAMBLE_LINES,
+                                        column_names=import_data.FIELDNAMES,
+                                        block_size=import_data.ARROW_BLOCK_BYTES),
+        convert_options=pa_csv.ConvertOptions(column_types={name: pa.string() for name in import_data.FIELDNAMES},
+                                              strings_can_be_null=False))
+
+    pending = []
+    pending_rows = 0
+
+    def flush():
+        t0 = time.perf_counter()
+        table = import_data.build_arrow_table(pa.Table.from_batches(pending), sink)
+        t1 = time.perf_counter()
+        if sink is not None:
+            sink.insert_arrow(f'{import_data.DATABASE}.{import_data.TABLE}', table)
+        stats['build_seconds'] += t1 - t0
+        stats['insert_seconds'] += time.perf_counter() - t1
+        stats['rows'] += table.num_rows
+
+    while True:
+        t0 = time.perf_counter()
+        try:
+            batch = reader.read_next_batch()
+        except StopIteration:
+            break
+        stats['parse_seconds'] += time.perf_counter() - t0
+        pending.append(batch)
+        pending_rows += batch.num_rows
+        if pending_rows >= import_data.BATCH_SIZE:
+            flush()
+            pending = []
+            pending_rows = 0
+    if pending_rows:
+        flush()
+
+    return stats
+
+def bench_parallel(path, workers):
+    """Process-pool path; parse includes batch building, times are summed across workers"""
+    import_data.CSV_FILE = path
+    rows, _, stats = import_data.import_parallel(workers)
+    return {'parse_seconds': stats['parse_seconds'], 'build_seconds': 0.0,
+            'insert_seconds': stats['insert_seconds'], 'rows': rows}
+
+def run_case(path, mode, sink_name, workers, host, port, batch_size):
+    """Run one benchmark case; executed in a fresh process so peak memory is per case"""
+    import_data.CLICKHOUSE_HOST = host
+    import_data.CLICKHOUSE_PORT = port
+    import_data.BATCH_SIZE = batch_size
+    import_data.TABLE = BENCH_TABLE
+    import_data.ACL_TABLE = BENCH_ACL_TABLE
+    import_data.INDEX_DIR = tempfile.gettempdir()  # Keep the parallel path's index away from real shares' indexes
+    sink = import_data.get_client() if sink_name == 'clickhouse' else None
+    if sink is not None:
+        sink.command(f'TRUNCATE TABLE {import_data.DATABASE}.{BENCH_TABLE}')
+        sink.command(f'TRUNCATE TABLE {import_data.DATABASE}.{BENCH_ACL_TABLE}')
+
+    start = time.perf_counter()
+    if mode == 'tuple':
+        stats = bench_tuple(path, sink)
+    elif mode == 'columnar':
+        stats = bench_columnar(path, sink)
+    else:
+        stats = bench_parallel(path, workers)
+    stats['total_seconds'] = time.perf_counter() - start
+    stats['rows_per_sec'] = stats['rows'] / stats['total_seconds'] if stats['total_seconds'] > 0 else 0
+    stats['peak_memory_mb'] = import_data.peak_memory_mb()
+
+    if sink is not None:
+        sink.close()
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark import_data.py on synthetic scans')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000_000],
+                        help='Scan sizes to generate, e.g. --rows 1000000 10000000 50000000 (default: 1000000)')
+    parser.add_argument('--scan', help='Benchmark an existing scan file instead of generating one')
+    parser.add_argument('--workdir', default='/tmp', help='Where generated scans are kept (default: /tmp)')
+    parser.add_argument('--modes', nargs='+', default=['tuple', 'columnar'], choices=MODES,
+                        help='Import paths to time (default: tuple columnar)')
+    parser.add_argument('--sink', choices=['stub', 'clickhouse'], default='stub',
+                        help='stub discards batches; clickhouse inserts into a scratch table (default: stub)')
+    parser.add_argument('--host', default=import_data.CLICKHOUSE_HOST)
+    parser.add_argument('--port', type=int, default=import_data.CLICKHOUSE_PORT)
+    parser.add_argument('--batch-size', type=int, default=import_data.BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Processes for parallel mode')
+    parser.add_argument('--report', default='import_benchmark.json', help='JSON report path')
+    args = parser.parse_args()
+
+    if 'parallel' in args.modes and args.sink != 'clickhouse':
+        parser.error('parallel mode opens its own insert connections; use --sink clickhouse')
+
+    import_data.CLICKHOUSE_HOST = args.host
+    import_data.CLICKHOUSE_PORT = args.port
+    import_data.BATCH_SIZE = args.batch_size
+
+    if args.sink == 'clickhouse':
+        client = import_data.get_client()
+        client.command(f'CREATE TABLE IF NOT EXISTS {import_data.DATABASE}.{BENCH_TABLE} '
+                       f'AS {import_data.DATABASE}.{import_data.TABLE}')
+        client.command(f'CREATE TABLE IF NOT EXISTS {import_data.DATABASE}.{BENCH_ACL_TABLE} '
+                       f'AS {import_data.DATABASE}.{import_data.ACL_TABLE}')
+        client.close()
+
+    scans = []
+    if args.scan:
+        scans.append((args.scan, None))
+    else:
+        for rows in args.rows:
+            path = os.path.join(args.workdir, f'synthetic_scan_{rows}.csv')
+            if not os.path.exists(path):
+                print(f"Generating {rows:,} rows -> {path}")
+                generate(path, rows)
+            scans.append((path, rows))
+
+    results = []
+    for path, rows in scans:
+        for mode in args.modes:
+            # Fresh process per case so ru_maxrss reflects only this case
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                stats = pool.submit(run_case, path, mode, args.sink, args.workers,
+                                    args.host, args.port, args.batch_size).result()
+            stats.update({'scan': path, 'file_bytes': os.path.getsize(path), 'mode': mode, 'sink': args.sink})
+            results.append(stats)
+            print(f"{os.path.basename(path)} {mode:>8}: {stats['rows']:,} rows in {stats['total_seconds']:.1f}s "
+                  f"({stats['rows_per_sec']:.0f} rows/sec) parse {stats['parse_seconds']:.1f}s "
+                  f"build {stats['build_seconds']:.1f}s insert {stats['insert_seconds']:.1f}s "
+                  f"peak {stats['peak_memory_mb']:.0f} MB")
+
+    if args.sink == 'clickhouse':
+        client = import_data.get_client()
+        client.command(f'DROP TABLE IF EXISTS {import_data.DATABASE}.{BENCH_TABLE}')
+        client.command(f'DROP TABLE IF EXISTS {import_data.DATABASE}.{BENCH_ACL_TABLE}')
+        client.close()
+
+    report = {
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'batch_size': args.batch_size,
+        'results': results,
+    }
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport written to {args.report}")
+
+if __name__ == '__main__':
+    main()
@@ -5,36 +5,71 @@ CREATE DATABASE IF NOT EXISTS file_share;
 
 USE file_share;
 
+-- ACL dictionary: each distinct ACL string is stored once here, and file_scan keeps only its id
+-- The id is cityHash64 of the ACL text, so concurrent imports derive the same id for the same ACL.
+-- The access flags are parsed once per ACL rather than once per file.
+CREATE TABLE IF NOT EXISTS acl_dim (
+    acl_id UInt64 DEFAULT cityHash64(acl),
+    acl String,
+    ace_count UInt16 MATERIALIZED if(acl = '', 0, length(splitByChar(';', acl))),
+    -- Granted to Everyone or Authenticated Users, i.e. readable by any account
+    everyone_access UInt8 MATERIALIZED multiSearchAny(acl, ['Everyone', 'Authenticated Users']),
+    -- Holds an unresolved domain SID, i.e. an entry for a deleted account
+    has_orphaned_sid UInt8 MATERIALIZED match(acl, 'S-1-5-21-[0-9]+-[0-9]+-[0-9]+-[0-9]+')
+) ENGINE = ReplacingMergeTree()
+ORDER BY acl_id;
+
+CREATE DICTIONARY IF NOT EXISTS acl_dict (
+    acl_id UInt64,
+    acl String,
+    ace_count UInt16,
+    everyone_access UInt8,
+    has_orphaned_sid UInt8
+) PRIMARY KEY acl_id
+SOURCE(CLICKHOUSE(DB 'file_share' TABLE 'acl_dim' USER 'default' PASSWORD 'clickhouse'))
+LAYOUT(HASHED())
+LIFETIME(MIN 60 MAX 300);
+
 CREATE TABLE IF NOT EXISTS file_scan (
     -- Raw fields from CSV
-    path String,
-    filename String,
+    path String CODEC(ZSTD(3)),
+    filename String CODEC(ZSTD(3)),
     extension LowCardinality(String),
-    size UInt64,
+    size UInt64 CODEC(T64, ZSTD(1)),
     migrated UInt8,
-    creation_date DateTime,
-    modify_date DateTime,
-    last_accessed_date DateTime,
-    owner String,
-    acl String,
-    duplicate_hash String,
+    creation_date DateTime CODEC(Delta, ZSTD(1)),
+    modify_date DateTime CODEC(Delta, ZSTD(1)),
+    last_accessed_date DateTime CODEC(Delta, ZSTD(1)),
+    owner LowCardinality(String),
+    acl_id UInt64 CODEC(ZSTD(1)),  -- ACL text and flags are in acl_dim / acl_dict
+    duplicate_hash String CODEC(ZSTD(1)),
     
     -- Metadata
     scan_date Date DEFAULT today(),
+    share LowCardinality(String) DEFAULT '',  -- From the scan's Source: line, e.g. \\fileserver01\share
     
-    -- Computed fields (ALIAS = computed on read, no storage cost)
-    domain String ALIAS splitByChar('\\', owner)[1],
-    username String ALIAS splitByChar('\\', owner)[2],
+    -- Computed fields (MATERIALIZED = computed once at insert and stored)
+    domain LowCardinality(String) MATERIALIZED splitByChar('\\', owner)[1],
+    username LowCardinality(String) MATERIALIZED splitByChar('\\', owner)[2],
+    is_empty UInt8 MATERIALIZED if(size = 0, 1, 0),
+    is_directory UInt8 MATERIALIZED if(filename = '.', 1, 0),
+    path_depth UInt16 MATERIALIZED length(splitByChar('/', path)) - 1,
+    
+    -- Computed fields (ALIAS = computed on read, since they depend on now() or a dictionary)
     days_since_modified UInt32 ALIAS dateDiff('day', modify_date, now()),
     days_since_accessed UInt32 ALIAS dateDiff('day', last_accessed_date, now()),
     file_age_days UInt32 ALIAS dateDiff('day', creation_date, now()),
-    is_empty UInt8 ALIAS if(size = 0, 1, 0),
-    is_directory UInt8 ALIAS if(filename = '.', 1, 0),
-    path_depth UInt16 ALIAS length(splitByChar('/', path)) - 1
+    acl String ALIAS dictGetString('file_share.acl_dict', 'acl', acl_id),
+    
+    -- Data-skipping indexes for the dashboard and AI query filters
+    -- (is_directory is in the sorting key, so it needs no index of its own)
+    INDEX idx_path path TYPE ngrambf_v1(3, 32768, 2, 0) GRANULARITY 1,
+    INDEX idx_extension extension TYPE set(256) GRANULARITY 4,
+    INDEX idx_duplicate_hash duplicate_hash TYPE bloom_filter(0.01) GRANULARITY 4
     
 ) ENGINE = MergeTree()
 PARTITION BY toYYYYMM(scan_date)
-ORDER BY (scan_date, owner, modify_date, size)
+ORDER BY (scan_date, is_directory, owner, modify_date)
 SETTINGS index_granularity = 8192;
 
 -- Create a view for easier querying with all computed fields visible
@@ -52,6 +87,7 @@ SELECT
     acl,
     duplicate_hash,
     scan_date,
+    share,
     -- Computed fields explicitly selected
     splitByChar('\\', owner)[1] AS domain,
     splitByChar('\\', owner)[2] AS username,
@@ -63,3 +99,271 @@ SELECT
     length(splitByChar('/', path)) - 1 AS path_depth
 FROM file_scan;
 
+-- One row per imported scan file, written by import_data.py and the ingestion service
+-- A --delta import only holds the files that are new or changed since the share's previous
+-- scan (delta = 1), so it must not be read as the share's current state.
+-- Re-importing a share on the same day replaces its row.
+CREATE TABLE IF NOT EXISTS scans (
+    share LowCardinality(String),
+    scan_date Date,
+    delta UInt8,
+    source_file String,
+    rows UInt64,
+    imported_at DateTime DEFAULT now()
+) ENGINE = ReplacingMergeTree(imported_at)
+ORDER BY (share, scan_date);
+
+-- Latest full scan of every share; "current state" queries filter on
+-- (share, scan_date) IN (SELECT share, scan_date FROM file_share.latest_scans)
+CREATE OR REPLACE VIEW latest_scans AS
+SELECT share, max(scan_date) AS scan_date
+FROM scans FINAL
+WHERE delta = 0
+GROUP BY share;
+
+
+-- Pre-aggregated rollups for the Grafana dashboards
+-- Materialized views fill these on every insert into file_scan, so panels read
+-- a few thousand rows instead of scanning the whole table.
+-- Ages are measured at scan time (dateDiff against scan_date), so a rollup row
+-- never changes after it is written.
+-- Age buckets (days):  0 = <30, 1 = <90, 2 = <180, 3 = <365, 4 = <730, 5 = <1095, 6 = 1095+
+-- Size buckets:        0 = empty, 1 = <1 KB, 2 = <1 MB, 3 = <10 MB, 4 = <100 MB, 5 = <1 GB, 6 = 1 GB+
+-- Rows must still be combined with sum() ... GROUP BY, since merges are eventual.
+-- Rows are kept per share; current-state panels read the latest full scan of each share
+-- through latest_scans.
+-- To populate the rollups from existing data run scripts/backfill_rollups.sql
+
+-- Totals, age and size distributions, recycle bin
+CREATE TABLE IF NOT EXISTS file_scan_by_bucket (
+    scan_date Date,
+    share LowCardinality(String),
+    is_directory UInt8,
+    in_recycle_bin UInt8,
+    age_bucket UInt8,
+    size_bucket UInt8,
+    files SimpleAggregateFunction(sum, UInt64),
+    bytes SimpleAggregateFunction(sum, UInt64)
+) ENGINE = AggregatingMergeTree()
+PARTITION BY toYYYYMM(scan_date)
+ORDER BY (scan_date, is_directory, in_recycle_bin, age_bucket, size_bucket, share);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS file_scan_by_bucket_mv TO file_scan_by_bucket AS
+SELECT
+    scan_date,
+    share,
+    if(filename = '.', 1, 0) AS is_directory,
+    if(position(path, '$RECYCLE.BIN') > 0, 1, 0) AS in_recycle_bin,
+    multiIf(dateDiff('day', modify_date, scan_date) < 30, 0,
+            dateDiff('day', modify_date, scan_date) < 90, 1,
+            dateDiff('day', modify_date, scan_date) < 180, 2,
+            dateDiff('day', modify_date, scan_date) < 365, 3,
+            dateDiff('day', modify_date, scan_date) < 730, 4,
+            dateDiff('day', modify_date, scan_date) < 1095, 5, 6) AS age_bucket,
+    multiIf(size = 0, 0, size < 1024, 1, size < 1048576, 2, size < 10485760, 3,
+            size < 104857600, 4, size < 1073741824, 5, 6) AS size_bucket,
+    count() AS files,
+    sum(size) AS bytes
+FROM file_scan
+GROUP BY scan_date, share, is_directory, in_recycle_bin, age_bucket, size_bucket;
+
+-- Per-owner totals (owner, owner type and domain panels)
+CREATE TABLE IF NOT EXISTS file_scan_by_owner (
+    scan_date Date,
+    share LowCardinality(String),
+    is_directory UInt8,
+    owner String,
+    files SimpleAggregateFunction(sum, UInt64),
+    bytes SimpleAggregateFunction(sum, UInt64)
+) ENGINE = AggregatingMergeTree()
+PARTITION BY toYYYYMM(scan_date)
+ORDER BY (scan_date, is_directory, owner, share);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS file_scan_by_owner_mv TO file_scan_by_owner AS
+SELECT
+    scan_date,
+    share,
+    if(filename = '.', 1, 0) AS is_directory,
+    owner,
+    count() AS files,
+    sum(size) AS bytes
+FROM file_scan
+GROUP BY scan_date, share, is_directory, owner;
+
+-- Per-extension totals, split by last-access age for the stale-file panels
+CREATE TABLE IF NOT EXISTS file_scan_by_extension (
+    scan_date Date,
+    share LowCardinality(String),
+    is_directory UInt8,
+    extension LowCardinality(String),
+    access_age_bucket UInt8,
+    files SimpleAggregateFunction(sum, UInt64),
+    bytes SimpleAggregateFunction(sum, UInt64)
+) ENGINE = AggregatingMergeTree()
+PARTITION BY toYYYYMM(scan_date)
+ORDER BY (scan_date, is_directory, extension, access_age_bucket, share);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS file_scan_by_extension_mv TO file_scan_by_extension AS
+SELECT
+    scan_date,
+    share,
+    if(filename = '.', 1, 0) AS is_directory,
+    extension,
+    multiIf(dateDiff('day', last_accessed_date, scan_date) < 30, 0,
+            dateDiff('day', last_accessed_date, scan_date) < 90, 1,
+            dateDiff('day', last_accessed_date, scan_date) < 180, 2,
+            dateDiff('day', last_accessed_date, scan_date) < 365, 3,
+            dateDiff('day', last_accessed_date, scan_date) < 730, 4,
+            dateDiff('day', last_accessed_date, scan_date) < 1095, 5, 6) AS access_age_bucket,
+    count() AS files,
+    sum(size) AS bytes
+FROM file_scan
+GROUP BY scan_date, share, is_directory, extension, access_age_bucket;
+
+-- Per-ACL totals; join to acl_dict for the access flags
+CREATE TABLE IF NOT EXISTS file_scan_by_acl (
+    scan_date Date,
+    share LowCardinality(String),
+    is_directory UInt8,
+    acl_id UInt64,
+    files SimpleAggregateFunction(sum, UInt64),
+    bytes SimpleAggregateFunction(sum, UInt64)
+) ENGINE = AggregatingMergeTree()
+PARTITION BY toYYYYMM(scan_date)
+ORDER BY (scan_date, is_directory, acl_id, share);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS file_scan_by_acl_mv TO file_scan_by_acl AS
+SELECT
+    scan_date,
+    share,
+    if(filename = '.', 1, 0) AS is_directory,
+    acl_id,
+    count() AS files,
+    sum(size) AS bytes
+FROM file_scan
+GROUP BY scan_date, share, is_directory, acl_id;
+
+-- Owner dictionary: every owner seen in a scan, classified once
+-- dictGet('file_share.owner_dict', 'owner_type', owner) replaces per-row LIKE/CASE classification.
+CREATE TABLE IF NOT EXISTS owner_dim (
+    owner String,
+    domain LowCardinality(String),
+    owner_type LowCardinality(String)
+) ENGINE = ReplacingMergeTree()
+ORDER BY owner;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS owner_dim_mv TO owner_dim AS
+SELECT DISTINCT
+    toString(owner) AS owner,
+    splitByChar('\\', owner)[1] AS domain,
+    multiIf(owner = '', 'Unknown',
+            owner LIKE 'S-1-%', 'Orphaned (SID)',
+            owner LIKE 'BUILTIN%', 'System (BUILTIN)',
+            owner LIKE 'NT AUTHORITY%', 'System (NT AUTHORITY)',
+            owner LIKE '%-adm', 'Admin Account', 'Regular User') AS owner_type
+FROM file_scan;
+
+CREATE DICTIONARY IF NOT EXISTS owner_dict (
+    owner String,
+    domain String,
+    owner_type String
+) PRIMARY KEY owner
+SOURCE(CLICKHOUSE(DB 'file_share' TABLE 'owner_dim' USER 'default' PASSWORD 'clickhouse'))
+LAYOUT(COMPLEX_KEY_HASHED())
+LIFETIME(MIN 60 MAX 300);
+
+-- Per-directory totals for the tree browser, recursive: every file is counted in each of
+-- its ancestor directories, so one row group answers "how big is this folder" without a
+-- LIKE prefix scan. Drill down with WHERE parent_path = '/share/Finance/'.
+-- depth 0 is the root '/', depth 1 its top-level folders. Directory entries (filename '.')
+-- are not counted, and last_modified is the newest file modification under the directory.
+CREATE TABLE IF NOT EXISTS file_scan_by_directory (
+    scan_date Date,
+    share LowCardinality(String),
+    parent_path String,
+    depth UInt16,
+    directory String,
+    age_bucket UInt8,
+    files SimpleAggregateFunction(sum, UInt64),
+    bytes SimpleAggregateFunction(sum, UInt64),
+    last_modified SimpleAggregateFunction(max, DateTime)
+) ENGINE = AggregatingMergeTree()
+PARTITION BY toYYYYMM(scan_date)
+ORDER BY (scan_date, parent_path, depth, directory, age_bucket, share);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS file_scan_by_directory_mv TO file_scan_by_directory AS
+SELECT
+    scan_date,
+    share,
+    if(depth <= 1, if(depth = 0, '', '/'),
+       concat('/', arrayStringConcat(arraySlice(parts, 1, depth - 1), '/'), '/')) AS parent_path,
+    depth,
+    if(depth = 0, '/', concat('/', arrayStringConcat(arraySlice(parts, 1, depth), '/'), '/')) AS directory,
+    age_bucket,
+    count() AS files,
+    sum(size) AS bytes,
+    max(modify_date) AS last_modified
+FROM (
+    SELECT
+        scan_date,
+        share,
+        size,
+        modify_date,
+        multiIf(dateDiff('day', modify_date, scan_date) < 30, 0,
+                dateDiff('day', modify_date, scan_date) < 90, 1,
+                dateDiff('day', modify_date, scan_date) < 180, 2,
+                dateDiff('day', modify_date, scan_date) < 365, 3,
+                dateDiff('day', modify_date, scan_date) < 730, 4,
+                dateDiff('day', modify_date, scan_date) < 1095, 5, 6) AS age_bucket,
+        arrayFilter(x -> x != '', splitByChar('/', path)) AS parts
+    FROM file_scan
+    WHERE filename != '.'
+)
+ARRAY JOIN range(toUInt16(length(parts) + 1)) AS depth
+GROUP BY scan_date, share, parent_path, depth, directory, age_bucket;
+
+-- Duplicate sets per share's scan, one row per duplicate_hash seen on more than one file of the share
+-- Built for the latest full scan of each imported share by import_data.py (or for every share on a
+-- schedule with --dedup-only), not by a materialized view: whether a hash repeats is only known once
+-- the whole scan is loaded. Read the current sets through latest_scans, as each share has its own date.
+-- Rebuilding a scan writes newer built_at versions and deletes the older ones, and
+-- ReplacingMergeTree collapses any rows left from overlapping runs. Read it with FINAL.
+-- reclaimable_bytes is what deleting every copy but the largest would free.
+CREATE TABLE IF NOT EXISTS duplicate_groups (
+    scan_date Date,
+    share LowCardinality(String),
+    duplicate_hash String,
+    copies UInt64,
+    file_size UInt64,
+    total_bytes UInt64,
+    reclaimable_bytes UInt64,
+    owners UInt32,
+    sample_paths Array(String),
+    built_at DateTime
+) ENGINE = ReplacingMergeTree(built_at)
+PARTITION BY toYYYYMM(scan_date)
+ORDER BY (scan_date, share, duplicate_hash);
+
+-- Changes between a share's scan and that share's previous full scan, per owner, extension and directory
+-- Built after each full import by import_data.py (--diff-only rebuilds every share's latest diff).
+-- Delta imports only hold the churn, so they are never compared.
+-- Files are matched across the two scans on cityHash64(path, filename): added files exist only in
+-- the newer scan, removed only in the older one, and changed files differ in size or modify_date.
+-- Added and changed files are attributed to their new owner, removed files to their old one.
+-- directory is the file's folder cut to the first few levels (DIFF_DIRECTORY_DEPTH in import_data.py).
+-- Each file is counted once per dimension, so sum over a single dimension for totals.
+CREATE TABLE IF NOT EXISTS scan_diff (
+    scan_date Date,
+    share LowCardinality(String),
+    previous_scan_date Date,
+    dimension LowCardinality(String),
+    key String,
+    added_files SimpleAggregateFunction(sum, UInt64),
+    added_bytes SimpleAggregateFunction(sum, UInt64),
+    removed_files SimpleAggregateFunction(sum, UInt64),
+    removed_bytes SimpleAggregateFunction(sum, UInt64),
+    changed_files SimpleAggregateFunction(sum, UInt64),
+    changed_bytes SimpleAggregateFunction(sum, Int64)
+) ENGINE = AggregatingMergeTree()
+PARTITION BY toYYYYMM(scan_date)
+ORDER BY (scan_date, share, previous_scan_date, dimension, key);
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Generate a synthetic Panzura Symphony scan CSV for benchmarking
+Same preamble and columns as a real export, with skewed owner, extension,
+path depth and ACL distributions so ClickHouse sees realistic cardinality
+"""
+
+import argparse
+import csv
+import gzip
+import random
+import sys
+from datetime import datetime, timedelta
+
+DOMAIN = 'CORP'
+USERS = 2000  # Regular user accounts; file ownership follows a Zipf-like skew
+DEPARTMENTS = ['Finance', 'HR', 'Legal', 'Engineering', 'Marketing', 'Sales', 'IT', 'Operations',
+               'Facilities', 'Executive', 'Research', 'Support']
+FOLDER_WORDS = ['Projects', 'Archive', 'Reports', 'Shared', 'Templates', 'Clients', 'Budget', 'Q1', 'Q2',
+                'Q3', 'Q4', 'Drafts', 'Final', 'Scans', 'Images', 'Backup', 'Old', 'Working', 'Contracts',
+                'Meetings', 'Training', 'Data', 'Exports', 'Personal']
+
+# (extension, weight, median size in bytes)
+EXTENSIONS = [
+    ('pdf', 14, 400_000), ('docx', 12, 60_000), ('xlsx', 10, 80_000), ('jpg', 12, 2_000_000),
+    ('png', 5, 500_000), ('txt', 6, 4_000), ('msg', 7, 90_000), ('pptx', 4, 3_000_000),
+    ('doc', 4, 70_000), ('xls', 3, 90_000), ('zip', 2, 30_000_000), ('pst', 1, 1_500_000_000),
+    ('mp4', 1, 200_000_000), ('csv', 3, 300_000), ('log', 2, 1_000_000), ('tmp', 2, 20_000),
+    ('dwg', 1, 5_000_000), ('iso', 0.2, 4_000_000_000), ('', 3, 10_000), ('lnk', 2, 1_500),
+]
+
+# Shares of rows that get special treatment
+DIRECTORY_SHARE = 0.06
+RECYCLE_BIN_SHARE = 0.01
+EMPTY_FILE_SHARE = 0.02
+MIGRATED_SHARE = 0.2
+DUPLICATE_SHARE = 0.12
+
+SCAN_TIME = datetime(2025, 1, 1)
+HISTORY_DAYS = 12 * 365
+
+def make_owners(rng):
+    """Regular users, admin accounts, built-in principals and orphaned SIDs with relative weights"""
+    owners = []
+    for i in range(USERS):
+        owners.append((f'{DOMAIN}\\user{i:04d}', 1.0 / (i + 1)))  # Zipf: a few users own most files
+    for i in range(40):
+        owners.append((f'{DOMAIN}\\user{i:04d}-adm', 0.02))
+    owners.append(('BUILTIN\\Administrators', 0.3))
+    owners.append(('NT AUTHORITY\\SYSTEM', 0.1))
+    for i in range(200):
+        sid = f'S-1-5-21-{rng.randint(10**9, 4 * 10**9)}-{rng.randint(10**9, 4 * 10**9)}-{rng.randint(10**9, 4 * 10**9)}-{1000 + i}'
+        owners.append((sid, 0.002))
+    owners.append(('', 0.01))
+    return owners
+
+def make_acls(rng, owners):
+    """A few hundred ACL patterns; most files inherit one of a handful"""
+    principals = [f'{DOMAIN}\\Domain Users', f'{DOMAIN}\\Domain Admins', 'BUILTIN\\Administrators',
+                  'NT AUTHORITY\\SYSTEM', 'Everyone', 'NT AUTHORITY\\Authenticated Users', 'CREATOR OWNER']
+    principals += [f'{DOMAIN}\\grp-{d.lower()}' for d in DEPARTMENTS]
+    principals += [o for o, _ in owners[:50]] + [o for o, _ in owners if o.startswith('S-1-')][:20]
+    rights = ['F', 'M', 'RX', 'R', 'W']
+
+    acls = []
+    for i in range(400):
+        aces = rng.sample(principals, rng.randint(2, 6))
+        acl = ';'.join(f'{p}:({rng.choice(rights)})' for p in aces)
+        acls.append((acl, 1.0 / (i + 1) ** 1.2))
+    return acls
+
+def iso(ts):
+    """Symphony timestamp format"""
+    return ts.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def cumulative(weights):
+    """Running totals for random.choices(cum_weights=...)"""
+    total = 0
+    out = []
+    for w in weights:
+        total += w
+        out.append(total)
+    return out
+
+def make_path(rng):
+    """Share path with a depth skewed towards 3-6 levels"""
+    if rng.random() < RECYCLE_BIN_SHARE:
+        return f'/share/$RECYCLE.BIN/S-1-5-21-{rng.randint(1000, 9999)}/'
+    depth = min(1 + int(rng.expovariate(0.3)), 14)
+    parts = ['share', rng.choice(DEPARTMENTS)]
+    for _ in range(depth - 1):
+        parts.append(f'{rng.choice(FOLDER_WORDS)}{rng.randint(1, 30)}')
+    return '/' + '/'.join(parts) + '/'
+
+def generate(output, rows, seed=42):
+    """Write `rows` data rows to output (a path; .gz is compressed, - is stdout)"""
+    rng = random.Random(seed)
+
+    owners = make_owners(rng)
+    owner_names = [o for o, _ in owners]
+    owner_cum = cumulative([w for _, w in owners])
+    acls = make_acls(rng, owners)
+    acl_names = [a for a, _ in acls]
+    acl_cum = cumulative([w for _, w in acls])
+    ext_names = [e for e, _, _ in EXTENSIONS]
+    ext_cum = cumulative([w for _, w, _ in EXTENSIONS])
+    ext_median = {e: m for e, _, m in EXTENSIONS}
+    duplicate_pool = [f'{rng.getrandbits(128):032x}' for _ in range(max(rows // 50, 1))]
+
+    if output == '-':
+        f = sys.stdout
+    elif output.endswith('.gz'):
+        f = gzip.open(output, 'wt', encoding='utf-8', newline='')
+    else:
+        f = open(output, 'w', encoding='utf-8', newline='')
+
+    try:
+        # 4-line preamble, same as a Symphony export
+        f.write('Source: \\\\fileserver01\\share\n')
+        f.write('Policy: Synthetic benchmark scan\n')
+        f.write('URI: smb://fileserver01/share\n')
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL, lineterminator='\n')
+        writer.writerow(['Path', 'Filename', 'Extension', 'Size', 'Migrated', 'Creation Date', 'Modify Date',
+                         'Last Accessed Date', 'Owner', 'ACL', 'Possible Duplicate Metadata Hash'])
+
+        for i in range(rows):
+            owner = rng.choices(owner_names, cum_weights=owner_cum)[0]
+            acl = rng.choices(acl_names, cum_weights=acl_cum)[0]
+            path = make_path(rng)
+
+            created = SCAN_TIME - timedelta(seconds=rng.randint(0, HISTORY_DAYS * 86400))
+            # Most files are rarely touched after creation
+            modified = created + timedelta(seconds=int((SCAN_TIME - created).total_seconds() * rng.random() ** 3))
+            accessed = modified + timedelta(seconds=int((SCAN_TIME - modified).total_seconds() * rng.random()))
+
+            if rng.random() < DIRECTORY_SHARE:
+                writer.writerow([path, '.', '', 0, 'False', iso(created), iso(modified), iso(accessed),
+                                 owner, acl, ''])
+                continue
+
+            ext = rng.choices(ext_names, cum_weights=ext_cum)[0]
+            if rng.random() < EMPTY_FILE_SHARE:
+                size = 0
+            else:
+                size = int(rng.lognormvariate(0, 1.5) * ext_median[ext])
+            name = f'file_{i:09d}.{ext}' if ext else f'file_{i:09d}'
+            if rng.random() < DUPLICATE_SHARE:
+                dup = rng.choice(duplicate_pool)
+            else:
+                dup = f'{rng.getrandbits(128):032x}'
+
+            writer.writerow([path, name, ext, size, 'True' if rng.random() < MIGRATED_SHARE else 'False',
+                             iso(created), iso(modified), iso(accessed), owner, acl, dup])
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic Symphony scan CSV')
+    parser.add_argument('--rows', type=int, default=1_000_000, help='Data rows to write (default: 1,000,000)')
+    parser.add_argument('--output', default='/data/synthetic_scan.csv',
+                        help='Output path; .gz is compressed, - is stdout (default: /data/synthetic_scan.csv)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+    args = parser.parse_args()
+
+    start = datetime.now()
+    generate(args.output, args.rows, args.seed)
+    if args.output != '-':
+        print(f"Wrote {args.rows:,} rows to {args.output} in {(datetime.now() - start).total_seconds():.1f} seconds")
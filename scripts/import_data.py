@@ -4,10 +4,40 @@ Import Panzura Symphony file share scan data into ClickHouse
 Handles large CSV files efficiently with batch processing
 """
 
+import argparse
 import csv
+import gzip
+import hashlib
+import io
+import json
+import lzma
+import mmap
+import os
+import re
+import resource
 import sys
-from datetime import datetime
+import threading
+import time
+import urllib.request
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import date, datetime, timezone
+from queue import Queue
 import clickhouse_connect
+from clickhouse_connect.driver.external import ExternalData
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None  # Only needed for --columnar
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # Only needed for .zst input
 
 # Configuration
 CLICKHOUSE_HOST = 'localhost'
@@ -16,20 +46,73 @@ DATABASE = 'file_share'
 TABLE = 'file_scan'
 CSV_FILE = '/data/symphony_scan.csv'
 BATCH_SIZE = 10000  # Insert in batches for better performance
+READ_BUFFER_BYTES = 8 * 1024 * 1024  # Read buffer for plain, compressed and stdin input
+NOTIFY_URL = None  # AI query service to notify after an import (--notify)
+INDEX_DIR = None  # Where <share>.index files live (--index-dir); None keeps them next to the scan file
+SHARE = None  # Share recorded with the rows (--share); None reads it from the scan's Source: line
+SCANS_TABLE = 'scans'  # One row per imported scan, with its share and whether it was a --delta import
+LATEST_SCANS = 'latest_scans'  # View of the latest full scan of each share
+ROLLUP_TABLES = ['file_scan_by_bucket', 'file_scan_by_owner', 'file_scan_by_extension',
+                 'file_scan_by_acl', 'file_scan_by_directory']  # Fed from file_scan by materialized views
+ACL_TABLE = 'acl_dim'  # Distinct ACL strings; file_scan stores their acl_id
+DICTIONARIES = ['acl_dict', 'owner_dict']  # Reloaded after an import so new ACLs and owners resolve at once
+
+# Parallel mode (--workers > 1)
+CHUNK_BYTES = 64 * 1024 * 1024  # Size of each byte range handed to a parse process
+INSERT_WORKERS = 4  # Concurrent client.insert threads
+INSERT_QUEUE_SIZE = 8  # Batches waiting for insert; bounds memory when ClickHouse falls behind
+
+# Duplicate groups, rebuilt after each import (--dedup-only rebuilds without importing)
+DUPLICATE_TABLE = 'duplicate_groups'
+DUPLICATE_SAMPLE_PATHS = 5  # Example paths stored per duplicate set
+DUPLICATE_SPILL_BYTES = 4 * 1024**3  # GROUP BY state kept in memory before spilling to disk
+
+# Scan-over-scan diff, rebuilt after each import (--diff-only rebuilds without importing)
+DIFF_TABLE = 'scan_diff'
+DIFF_BUCKETS = 16  # Files are compared in this many hash buckets, one query each, to bound memory
+DIFF_DIRECTORY_DEPTH = 3  # Folder levels kept for the per-directory diff, e.g. /share/Finance/Reports/
+
+# Columnar mode (--columnar)
+ARROW_BLOCK_BYTES = 16 * 1024 * 1024  # Bytes of CSV the Arrow reader parses per block
+# The ISO forms datetime.fromisoformat() reads in parse_datetime(), split into parts for Arrow
+ARROW_TIMESTAMP_PATTERN = (r'^(?P<date>\d{4}-\d{2}-\d{2})'
+                           r'(?:[T ](?P<hour>\d{2}):(?P<minute>\d{2})(?::(?P<second>\d{2})(?:\.\d+)?)?)?'
+                           r'(?:Z|(?P<sign>[+-])(?P<offset_hour>\d{2}):?(?P<offset_minute>\d{2}))?$')
+
+PREAMBLE_LINES = 4  # Lines before the first data row
+
+FIELDNAMES = ['Path', 'Filename', 'Extension', 'Size', 'Migrated',
+              'Creation Date', 'Modify Date', 'Last Accessed Date',
+              'Owner', 'ACL', 'Possible Duplicate Metadata Hash']
+
+COLUMNS = ['path', 'filename', 'extension', 'size', 'migrated',
+           'creation_date', 'modify_date', 'last_accessed_date',
+           'owner', 'acl_id', 'duplicate_hash']
+ACL_INDEX = COLUMNS.index('acl_id')  # parse_row leaves the ACL text here; insert_batch swaps in its id
+
+# Rows carry share and scan_date explicitly, so a resumed run keeps the original date
+SCAN_COLUMNS = COLUMNS + ['share', 'scan_date']
 
 def parse_boolean(value):
     """Convert string boolean to integer (0/1)"""
     return 1 if value.lower() == 'true' else 0
 
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)  # Stored for empty, invalid or earlier dates
+
 def parse_datetime(value):
-    """Parse ISO datetime string to datetime object"""
+    """
+    Parse ISO datetime string to a UTC datetime; values without an offset are
+    taken as UTC, so the stored value doesn't depend on the importing machine's zone
+    """
     if not value:
-        return datetime(1970, 1, 1)  # Default for empty dates
+        return EPOCH
     try:
         # Remove 'Z' and parse
-        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
     except:
-        return datetime(1970, 1, 1)
+        return EPOCH
+    parsed = parsed.replace(tzinfo=timezone.utc) if parsed.tzinfo is None else parsed.astimezone(timezone.utc)
+    return max(parsed, EPOCH)
 
 def parse_size(value):
     """Parse size as integer"""
@@ -38,111 +121,941 @@ def parse_size(value):
     except:
         return 0
 
-def import_data():
-    """Import CSV data into ClickHouse"""
-    
-    print(f"Connecting to ClickHouse at {CLICKHOUSE_HOST}:{CLICKHOUSE_PORT}...")
-    client = clickhouse_connect.get_client(host=CLICKHOUSE_HOST, port=CLICKHOUSE_PORT, username='default', password='clickhouse')
-    
-    print(f"Opening CSV file: {CSV_FILE}")
-    
+def parse_row(row):
+    """Convert one CSV row (dict) into a tuple matching COLUMNS, with the ACL still as text"""
+    return (
+        row['Path'].strip('"'),
+        row['Filename'].strip('"'),
+        row['Extension'].strip('"'),
+        parse_size(row['Size']),
+        parse_boolean(row['Migrated']),
+        parse_datetime(row['Creation Date']),
+        parse_datetime(row['Modify Date']),
+        parse_datetime(row['Last Accessed Date']),
+        row['Owner'].strip('"'),
+        row['ACL'].strip('"'),
+        row.get('Possible Duplicate Metadata Hash', '').strip('"')
+    )
+
+def get_client(settings=None):
+    """Open a ClickHouse connection, optionally with session settings applied to every query and insert"""
+    return clickhouse_connect.get_client(host=CLICKHOUSE_HOST, port=CLICKHOUSE_PORT, username='default', password='clickhouse',
+                                         settings=settings)
+
+class AclIds:
+    """
+    Maps ACL strings to the ids stored in file_scan.acl_id.
+    An id is cityHash64 of the ACL text, computed by ClickHouse, so the importer, the ingestion
+    service and any number of parallel imports all derive the same id for the same ACL.
+    New ACLs are written to acl_dim before any row that uses them is inserted.
+    Shared by the insert threads of the parallel path; the lock only guards the cache, so
+    two threads may both hash and write the same new ACL, which acl_dim collapses by id.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.lock = threading.Lock()
+
+    def hash_acls(self, client, acls):
+        """Ask ClickHouse for the ids of a list of ACLs, sent as external data in the request body"""
+        data = ''.join(json.dumps({'n': n, 'acl': acl}) + '\n' for n, acl in enumerate(acls)).encode('utf-8')
+        result = client.query('SELECT n, cityHash64(acl) FROM acls', external_data=ExternalData(
+            file_name='acls', data=data, fmt='JSONEachRow', structure='n UInt32, acl String'))
+        ids = [0] * len(acls)
+        for n, acl_id in result.result_rows:
+            ids[n] = acl_id
+        return ids
+
+    def lookup(self, client, acls):
+        """Ids for a list of ACL strings, registering unseen ones (client=None numbers them in memory only)"""
+        with self.lock:
+            new = list(dict.fromkeys(acl for acl in acls if acl not in self.ids))
+            if new and client is None:
+                self.ids.update(zip(new, range(len(self.ids) + 1, len(self.ids) + len(new) + 1)))
+                new = []
+        if new:
+            ids = self.hash_acls(client, new)
+            client.insert(f'{DATABASE}.{ACL_TABLE}', list(zip(ids, new)), column_names=['acl_id', 'acl'])
+            with self.lock:
+                self.ids.update(zip(new, ids))
+        return [self.ids[acl] for acl in acls]
+
+acl_ids = AclIds()
+
+def insert_batch(client, batch, column_names=COLUMNS):
+    """Insert a list of row tuples, replacing the ACL text with its id"""
+    ids = acl_ids.lookup(client, [row[ACL_INDEX] for row in batch])
+    batch = [row[:ACL_INDEX] + (acl_id,) + row[ACL_INDEX + 1:] for row, acl_id in zip(batch, ids)]
+    client.insert(f'{DATABASE}.{TABLE}', batch, column_names=column_names)
+
+def detect_compression(stream):
+    """Return 'gzip', 'zstd', 'xz' or None from the magic bytes at the start of a buffered stream"""
+    magic = stream.peek(6)[:6]
+    if magic.startswith(b'\x1f\x8b'):
+        return 'gzip'
+    if magic.startswith(b'\x28\xb5\x2f\xfd'):
+        return 'zstd'
+    if magic.startswith(b'\xfd7zXZ\x00'):
+        return 'xz'
+    return None
+
+class ScanReader(io.BufferedReader):
+    """Buffered reader over a decompressor that also closes the file beneath it"""
+
+    def __init__(self, stream, raw):
+        super().__init__(stream, buffer_size=READ_BUFFER_BYTES)
+        self.raw_file = raw
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.raw_file.close()
+
+def open_scan(path, use_mmap=False):
+    """
+    Open the scan as a binary stream; '-' reads stdin.
+    gzip, zstd and xz input is decompressed on the fly. With use_mmap an
+    uncompressed file is memory-mapped instead of read through a buffer.
+    """
+    if path == '-':
+        raw = open(sys.stdin.fileno(), 'rb', buffering=READ_BUFFER_BYTES, closefd=False)
+    else:
+        raw = open(path, 'rb', buffering=READ_BUFFER_BYTES)
+
+    compression = detect_compression(raw)
+    if compression == 'gzip':
+        stream = gzip.GzipFile(fileobj=raw)
+    elif compression == 'zstd':
+        if zstandard is None:
+            raw.close()
+            raise RuntimeError("zstd input requires zstandard (pip install zstandard)")
+        stream = zstandard.ZstdDecompressor().stream_reader(raw, read_size=READ_BUFFER_BYTES)
+    elif compression == 'xz':
+        stream = lzma.LZMAFile(raw)
+    elif use_mmap and path != '-':
+        mapped = mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ)
+        raw.close()
+        return mapped
+    else:
+        return raw
+
+    # GzipFile and LZMAFile don't close a file object they were given
+    return ScanReader(stream, raw)
+
+def is_plain_file(path):
+    """True if path is an uncompressed regular file (required for byte-range chunking)"""
+    if path == '-':
+        return False
+    with open(path, 'rb') as f:
+        return detect_compression(f) is None
+
+def read_share(path):
+    """Share named on the scan's Source: line, e.g. \\\\fileserver01\\share, or '' without one"""
+    with open_scan(path) as f:
+        line = f.readline().decode('utf-8', errors='replace').strip()
+    return line[len('Source:'):].strip() if line.startswith('Source:') else ''
+
+def index_path(share, directory=None):
+    """Hash index of the share's previous scan, by default next to the scan file so dated exports find it"""
+    name = re.sub(r'[^A-Za-z0-9.-]+', '_', share).strip('_') or 'scan'
+    directory = directory or INDEX_DIR or os.path.dirname(os.path.abspath(CSV_FILE))
+    return os.path.join(directory, f'{name}.index')
+
+def record_scan(client, share, scan_date, delta, rows, source_file):
+    """Register an imported scan; latest_scans only lists full (non-delta) scans"""
+    client.insert(f'{DATABASE}.{SCANS_TABLE}', [(share, scan_date, int(delta), source_file, rows)],
+                  column_names=['share', 'scan_date', 'delta', 'source_file', 'rows'])
+
+def has_scan(client, share, scan_date):
+    """Whether a scan of the share was already imported on scan_date"""
+    return client.query(f'SELECT count() FROM {DATABASE}.{SCANS_TABLE} FINAL '
+                        'WHERE share = {share:String} AND scan_date = {scan_date:Date}',
+                        parameters={'share': share, 'scan_date': scan_date}).result_rows[0][0] > 0
+
+def replace_scan(client, share, scan_date):
+    """
+    Delete the share's rows for scan_date from file_scan and its rollups, so a file
+    imported again on the same day replaces the earlier import instead of adding to it
+    """
+    parameters = {'share': share, 'scan_date': scan_date}
+    for table in [TABLE] + ROLLUP_TABLES:
+        client.command(f'DELETE FROM {DATABASE}.{table} WHERE share = {{share:String}} AND scan_date = {{scan_date:Date}}',
+                       parameters=parameters)
+
+def key_hash(path, filename, size, modify_date):
+    """64-bit hash of the fields that identify an unchanged file between scans"""
+    key = '\0'.join((path or '', filename or '', size or '', modify_date or ''))
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def row_hash(row):
+    """key_hash of a CSV row; fields missing from a short row hash as empty"""
+    return key_hash(row['Path'], row['Filename'], row['Size'], row['Modify Date'])
+
+def load_index(path):
+    """Load the sorted hash index of the previous scan, or None if there isn't one"""
+    if not os.path.exists(path):
+        return None
+    index = array('Q')
+    with open(path, 'rb') as f:
+        index.frombytes(f.read())
+    return index
+
+def index_contains(index, value):
+    """Binary search a sorted hash index"""
+    i = bisect_left(index, value)
+    return i < len(index) and index[i] == value
+
+def save_index(path, hashes):
+    """Write the hashes of this scan as the sorted index for the next --delta run"""
+    index = array('Q', sorted(hashes))
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        index.tofile(f)
+    os.replace(tmp, path)
+
+def load_checkpoint(path):
+    """Read the checkpoint left by an interrupted run, or None"""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def save_checkpoint(path, state):
+    """Atomically record the last committed batch so --resume can pick up after it"""
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+def read_lines(f, position):
+    """Yield decoded lines from a binary stream, keeping position[0] at the end of the last line read"""
+    for line in iter(f.readline, b''):
+        position[0] += len(line)
+        yield line.decode('utf-8')
+
+def import_serial(client, share='', resume=False, delta=False, use_mmap=False):
+    """
+    Single-threaded import: parse and insert on one core.
+    After every batch the byte offset and row count are written to the
+    checkpoint file so an interrupted run can continue with --resume.
+    Every run writes the (path, filename, size, modify_date) hashes of its rows
+    as the share's index; with delta=True, rows whose hash is in the index of
+    the share's previous scan are skipped.
+    Offsets count uncompressed bytes, so compressed input resumes too.
+    Stdin input is not checkpointed or indexed.
+    Returns (rows, skipped, unchanged, scan_date)
+    """
+    from_stdin = CSV_FILE == '-'
+    checkpoint_file = None if from_stdin else f'{CSV_FILE}.checkpoint'
+    index_file = index_path(share)
+    file_size = None if from_stdin else os.path.getsize(CSV_FILE)
+
+    checkpoint = load_checkpoint(checkpoint_file) if resume else None
+    if checkpoint is not None:
+        if checkpoint['file_size'] != file_size:
+            raise RuntimeError(f"Checkpoint {checkpoint_file} was written for a different file; "
+                               "delete it or run without --resume")
+        if checkpoint['delta'] != delta:
+            raise RuntimeError(f"Checkpoint {checkpoint_file} was written "
+                               f"{'with' if checkpoint['delta'] else 'without'} --delta; rerun the same way")
+        print(f"Resuming after {checkpoint['rows']:,} rows (byte {checkpoint['offset']:,})")
+    elif resume:
+        print("No checkpoint found, starting from the beginning")
+    elif checkpoint_file and os.path.exists(checkpoint_file):
+        print(f"Warning: {checkpoint_file} exists from an interrupted run; use --resume to continue it")
+
+    # Keep the interrupted run's scan_date so a resume after midnight stays one scan
+    scan_date = date.fromisoformat(checkpoint['scan_date']) if checkpoint else date.today()
+    resume_offset = checkpoint['offset'] if checkpoint else 0
+    total_rows = checkpoint['rows'] if checkpoint else 0
+    skipped_rows = checkpoint['skipped'] if checkpoint else 0
+    unchanged_rows = checkpoint['unchanged'] if checkpoint else 0
+
+    prior_index = None
+    hashes = None if from_stdin else array('Q')
+    if delta:
+        prior_index = load_index(index_file)
+        if prior_index is None:
+            print(f"No index at {index_file}, loading the full scan and building one")
+        else:
+            print(f"Loaded index of previous scan ({len(prior_index):,} rows)")
+
+    def commit(batch, offset):
+        insert_batch(client, batch, SCAN_COLUMNS)
+        if checkpoint_file is None:
+            return
+        save_checkpoint(checkpoint_file, {
+            'file_size': file_size, 'offset': offset, 'rows': total_rows + len(batch),
+            'skipped': skipped_rows, 'unchanged': unchanged_rows,
+            'scan_date': scan_date.isoformat(), 'delta': delta,
+        })
+
     batch = []
-    total_rows = 0
-    skipped_rows = 0
     start_time = datetime.now()
-    
-    with open(CSV_FILE, 'r', encoding='utf-8') as f:
+
+    with open_scan(CSV_FILE, use_mmap) as f:
         # Skip the first 3 lines (Source, Policy, URI, blank line)
-        for _ in range(4):
-            next(f)
-        
+        position = [0]
+        for _ in range(PREAMBLE_LINES):
+            position[0] += len(f.readline())
+
         # Line 4 contains the actual CSV header, line 5+ contains data
-        reader = csv.DictReader(f, fieldnames=['Path', 'Filename', 'Extension', 'Size', 'Migrated', 
-                                                 'Creation Date', 'Modify Date', 'Last Accessed Date', 
-                                                 'Owner', 'ACL', 'Possible Duplicate Metadata Hash'])
-        
+        reader = csv.DictReader(read_lines(f, position), fieldnames=FIELDNAMES)
+
         print("Starting import...")
-        
+
         for row_num, row in enumerate(reader, 1):
+            if position[0] <= resume_offset:
+                # Committed by the interrupted run; reread only so the new index covers every row
+                if hashes is not None:
+                    hashes.append(row_hash(row))
+                continue
+
             try:
-                # Parse and prepare data
-                record = (
-                    row['Path'].strip('"'),
-                    row['Filename'].strip('"'),
-                    row['Extension'].strip('"'),
-                    parse_size(row['Size']),
-                    parse_boolean(row['Migrated']),
-                    parse_datetime(row['Creation Date']),
-                    parse_datetime(row['Modify Date']),
-                    parse_datetime(row['Last Accessed Date']),
-                    row['Owner'].strip('"'),
-                    row['ACL'].strip('"'),
-                    row.get('Possible Duplicate Metadata Hash', '').strip('"')
-                )
-                
-                batch.append(record)
-                
+                record = parse_row(row)
+
+                if hashes is not None:
+                    h = row_hash(row)
+                    hashes.append(h)
+                    if prior_index is not None and index_contains(prior_index, h):
+                        unchanged_rows += 1
+                        continue
+
+                batch.append(record + (share, scan_date))
+
                 # Insert batch when full
                 if len(batch) >= BATCH_SIZE:
-                    client.insert(
-                        f'{DATABASE}.{TABLE}',
-                        batch,
-                        column_names=['path', 'filename', 'extension', 'size', 'migrated',
-                                     'creation_date', 'modify_date', 'last_accessed_date',
-                                     'owner', 'acl', 'duplicate_hash']
-                    )
+                    commit(batch, position[0])
                     total_rows += len(batch)
                     batch = []
-                    
+
                     # Progress update
                     if total_rows % 100000 == 0:
                         elapsed = (datetime.now() - start_time).total_seconds()
                         rate = total_rows / elapsed if elapsed > 0 else 0
                         print(f"Imported {total_rows:,} rows ({rate:.0f} rows/sec)")
-                
+
             except Exception as e:
                 skipped_rows += 1
                 if skipped_rows <= 10:  # Only print first 10 errors
                     print(f"Error on row {row_num}: {e}")
                 continue
-        
+
         # Insert remaining batch
         if batch:
-            client.insert(
-                f'{DATABASE}.{TABLE}',
-                batch,
-                column_names=['path', 'filename', 'extension', 'size', 'migrated',
-                             'creation_date', 'modify_date', 'last_accessed_date',
-                             'owner', 'acl', 'duplicate_hash']
-            )
+            commit(batch, position[0])
             total_rows += len(batch)
-    
+
+    if hashes is not None:
+        save_index(index_file, hashes)
+        print(f"Wrote index of this scan to {index_file}")
+    if checkpoint_file and os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+
+    return total_rows, skipped_rows, unchanged_rows, scan_date
+
+def data_offset(path):
+    """Byte offset of the first data row (just past the preamble)"""
+    with open(path, 'rb') as f:
+        for _ in range(PREAMBLE_LINES):
+            f.readline()
+        return f.tell()
+
+def split_chunks(path, start, chunk_bytes):
+    """
+    Split the file from `start` into (start, end) byte ranges.
+    Each end is moved forward to the next newline so no row is cut in half.
+    """
+    file_size = os.path.getsize(path)
+    chunks = []
+    with open(path, 'rb') as f:
+        pos = start
+        while pos < file_size:
+            end = min(pos + chunk_bytes, file_size)
+            if end < file_size:
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            chunks.append((pos, end))
+            pos = end
+    return chunks
+
+def parse_chunk(path, start, end, share, scan_date):
+    """
+    Parse one byte range in a worker process.
+    Returns (records, hashes, skipped, first_errors, parse_seconds)
+    """
+    t0 = time.perf_counter()
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start).decode('utf-8')
+
+    records = []
+    hashes = array('Q')
+    skipped = 0
+    errors = []
+    for row in csv.DictReader(io.StringIO(data), fieldnames=FIELDNAMES):
+        try:
+            records.append(parse_row(row) + (share, scan_date))
+            hashes.append(row_hash(row))
+        except Exception as e:
+            skipped += 1
+            if len(errors) < 10:
+                errors.append(f"chunk at byte {start:,}: {e}")
+
+    return records, hashes, skipped, errors, time.perf_counter() - t0
+
+def insert_worker(batches, stats, lock):
+    """Insert thread: drain the batch queue until a None sentinel arrives"""
+    client = get_client()
+    try:
+        while True:
+            batch = batches.get()
+            if batch is None:
+                break
+            # Keep draining after a failure so the producer never blocks on a full queue
+            if stats['error'] is not None:
+                continue
+            try:
+                t0 = time.perf_counter()
+                insert_batch(client, batch, SCAN_COLUMNS)
+                elapsed = time.perf_counter() - t0
+                with lock:
+                    stats['insert_seconds'] += elapsed
+                    stats['inserted'] += len(batch)
+            except Exception as e:
+                with lock:
+                    if stats['error'] is None:
+                        stats['error'] = e
+    finally:
+        client.close()
+
+def import_parallel(workers, share='', scan_date=None):
+    """
+    Parallel import: parse byte-range chunks in a process pool and feed
+    INSERT_WORKERS insert threads through a bounded queue.
+    Returns (rows, skipped, stats)
+    """
+    scan_date = scan_date or date.today()
+    start = data_offset(CSV_FILE)
+    chunks = split_chunks(CSV_FILE, start, CHUNK_BYTES)
+    print(f"Split into {len(chunks):,} chunks of ~{CHUNK_BYTES // (1024 * 1024)} MB "
+          f"({workers} parse processes, {INSERT_WORKERS} insert threads)")
+
+    batches = Queue(maxsize=INSERT_QUEUE_SIZE)
+    lock = threading.Lock()
+    stats = {'parse_seconds': 0.0, 'insert_seconds': 0.0, 'inserted': 0,
+             'queue_wait_seconds': 0.0, 'error': None}
+    threads = [threading.Thread(target=insert_worker, args=(batches, stats, lock), daemon=True)
+               for _ in range(INSERT_WORKERS)]
+    for t in threads:
+        t.start()
+
+    parsed_rows = 0
+    skipped_rows = 0
+    printed_errors = 0
+    hashes = array('Q')
+    start_time = time.perf_counter()
+
+    def collect(future):
+        nonlocal parsed_rows, skipped_rows, printed_errors
+        records, chunk_hashes, skipped, errors, parse_seconds = future.result()
+        hashes.extend(chunk_hashes)
+        for error in errors:
+            if printed_errors < 10:  # Only print first 10 errors
+                print(f"Error in {error}")
+                printed_errors += 1
+        skipped_rows += skipped
+        parsed_rows += len(records)
+        stats['parse_seconds'] += parse_seconds
+
+        t0 = time.perf_counter()
+        for i in range(0, len(records), BATCH_SIZE):
+            batches.put(records[i:i + BATCH_SIZE])
+        stats['queue_wait_seconds'] += time.perf_counter() - t0
+
+        elapsed = time.perf_counter() - start_time
+        print(f"Parsed {parsed_rows:,} rows, inserted {stats['inserted']:,} "
+              f"({stats['inserted'] / elapsed:.0f} rows/sec)")
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Keep at most 2 chunks per process in flight so parsed rows don't pile up in memory
+            pending = set()
+            for chunk_start, chunk_end in chunks:
+                pending.add(pool.submit(parse_chunk, CSV_FILE, chunk_start, chunk_end, share, scan_date))
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future)
+                if stats['error'] is not None:
+                    break
+            for future in pending:
+                collect(future)
+    finally:
+        for _ in threads:
+            batches.put(None)
+        for t in threads:
+            t.join()
+
+    if stats['error'] is not None:
+        raise stats['error']
+
+    save_index(index_path(share), hashes)
+    print(f"Wrote index of this scan to {index_path(share)}")
+
+    return stats['inserted'], skipped_rows, stats
+
+def arrow_sizes(column):
+    """Cast a string column to UInt64; empty or non-numeric values become 0"""
+    digits = pc.match_substring_regex(column, '^[0-9]+$')
+    return pc.cast(pc.if_else(digits, column, '0'), pa.uint64())
+
+def arrow_booleans(column):
+    """Cast a 'True'/'False' string column to UInt8"""
+    return pc.cast(pc.equal(pc.utf8_lower(column), 'true'), pa.uint8())
+
+def arrow_datetimes(column):
+    """
+    Parse ISO timestamps in bulk to UTC at second precision, as parse_datetime()
+    values are stored: fractional seconds are dropped, a UTC offset is converted
+    and empty, invalid or earlier values become 1970-01-01.
+    """
+    epoch = pa.scalar(0, type=pa.timestamp('s'))
+    parts = pc.extract_regex(column, ARROW_TIMESTAMP_PATTERN)
+
+    def part(name, default):
+        # Optional groups that did not match come back empty
+        value = pc.struct_field(parts, name)
+        return pc.if_else(pc.equal(value, ''), default, value)
+
+    local = pc.strptime(pc.binary_join_element_wise(part('date', ''), 'T', part('hour', '00'), ':',
+                                                    part('minute', '00'), ':', part('second', '00'), ''),
+                        format='%Y-%m-%dT%H:%M:%S', unit='s', error_is_null=True)
+    offset = pc.add(pc.multiply(pc.cast(part('offset_hour', '0'), pa.int64()), 3600),
+                    pc.multiply(pc.cast(part('offset_minute', '0'), pa.int64()), 60))
+    offset = pc.if_else(pc.equal(pc.struct_field(parts, 'sign'), '-'), pc.negate(offset), offset)
+    parsed = pc.subtract(local, pc.cast(offset, pa.duration('s')))
+    return pc.max_element_wise(pc.fill_null(parsed, epoch), epoch)
+
+def arrow_strings(column):
+    """Strip surrounding quotes from a string column, like parse_row()"""
+    return pc.utf8_trim(column, '"')
+
+def arrow_acl_ids(client, column):
+    """Map an ACL string column to acl ids, looking up each distinct ACL once"""
+    encoded = pc.dictionary_encode(column.combine_chunks())
+    ids = pa.array(acl_ids.lookup(client, encoded.dictionary.to_pylist()), pa.uint64())
+    return pc.take(ids, encoded.indices)
+
+def build_arrow_table(raw, client=None):
+    """Convert a table of raw CSV string columns into the file_scan column types"""
+    return pa.table({
+        'path': arrow_strings(raw['Path']),
+        'filename': arrow_strings(raw['Filename']),
+        'extension': arrow_strings(raw['Extension']),
+        'size': arrow_sizes(raw['Size']),
+        'migrated': arrow_booleans(raw['Migrated']),
+        'creation_date': arrow_datetimes(raw['Creation Date']),
+        'modify_date': arrow_datetimes(raw['Modify Date']),
+        'last_accessed_date': arrow_datetimes(raw['Last Accessed Date']),
+        'owner': arrow_strings(raw['Owner']),
+        'acl_id': arrow_acl_ids(client, arrow_strings(raw['ACL'])),
+        'duplicate_hash': arrow_strings(raw['Possible Duplicate Metadata Hash']),
+    })
+
+def import_columnar(client, share='', scan_date=None, use_mmap=False):
+    """
+    Columnar import: Arrow's CSV reader parses blocks into string columns,
+    each batch is converted with vectorized compute functions and sent with
+    insert_arrow; only the four key columns of the share's index are read
+    back into Python, to hash each row.
+    Stdin input is not indexed.
+    Returns (rows, skipped, stats)
+    """
+    if pa is None:
+        raise RuntimeError("--columnar requires pyarrow (pip install pyarrow)")
+
+    scan_date = scan_date or date.today()
+    skipped = []
+
+    def skip_invalid_row(row):
+        skipped.append(row)
+        if len(skipped) <= 10:  # Only print first 10 errors
+            print(f"Error on row {row.number}: expected {row.expected_columns} columns, got {row.actual_columns}")
+        return 'skip'
+
+    if use_mmap and is_plain_file(CSV_FILE):
+        source = pa.memory_map(CSV_FILE)
+    else:
+        source = open_scan(CSV_FILE)
+
+    reader = pa_csv.open_csv(
+        source,
+        read_options=pa_csv.ReadOptions(skip_rows=PREAMBLE_LINES, column_names=FIELDNAMES,
+                                        block_size=ARROW_BLOCK_BYTES),
+        parse_options=pa_csv.ParseOptions(invalid_row_handler=skip_invalid_row),
+        convert_options=pa_csv.ConvertOptions(column_types={name: pa.string() for name in FIELDNAMES},
+                                              strings_can_be_null=False))
+
+    print("Starting columnar import...")
+
+    stats = {'parse_seconds': 0.0, 'insert_seconds': 0.0}
+    total_rows = 0
+    hashes = None if CSV_FILE == '-' else array('Q')
+    pending = []
+    pending_rows = 0
+    start_time = time.perf_counter()
+
+    def flush():
+        nonlocal total_rows, pending, pending_rows
+        t0 = time.perf_counter()
+        raw = pa.Table.from_batches(pending)
+        if hashes is not None:
+            hashes.extend(map(key_hash, *(raw[name].to_pylist()
+                                          for name in ('Path', 'Filename', 'Size', 'Modify Date'))))
+        table = build_arrow_table(raw, client)
+        table = table.append_column('share', pa.array([share] * table.num_rows, pa.string()))
+        table = table.append_column('scan_date', pa.array([scan_date] * table.num_rows, pa.date32()))
+        t1 = time.perf_counter()
+        client.insert_arrow(f'{DATABASE}.{TABLE}', table)
+        stats['parse_seconds'] += t1 - t0
+        stats['insert_seconds'] += time.perf_counter() - t1
+        total_rows += table.num_rows
+        pending = []
+        pending_rows = 0
+
+        elapsed = time.perf_counter() - start_time
+        print(f"Imported {total_rows:,} rows ({total_rows / elapsed:.0f} rows/sec)")
+
+    with source:
+        while True:
+            t0 = time.perf_counter()
+            try:
+                batch = reader.read_next_batch()
+            except StopIteration:
+                break
+            stats['parse_seconds'] += time.perf_counter() - t0
+            pending.append(batch)
+            pending_rows += batch.num_rows
+            if pending_rows >= BATCH_SIZE:
+                flush()
+
+        if pending_rows:
+            flush()
+
+    if hashes is not None:
+        save_index(index_path(share), hashes)
+        print(f"Wrote index of this scan to {index_path(share)}")
+
+    return total_rows, len(skipped), stats
+
+def peak_memory_mb():
+    """Peak resident memory of this process (ru_maxrss is KB on Linux, bytes on macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def print_stage_report(total_rows, duration, stats):
+    """Per-stage throughput for the parallel and columnar modes"""
+    parse_seconds = stats['parse_seconds']
+    insert_seconds = stats['insert_seconds']
+    print("Stage throughput:")
+    print(f"  Parse:  {parse_seconds:.2f} seconds "
+          f"({total_rows / parse_seconds if parse_seconds > 0 else 0:.0f} rows/sec)")
+    print(f"  Insert: {insert_seconds:.2f} seconds "
+          f"({total_rows / insert_seconds if insert_seconds > 0 else 0:.0f} rows/sec)")
+    if 'queue_wait_seconds' in stats:
+        print(f"  Queue:  {stats['queue_wait_seconds']:.2f} seconds waiting on insert backpressure")
+        print("  (parse time is summed across processes, insert time across threads)")
+    print(f"  Wall:   {total_rows / duration if duration > 0 else 0:.0f} rows/sec end to end")
+
+def import_data(workers=1, columnar=False, resume=False, delta=False, use_mmap=False):
+    """Import CSV data into ClickHouse"""
+
+    print(f"Connecting to ClickHouse at {CLICKHOUSE_HOST}:{CLICKHOUSE_PORT}...")
+    client = get_client()
+
+    print(f"Opening CSV file: {'stdin' if CSV_FILE == '-' else CSV_FILE}")
+    # Stdin can't be read twice, so its share comes from --share only
+    share = SHARE if SHARE is not None else '' if CSV_FILE == '-' else read_share(CSV_FILE)
+    print(f"Share: {share or '(unnamed)'}")
+    # Without the share's index a --delta run loads every row, so it counts as a full scan
+    partial = delta and os.path.exists(index_path(share))
+
+    start_time = datetime.now()
+
+    stats = None
+    unchanged_rows = None
+    scan_date = date.today()
+    # A resumed run continues its own rows; otherwise drop anything already imported for this share today
+    if not (resume and os.path.exists(f'{CSV_FILE}.checkpoint')):
+        # The share's index is already this day's, so a delta would compare the scan with itself
+        if partial and has_scan(client, share, scan_date):
+            raise RuntimeError(f"{share or '(unnamed)'} was already imported on {scan_date}; "
+                               "import this file without --delta to replace that scan")
+        replace_scan(client, share, scan_date)
+    if columnar:
+        total_rows, skipped_rows, stats = import_columnar(client, share, scan_date, use_mmap=use_mmap)
+    elif workers > 1:
+        total_rows, skipped_rows, stats = import_parallel(workers, share, scan_date)
+    else:
+        total_rows, skipped_rows, unchanged_rows, scan_date = import_serial(client, share, resume=resume,
+                                                                             delta=delta, use_mmap=use_mmap)
+    record_scan(client, share, scan_date, partial, total_rows, CSV_FILE)
+
     end_time = datetime.now()
     duration = (end_time - start_time).total_seconds()
-    
+
     print("\n" + "="*60)
     print("Import Complete!")
     print("="*60)
     print(f"Total rows imported: {total_rows:,}")
     print(f"Rows skipped (errors): {skipped_rows:,}")
+    if delta:
+        print(f"Rows unchanged since previous scan: {unchanged_rows:,}")
     print(f"Duration: {duration:.2f} seconds")
     print(f"Average rate: {total_rows/duration:.0f} rows/second")
+    print(f"Peak memory: {peak_memory_mb():.0f} MB")
+    if stats is not None:
+        print_stage_report(total_rows, duration, stats)
     print("="*60)
-    
+
+    for dictionary in DICTIONARIES:
+        client.command(f'SYSTEM RELOAD DICTIONARY {DATABASE}.{dictionary}')
+
     # Verify data
     result = client.query(f'SELECT COUNT(*) FROM {DATABASE}.{TABLE}')
     count = result.result_rows[0][0]
     print(f"\nVerification: {count:,} rows in database")
-    
+
+    if partial:
+        # A delta scan only holds new or changed rows, so its duplicate sets would be incomplete
+        print("Skipping duplicate groups for a delta import")
+    else:
+        # The rows are already in; an older database may just lack these tables (rerun create_schema.sql)
+        try:
+            build_duplicate_groups(client, [share])
+        except Exception as e:
+            print(f"Warning: could not build duplicate groups: {e}")
+        try:
+            build_scan_diff(client, [share])
+        except Exception as e:
+            print(f"Warning: could not build scan diff: {e}")
+
     client.close()
 
+    if NOTIFY_URL:
+        notify_import(NOTIFY_URL)
+
+def build_duplicate_groups(client, shares=None):
+    """
+    Rebuild duplicate_groups for the latest full scan of each share (default: every share)
+    from that scan's file rows; delta imports are left out. The new groups are written
+    before the previous build is deleted, so the table never reads as empty while this runs.
+    """
+    parameters = {'built_at': client.query('SELECT now()').result_rows[0][0]}
+    current = f'SELECT share, scan_date FROM {DATABASE}.{LATEST_SCANS}'
+    if shares is not None:
+        current += ' WHERE share IN {shares:Array(String)}'
+        parameters['shares'] = list(shares)
+
+    names = 'every share' if shares is None else ', '.join(share or '(unnamed)' for share in shares)
+    print(f"Building duplicate groups for {names}...")
+    start_time = datetime.now()
+    client.command(f"""
+        INSERT INTO {DATABASE}.{DUPLICATE_TABLE}
+        SELECT
+            scan_date,
+            share,
+            duplicate_hash,
+            count() AS copies,
+            max(size) AS file_size,
+            sum(size) AS total_bytes,
+            sum(size) - max(size) AS reclaimable_bytes,
+            uniqExact(owner) AS owners,
+            groupArray({DUPLICATE_SAMPLE_PATHS})(concat(path, filename)) AS sample_paths,
+            {{built_at:DateTime}} AS built_at
+        FROM {DATABASE}.{TABLE}
+        WHERE (share, scan_date) IN ({current}) AND is_directory = 0 AND duplicate_hash != ''
+        GROUP BY scan_date, share, duplicate_hash
+        HAVING copies > 1""",
+        parameters=parameters, settings={'max_bytes_before_external_group_by': DUPLICATE_SPILL_BYTES})
+    client.command(f'DELETE FROM {DATABASE}.{DUPLICATE_TABLE} '
+                   f'WHERE (share, scan_date) IN ({current}) AND built_at < {{built_at:DateTime}}', parameters=parameters)
+
+    groups, reclaimable = client.query(
+        f'SELECT count(), sum(reclaimable_bytes) FROM {DATABASE}.{DUPLICATE_TABLE} FINAL '
+        f'WHERE (share, scan_date) IN ({current})', parameters=parameters).result_rows[0]
+    duration = (datetime.now() - start_time).total_seconds()
+    print(f"Duplicate groups: {groups:,} sets, {reclaimable / 1024**3:,.1f} GiB reclaimable ({duration:.1f} seconds)")
+
+def build_scan_diff(client, shares=None):
+    """
+    Rebuild scan_diff for the latest full scan of each share (default: every share)
+    against that share's previous full scan. Delta imports only hold the churn, so
+    they are never compared.
+    """
+    scans = client.query(f'SELECT share, arraySort(groupArray(scan_date)) FROM {DATABASE}.{SCANS_TABLE} FINAL '
+                         'WHERE delta = 0 GROUP BY share ORDER BY share').result_rows
+    for share, dates in scans:
+        if shares is not None and share not in shares:
+            continue
+        if len(dates) < 2:
+            print(f"No full scan of {share or '(unnamed)'} before {dates[-1]} to compare with, skipping its diff")
+            continue
+        build_share_diff(client, share, dates[-1], dates[-2])
+
+def build_share_diff(client, share, scan_date, previous):
+    """
+    Rebuild scan_diff for one share's scan against an earlier scan of the same share.
+    Both scans are grouped by path hash in a single pass, which works as a full outer
+    join without holding either scan in a hash table; each hash bucket is its own insert.
+    """
+    parameters = {'share': share, 'scan_date': scan_date, 'previous': previous, 'buckets': DIFF_BUCKETS}
+
+    print(f"Comparing scan {scan_date} of {share or '(unnamed)'} with {previous}...")
+    start_time = datetime.now()
+    client.command(f'DELETE FROM {DATABASE}.{DIFF_TABLE} WHERE share = {{share:String}} AND scan_date = {{scan_date:Date}}',
+                   parameters=parameters)
+    for bucket in range(DIFF_BUCKETS):
+        client.command(f"""
+            INSERT INTO {DATABASE}.{DIFF_TABLE}
+            SELECT
+                {{scan_date:Date}} AS scan_date,
+                {{share:String}} AS share,
+                {{previous:Date}} AS previous_scan_date,
+                dim.1 AS dimension,
+                dim.2 AS key,
+                countIf(status = 'added') AS added_files,
+                sumIf(new_size, status = 'added') AS added_bytes,
+                countIf(status = 'removed') AS removed_files,
+                sumIf(old_size, status = 'removed') AS removed_bytes,
+                countIf(status = 'changed') AS changed_files,
+                sumIf(toInt64(new_size) - toInt64(old_size), status = 'changed') AS changed_bytes
+            FROM (
+                SELECT
+                    multiIf(old_count = 0, 'added', new_count = 0, 'removed',
+                            new_size != old_size OR new_modified != old_modified, 'changed', 'unchanged') AS status,
+                    new_size,
+                    old_size,
+                    [('owner', if(new_count = 0, old_owner, new_owner)),
+                     ('extension', toString(extension)),
+                     ('directory', directory)] AS dims
+                FROM (
+                    SELECT
+                        cityHash64(path, filename) AS file_hash,
+                        countIf(scan_date = {{scan_date:Date}}) AS new_count,
+                        countIf(scan_date = {{previous:Date}}) AS old_count,
+                        anyIf(size, scan_date = {{scan_date:Date}}) AS new_size,
+                        anyIf(size, scan_date = {{previous:Date}}) AS old_size,
+                        anyIf(modify_date, scan_date = {{scan_date:Date}}) AS new_modified,
+                        anyIf(modify_date, scan_date = {{previous:Date}}) AS old_modified,
+                        anyIf(owner, scan_date = {{scan_date:Date}}) AS new_owner,
+                        anyIf(owner, scan_date = {{previous:Date}}) AS old_owner,
+                        any(extension) AS extension,
+                        any(concat('/', arrayStringConcat(arrayMap(x -> concat(x, '/'),
+                            arraySlice(arrayFilter(x -> x != '', splitByChar('/', path)), 1, {DIFF_DIRECTORY_DEPTH})), '')))
+                            AS directory
+                    FROM {DATABASE}.{TABLE}
+                    WHERE share = {{share:String}} AND scan_date IN ({{scan_date:Date}}, {{previous:Date}})
+                        AND is_directory = 0
+                        AND cityHash64(path, filename) % {{buckets:UInt32}} = {bucket}
+                    GROUP BY file_hash
+                )
+                WHERE status != 'unchanged'
+            )
+            ARRAY JOIN dims AS dim
+            GROUP BY dimension, key""",
+            parameters=parameters)
+
+    added, removed, changed, growth = client.query(
+        f'SELECT sum(added_files), sum(removed_files), sum(changed_files), '
+        f'sum(added_bytes) - sum(removed_bytes) + sum(changed_bytes) FROM {DATABASE}.{DIFF_TABLE} '
+        "WHERE share = {share:String} AND scan_date = {scan_date:Date} AND dimension = 'extension'",
+        parameters=parameters).result_rows[0]
+    duration = (datetime.now() - start_time).total_seconds()
+    print(f"Scan diff: {added:,} added, {removed:,} removed, {changed:,} changed, "
+          f"{growth / 1024**3:+,.1f} GiB net ({duration:.1f} seconds)")
+
+def notify_import(url):
+    """Tell the AI query service new data is loaded so it drops cached results"""
+    try:
+        urllib.request.urlopen(urllib.request.Request(f"{url.rstrip('/')}/cache/invalidate", method='POST'),
+                               timeout=10).close()
+        print(f"Invalidated query cache at {url}")
+    except OSError as e:
+        print(f"Warning: could not invalidate query cache at {url}: {e}")
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import a Panzura Symphony scan CSV into ClickHouse')
+    parser.add_argument('--file', default=CSV_FILE,
+                        help=f'Scan CSV, optionally .gz/.zst/.xz; - reads stdin (default: {CSV_FILE})')
+    parser.add_argument('--host', default=CLICKHOUSE_HOST, help=f'ClickHouse host (default: {CLICKHOUSE_HOST})')
+    parser.add_argument('--port', type=int, default=CLICKHOUSE_PORT,
+                        help=f'ClickHouse HTTP port (default: {CLICKHOUSE_PORT})')
+    parser.add_argument('--table', default=TABLE, help=f'Target table in {DATABASE} (default: {TABLE})')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help=f'Rows per insert (default: {BATCH_SIZE})')
+    parser.add_argument('--mmap', action='store_true',
+                        help='Memory-map an uncompressed file instead of reading it through a buffer')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Parse processes; 1 keeps the single-threaded path (default: 1)')
+    parser.add_argument('--columnar', action='store_true',
+                        help='Parse with Arrow and insert columns instead of row tuples; '
+                             'ignores --workers since the Arrow reader is multi-threaded (requires pyarrow)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue an interrupted run from its checkpoint file')
+    parser.add_argument('--delta', action='store_true',
+                        help='Only load rows that are new or changed since the share\'s previous scan')
+    parser.add_argument('--index-dir', default=INDEX_DIR,
+                        help='Directory of the per-share hash indexes (default: next to the scan file)')
+    parser.add_argument('--share', default=SHARE,
+                        help='Share name stored with the rows (default: the scan\'s Source: line)')
+    parser.add_argument('--notify', default=NOTIFY_URL,
+                        help='AI query service URL to invalidate cached results after the import, '
+                             'e.g. http://localhost:5000')
+    parser.add_argument('--dedup-only', action='store_true',
+                        help='Rebuild every share\'s duplicate groups at its latest scan without importing, e.g. from cron')
+    parser.add_argument('--diff-only', action='store_true',
+                        help='Rebuild each share\'s latest diff against its previous full scan without importing')
+    args = parser.parse_args()
+    if (args.resume or args.delta) and (args.workers > 1 or args.columnar):
+        parser.error('--resume and --delta use the single-threaded path; drop --workers/--columnar')
+    if (args.resume or args.delta) and args.file == '-':
+        parser.error('--resume and --delta need a file; they cannot be used with stdin')
+    if args.workers > 1 and not args.columnar and (
+            args.file == '-' or (os.path.exists(args.file) and not is_plain_file(args.file))):
+        parser.error('--workers needs an uncompressed file; use --columnar for compressed or stdin input')
+
+    CSV_FILE = args.file
+    CLICKHOUSE_HOST = args.host
+    CLICKHOUSE_PORT = args.port
+    TABLE = args.table
+    BATCH_SIZE = args.batch_size
+    NOTIFY_URL = args.notify
+    SHARE = args.share
+    INDEX_DIR = args.index_dir
+
+    if args.dedup_only or args.diff_only:
+        client = get_client()
+        if args.dedup_only:
+            build_duplicate_groups(client)
+        if args.diff_only:
+            build_scan_diff(client)
+        client.close()
+        if NOTIFY_URL:
+            notify_import(NOTIFY_URL)
+        sys.exit(0)
+
     try:
-        import_data()
+        import_data(workers=args.workers, columnar=args.columnar, resume=args.resume, delta=args.delta,
+                    use_mmap=args.mmap)
     except KeyboardInterrupt:
         print("\n\nImport interrupted by user")
+        if args.workers == 1 and not args.columnar:
+            print("Run again with --resume to continue from the last committed batch")
         sys.exit(1)
     except Exception as e:
         print(f"\n\nError: {e}")
         sys.exit(1)
-
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+Ingestion service for Panzura Symphony scans
+Watches the data directory for new scan files, imports them through a bounded
+queue and reports progress, rows/sec and lag over HTTP
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import time
+from array import array
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+
+from fastapi import FastAPI
+from fastapi.responses import Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, generate_latest
+import uvicorn
+
+import import_data
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Configuration
+DATA_DIR = '/data'
+HTTP_PORT = 5001
+SCAN_SUFFIXES = ('.csv', '.csv.gz', '.csv.zst', '.csv.xz')  # Anything else in DATA_DIR is ignored
+STATE_FILE = '.ingested.json'  # In DATA_DIR; size and mtime of every file already imported
+POLL_SECONDS = 10  # A file is queued once its size and mtime are unchanged across one poll
+FILE_QUEUE_SIZE = 16  # Files waiting for a worker; the watcher stops picking up more when full
+INGEST_WORKERS = 2  # Files imported at once, each with its own ClickHouse connection
+BATCH_BYTES = 32 * 1024 * 1024  # CSV bytes per insert, so long ACLs don't make a fixed row count balloon
+BATCH_QUEUE_SIZE = 4  # Parsed batches waiting for insert per file; the parser blocks when full
+RATE_WINDOW_SECONDS = 60  # rows/sec in /status is averaged over this window
+INSERT_SETTINGS = {
+    'async_insert': 1,  # Concurrent files are merged into fewer parts by the server
+    'wait_for_async_insert': 1,  # Acknowledge only once flushed, so a checkpoint never runs ahead of the data
+}
+
+# Prometheus metrics (GET /metrics)
+ROWS = Counter('ingest_rows', 'Rows inserted into file_scan')
+FILES = Counter('ingest_files', 'Scan files finished', ['result'])
+INSERT_SECONDS = Counter('ingest_insert_seconds', 'Time spent in ClickHouse inserts')
+
+class Job:
+    """One scan file and its import progress"""
+
+    def __init__(self, path, size, mtime):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.state = 'queued'  # queued, importing, done or failed
+        self.plain = False
+        self.share = None
+        self.scan_date = None
+        self.bytes_read = 0
+        self.rows = 0
+        self.skipped = 0
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.cancelled = False
+        self.hashes = None  # Row hashes written as the share's --delta index once the file is in
+
+    def status(self):
+        """Progress as reported by GET /status"""
+        end = self.finished or time.time()
+        elapsed = end - self.started if self.started else 0
+        return {
+            'path': self.path,
+            'state': self.state,
+            'file_bytes': self.size,
+            'share': self.share,
+            'scan_date': self.scan_date.isoformat() if self.scan_date else None,
+            'rows': self.rows,
+            'skipped': self.skipped,
+            # Offsets count uncompressed bytes, so a percentage is only meaningful for plain files
+            'progress': round(self.bytes_read / self.size, 4) if self.plain and self.size else None,
+            'rows_per_sec': round(self.rows / elapsed) if elapsed > 0 else 0,
+            'started': datetime.fromtimestamp(self.started).isoformat(timespec='seconds') if self.started else None,
+            'finished': datetime.fromtimestamp(self.finished).isoformat(timespec='seconds') if self.finished else None,
+            'error': self.error,
+        }
+
+jobs = {}  # path -> latest Job
+ingested = {}  # path -> [size, mtime] of imported files, persisted in STATE_FILE
+recent_rows = deque()  # (time, rows) per insert within RATE_WINDOW_SECONDS
+file_queue = None
+active = 0  # Files being imported; finalize waits for this to reach 0
+pending_shares = set()  # Shares imported since the last finalize
+health_client = None  # Opened by the first /health probe and kept for the next ones
+health_lock = asyncio.Lock()  # Concurrent first probes open only one client
+
+def state_path():
+    return os.path.join(DATA_DIR, STATE_FILE)
+
+def load_state():
+    """Read the list of already imported files"""
+    global ingested
+    try:
+        with open(state_path()) as f:
+            ingested = json.load(f)
+    except FileNotFoundError:
+        ingested = {}
+
+def save_state():
+    """Atomically write the list of imported files"""
+    tmp = state_path() + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(ingested, f, indent=1)
+    os.replace(tmp, state_path())
+
+def list_scans():
+    """Scan files under DATA_DIR (one level of share subdirectories too) as {path: [size, mtime]}"""
+    found = {}
+    for root, dirs, files in os.walk(DATA_DIR):
+        dirs[:] = [d for d in dirs if not d.startswith('.')] if root == DATA_DIR else []
+        for name in files:
+            if name.startswith('.') or not name.endswith(SCAN_SUFFIXES):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            found[path] = [st.st_size, int(st.st_mtime)]
+    return found
+
+def lag_seconds():
+    """Age of the oldest scan file not yet imported (by mtime), 0 when caught up"""
+    waiting = [job.mtime for job in jobs.values() if job.state in ('queued', 'importing')]
+    return max(time.time() - min(waiting), 0) if waiting else 0
+
+def rows_per_sec():
+    """Insert rate over the last RATE_WINDOW_SECONDS"""
+    cutoff = time.time() - RATE_WINDOW_SECONDS
+    while recent_rows and recent_rows[0][0] < cutoff:
+        recent_rows.popleft()
+    return sum(rows for _, rows in recent_rows) / RATE_WINDOW_SECONDS
+
+QUEUE_FILES = Gauge('ingest_queue_files', 'Scan files waiting for a worker')
+QUEUE_FILES.set_function(lambda: file_queue.qsize() if file_queue else 0)
+LAG_SECONDS = Gauge('ingest_lag_seconds', 'Age of the oldest scan file not yet imported')
+LAG_SECONDS.set_function(lag_seconds)
+
+async def watch():
+    """Poll DATA_DIR and queue files that are new or changed and no longer being written"""
+    previous = {}
+    while True:
+        try:
+            current = await asyncio.to_thread(list_scans)
+        except OSError as e:
+            logger.warning(f"Could not list {DATA_DIR}: {e}")
+            current = {}
+        for path, signature in sorted(current.items(), key=lambda item: item[1][1]):
+            if previous.get(path) != signature or ingested.get(path) == signature:
+                continue
+            job = jobs.get(path)
+            if job is not None and [job.size, job.mtime] == signature and job.state != 'done':
+                continue  # Already queued, importing, or failed on this exact file
+            jobs[path] = Job(path, *signature)
+            logger.info(f"Queued {path} ({signature[0]:,} bytes)")
+            await file_queue.put(jobs[path])  # Blocks the watcher while FILE_QUEUE_SIZE files wait
+        previous = current
+        await asyncio.sleep(POLL_SECONDS)
+
+def read_batches(job, resume_offset, put):
+    """Parse a scan file (runs in a thread), handing (rows, end offset) to put() every BATCH_BYTES"""
+    with import_data.open_scan(job.path) as f:
+        position = [0]
+        for _ in range(import_data.PREAMBLE_LINES):
+            position[0] += len(f.readline())
+        reader = csv.DictReader(import_data.read_lines(f, position), fieldnames=import_data.FIELDNAMES)
+
+        batch = []
+        batch_start = max(position[0], resume_offset)
+        for row_num, row in enumerate(reader, 1):
+            if position[0] <= resume_offset:
+                # Inserted before the restart; reread only so the index covers every row
+                job.hashes.append(import_data.row_hash(row))
+                continue
+            try:
+                batch.append(import_data.parse_row(row) + (job.share, job.scan_date))
+                job.hashes.append(import_data.row_hash(row))
+            except Exception as e:
+                job.skipped += 1
+                if job.skipped <= 10:  # Only log the first 10 errors per file
+                    logger.warning(f"{job.path}: error on row {row_num}: {e}")
+            job.bytes_read = position[0]
+            if position[0] - batch_start >= BATCH_BYTES:
+                put(batch, position[0])
+                batch = []
+                batch_start = position[0]
+        if batch:
+            put(batch, position[0])
+
+async def ingest_file(client, job):
+    """
+    Import one file: a parser thread fills a bounded batch queue while this
+    coroutine inserts. After each insert the offset is checkpointed in the
+    same format as import_data.py, so a restart continues the file.
+    """
+    global active
+    loop = asyncio.get_running_loop()
+    checkpoint_file = f'{job.path}.checkpoint'
+    checkpoint = import_data.load_checkpoint(checkpoint_file)
+    if checkpoint is not None and (checkpoint['file_size'] != job.size or checkpoint['delta']):
+        logger.warning(f"Ignoring {checkpoint_file}, it was written for a different run")
+        checkpoint = None
+
+    job.state = 'importing'
+    job.started = time.time()
+    job.plain = import_data.is_plain_file(job.path)
+    job.share = await asyncio.to_thread(import_data.read_share, job.path)
+    # Keep an interrupted run's scan_date so a restart after midnight stays one scan
+    job.scan_date = date.fromisoformat(checkpoint['scan_date']) if checkpoint else date.today()
+    resume_offset = checkpoint['offset'] if checkpoint else 0
+    job.rows = checkpoint['rows'] if checkpoint else 0
+    job.skipped = checkpoint['skipped'] if checkpoint else 0
+    job.hashes = array('Q')
+    if checkpoint:
+        logger.info(f"Resuming {job.path} after {job.rows:,} rows (byte {resume_offset:,})")
+    else:
+        # A file re-exported the same day replaces the share's earlier import instead of adding to it
+        await asyncio.to_thread(import_data.replace_scan, client, job.share, job.scan_date)
+
+    active += 1
+
+    batches = asyncio.Queue(maxsize=BATCH_QUEUE_SIZE)
+
+    def put(batch, offset):
+        if job.cancelled:
+            raise RuntimeError('insert failed')
+        asyncio.run_coroutine_threadsafe(batches.put((batch, offset)), loop).result()
+
+    async def parse():
+        try:
+            await asyncio.to_thread(read_batches, job, resume_offset, put)
+        finally:
+            await batches.put(None)
+
+    parser = asyncio.create_task(parse())
+    try:
+        while (item := await batches.get()) is not None:
+            batch, offset = item
+            start = time.perf_counter()
+            await asyncio.to_thread(import_data.insert_batch, client, batch, import_data.SCAN_COLUMNS)
+            INSERT_SECONDS.inc(time.perf_counter() - start)
+            job.rows += len(batch)
+            ROWS.inc(len(batch))
+            recent_rows.append((time.time(), len(batch)))
+            import_data.save_checkpoint(checkpoint_file, {
+                'file_size': job.size, 'offset': offset, 'rows': job.rows, 'skipped': job.skipped,
+                'unchanged': 0, 'scan_date': job.scan_date.isoformat(), 'delta': False,
+            })
+        await parser  # Raises if the file could not be read
+    except BaseException:
+        job.cancelled = True
+        while not parser.done():  # Drain so a parser blocked on the full queue can see the cancellation
+            while not batches.empty():
+                batches.get_nowait()
+            await asyncio.sleep(0.1)
+        await asyncio.gather(parser, return_exceptions=True)
+        job.hashes = None
+        raise
+    finally:
+        active -= 1
+
+    await asyncio.to_thread(import_data.record_scan, client, job.share, job.scan_date, False, job.rows, job.path)
+    # Every share's index sits in DATA_DIR, where a manual --delta run finds it with --index-dir
+    await asyncio.to_thread(import_data.save_index, import_data.index_path(job.share, DATA_DIR), job.hashes)
+    job.hashes = None
+    if os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+    ingested[job.path] = [job.size, job.mtime]
+    save_state()
+
+async def finalize(client, shares):
+    """Once the queue drains: reload dictionaries, rebuild per-scan tables and notify the AI service"""
+    for dictionary in import_data.DICTIONARIES:
+        await asyncio.to_thread(client.command, f'SYSTEM RELOAD DICTIONARY {import_data.DATABASE}.{dictionary}')
+    # The rows are already in; an older database may just lack these tables (rerun create_schema.sql)
+    for build in (import_data.build_duplicate_groups, import_data.build_scan_diff):
+        try:
+            await asyncio.to_thread(build, client, shares)
+        except Exception as e:
+            logger.warning(f"{build.__name__} failed: {e}")
+    if import_data.NOTIFY_URL:
+        await asyncio.to_thread(import_data.notify_import, import_data.NOTIFY_URL)
+
+async def ingest_worker():
+    """Take files off the queue one at a time; whichever worker finishes last runs finalize()"""
+    client = await asyncio.to_thread(import_data.get_client, INSERT_SETTINGS)
+    try:
+        while True:
+            job = await file_queue.get()
+            try:
+                logger.info(f"Importing {job.path}")
+                await ingest_file(client, job)
+                job.state = 'done'
+                FILES.labels('done').inc()
+                pending_shares.add(job.share)
+                logger.info(f"Imported {job.path}: {job.rows:,} rows, {job.skipped:,} skipped "
+                            f"in {time.time() - job.started:.1f} seconds")
+            except Exception as e:
+                job.state = 'failed'
+                job.error = str(e)
+                FILES.labels('failed').inc()
+                logger.error(f"Import of {job.path} failed: {e}")
+            finally:
+                job.finished = time.time()
+                file_queue.task_done()
+
+            if pending_shares and active == 0 and file_queue.empty():
+                shares = set(pending_shares)
+                pending_shares.clear()
+                try:
+                    await finalize(client, shares)
+                except Exception as e:
+                    logger.error(f"Post-import steps failed: {e}")
+    finally:
+        client.close()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global file_queue
+    load_state()
+    file_queue = asyncio.Queue(maxsize=FILE_QUEUE_SIZE)
+    tasks = [asyncio.create_task(watch())]
+    tasks += [asyncio.create_task(ingest_worker()) for _ in range(INGEST_WORKERS)]
+    logger.info(f"Watching {DATA_DIR} with {INGEST_WORKERS} workers "
+                f"({len(ingested)} files already imported)")
+    yield
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if health_client is not None:
+        health_client.close()
+
+app = FastAPI(title="Pan-Dashboard Ingestion Service", lifespan=lifespan)
+
+@app.get("/health")
+async def health():
+    """Liveness plus a ClickHouse ping"""
+    global health_client
+    status = {"service": "ok"}
+    try:
+        async with health_lock:
+            if health_client is None:
+                health_client = await asyncio.to_thread(import_data.get_client)
+        if not await asyncio.to_thread(health_client.ping):
+            raise RuntimeError('ping failed')
+        status["clickhouse"] = "ok"
+    except Exception as e:
+        status["clickhouse"] = f"error: {str(e)}"
+    return status
+
+@app.get("/status")
+async def status():
+    """Queue depth, throughput, lag and per-file progress"""
+    return {
+        "data_dir": DATA_DIR,
+        "queued": file_queue.qsize(),
+        "importing": active,
+        "rows_per_sec": round(rows_per_sec()),
+        "lag_seconds": round(lag_seconds()),
+        "files_imported": len(ingested),
+        "files": [job.status() for job in sorted(jobs.values(), key=lambda job: job.mtime, reverse=True)],
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics"""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Continuously import Symphony scans dropped into a directory')
+    parser.add_argument('--data-dir', default=DATA_DIR, help=f'Directory to watch (default: {DATA_DIR})')
+    parser.add_argument('--host', default=import_data.CLICKHOUSE_HOST,
+                        help=f'ClickHouse host (default: {import_data.CLICKHOUSE_HOST})')
+    parser.add_argument('--port', type=int, default=import_data.CLICKHOUSE_PORT,
+                        help=f'ClickHouse HTTP port (default: {import_data.CLICKHOUSE_PORT})')
+    parser.add_argument('--http-port', type=int, default=HTTP_PORT,
+                        help=f'Port for /status, /health and /metrics (default: {HTTP_PORT})')
+    parser.add_argument('--workers', type=int, default=INGEST_WORKERS,
+                        help=f'Files imported at once (default: {INGEST_WORKERS})')
+    parser.add_argument('--batch-bytes', type=int, default=BATCH_BYTES,
+                        help=f'CSV bytes per insert (default: {BATCH_BYTES})')
+    parser.add_argument('--poll', type=float, default=POLL_SECONDS,
+                        help=f'Seconds between directory scans (default: {POLL_SECONDS})')
+    parser.add_argument('--notify', default=import_data.NOTIFY_URL,
+                        help='AI query service URL to invalidate cached results after imports, '
+                             'e.g. http://localhost:5000')
+    args = parser.parse_args()
+
+    DATA_DIR = args.data_dir
+    INGEST_WORKERS = args.workers
+    BATCH_BYTES = args.batch_bytes
+    POLL_SECONDS = args.poll
+    import_data.CLICKHOUSE_HOST = args.host
+    import_data.CLICKHOUSE_PORT = args.port
+    import_data.NOTIFY_URL = args.notify
+
+    uvicorn.run(app, host='0.0.0.0', port=args.http_port)
@@ -0,0 +1,113 @@
+-- Migrate file_scan to the v2 layout
+-- v2 stores the stable computed fields (domain, username, is_empty, is_directory,
+-- path_depth) as MATERIALIZED columns, uses LowCardinality for owner and domain,
+-- adds data-skipping indexes and column codecs, and sorts by is_directory so
+-- the dashboards' "is_directory = 0" filter prunes by primary key.
+--
+-- Usage (stop imports first, and make sure there is disk space for a second copy of the table):
+--   cat scripts/migrate_schema_v2.sql | docker exec -i pan-clickhouse clickhouse-client --password clickhouse
+--
+-- The old table is kept as file_scan_v1 for rollback. Drop it once the dashboards look right:
+--   DROP TABLE file_share.file_scan_v1;
+
+USE file_share;
+
+DROP TABLE IF EXISTS file_scan_v2;
+
+CREATE TABLE file_scan_v2 (
+    -- Raw fields from CSV
+    path String CODEC(ZSTD(3)),
+    filename String CODEC(ZSTD(3)),
+    extension LowCardinality(String),
+    size UInt64 CODEC(T64, ZSTD(1)),
+    migrated UInt8,
+    creation_date DateTime CODEC(Delta, ZSTD(1)),
+    modify_date DateTime CODEC(Delta, ZSTD(1)),
+    last_accessed_date DateTime CODEC(Delta, ZSTD(1)),
+    owner LowCardinality(String),
+    acl String CODEC(ZSTD(3)),
+    duplicate_hash String CODEC(ZSTD(1)),
+    
+    -- Metadata
+    scan_date Date DEFAULT today(),
+    
+    -- Computed fields (MATERIALIZED = computed once at insert and stored)
+    domain LowCardinality(String) MATERIALIZED splitByChar('\\', owner)[1],
+    username LowCardinality(String) MATERIALIZED splitByChar('\\', owner)[2],
+    is_empty UInt8 MATERIALIZED if(size = 0, 1, 0),
+    is_directory UInt8 MATERIALIZED if(filename = '.', 1, 0),
+    path_depth UInt16 MATERIALIZED length(splitByChar('/', path)) - 1,
+    
+    -- Computed fields (ALIAS = computed on read, since they depend on now())
+    days_since_modified UInt32 ALIAS dateDiff('day', modify_date, now()),
+    days_since_accessed UInt32 ALIAS dateDiff('day', last_accessed_date, now()),
+    file_age_days UInt32 ALIAS dateDiff('day', creation_date, now()),
+    
+    -- Data-skipping indexes for the dashboard and AI query filters
+    -- (is_directory is in the sorting key, so it needs no index of its own)
+    INDEX idx_path path TYPE ngrambf_v1(3, 32768, 2, 0) GRANULARITY 1,
+    INDEX idx_extension extension TYPE set(256) GRANULARITY 4,
+    INDEX idx_duplicate_hash duplicate_hash TYPE bloom_filter(0.01) GRANULARITY 4
+    
+) ENGINE = MergeTree()
+PARTITION BY toYYYYMM(scan_date)
+ORDER BY (scan_date, is_directory, owner, modify_date)
+SETTINGS index_granularity = 8192;
+
+INSERT INTO file_scan_v2 (path, filename, extension, size, migrated, creation_date, modify_date, last_accessed_date,
+    owner, acl, duplicate_hash, scan_date)
+SELECT path, filename, extension, size, migrated, creation_date, modify_date, last_accessed_date,
+    owner, acl, duplicate_hash, scan_date
+FROM file_scan;
+
+RENAME TABLE file_scan TO file_scan_v1, file_scan_v2 TO file_scan;
+
+-- Materialized views stay bound to the table they were created on, so recreate
+-- the rollup views against the new file_scan. The rollup tables keep their rows.
+DROP VIEW IF EXISTS file_scan_by_bucket_mv;
+DROP VIEW IF EXISTS file_scan_by_owner_mv;
+DROP VIEW IF EXISTS file_scan_by_extension_mv;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS file_scan_by_bucket_mv TO file_scan_by_bucket AS
+SELECT
+    scan_date,
+    if(filename = '.', 1, 0) AS is_directory,
+    if(position(path, '$RECYCLE.BIN') > 0, 1, 0) AS in_recycle_bin,
+    multiIf(dateDiff('day', modify_date, scan_date) < 30, 0,
+            dateDiff('day', modify_date, scan_date) < 90, 1,
+            dateDiff('day', modify_date, scan_date) < 180, 2,
+            dateDiff('day', modify_date, scan_date) < 365, 3,
+            dateDiff('day', modify_date, scan_date) < 730, 4,
+            dateDiff('day', modify_date, scan_date) < 1095, 5, 6) AS age_bucket,
+    multiIf(size = 0, 0, size < 1024, 1, size < 1048576, 2, size < 10485760, 3,
+            size < 104857600, 4, size < 1073741824, 5, 6) AS size_bucket,
+    count() AS files,
+    sum(size) AS bytes
+FROM file_scan
+GROUP BY scan_date, is_directory, in_recycle_bin, age_bucket, size_bucket;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS file_scan_by_owner_mv TO file_scan_by_owner AS
+SELECT
+    scan_date,
+    if(filename = '.', 1, 0) AS is_directory,
+    owner,
+    count() AS files,
+    sum(size) AS bytes
+FROM file_scan
+GROUP BY scan_date, is_directory, owner;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS file_scan_by_extension_mv TO file_scan_by_extension AS
+SELECT
+    scan_date,
+    if(filename = '.', 1, 0) AS is_directory,
+    extension,
+    multiIf(dateDiff('day', last_accessed_date, scan_date) < 30, 0,
+            dateDiff('day', last_accessed_date, scan_date) < 90, 1,
+            dateDiff('day', last_accessed_date, scan_date) < 180, 2,
+            dateDiff('day', last_accessed_date, scan_date) < 365, 3,
+            dateDiff('day', last_accessed_date, scan_date) < 730, 4,
+            dateDiff('day', last_accessed_date, scan_date) < 1095, 5, 6) AS access_age_bucket,
+    count() AS files,
+    sum(size) AS bytes
+FROM file_scan
+GROUP BY scan_date, is_directory, extension, access_age_bucket;
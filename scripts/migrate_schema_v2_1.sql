@@ -0,0 +1,87 @@
+-- Migrate a v2 database to v2.1: add the recursive directory rollup behind /tree and the
+-- Directory Tree dashboard, and fill it from the scans already in file_scan.
+-- Safe to run more than once; the rollup is rebuilt from file_scan each time.
+--
+-- Usage (stop imports first, rows inserted while this runs would be counted twice):
+--   cat scripts/migrate_schema_v2_1.sql | docker exec -i pan-clickhouse clickhouse-client --password clickhouse
+--
+-- Run it after migrate_schema_v2.sql and before migrate_schema_v3.sql.
+
+USE file_share;
+
+-- Per-directory totals for the tree browser, recursive: every file is counted in each of
+-- its ancestor directories, so one row group answers "how big is this folder" without a
+-- LIKE prefix scan. Drill down with WHERE parent_path = '/share/Finance/'.
+-- depth 0 is the root '/', depth 1 its top-level folders. Directory entries (filename '.')
+-- are not counted, and last_modified is the newest file modification under the directory.
+CREATE TABLE IF NOT EXISTS file_scan_by_directory (
+    scan_date Date,
+    parent_path String,
+    depth UInt16,
+    directory String,
+    age_bucket UInt8,
+    files SimpleAggregateFunction(sum, UInt64),
+    bytes SimpleAggregateFunction(sum, UInt64),
+    last_modified SimpleAggregateFunction(max, DateTime)
+) ENGINE = AggregatingMergeTree()
+PARTITION BY toYYYYMM(scan_date)
+ORDER BY (scan_date, parent_path, depth, directory, age_bucket);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS file_scan_by_directory_mv TO file_scan_by_directory AS
+SELECT
+    scan_date,
+    if(depth <= 1, if(depth = 0, '', '/'),
+       concat('/', arrayStringConcat(arraySlice(parts, 1, depth - 1), '/'), '/')) AS parent_path,
+    depth,
+    if(depth = 0, '/', concat('/', arrayStringConcat(arraySlice(parts, 1, depth), '/'), '/')) AS directory,
+    age_bucket,
+    count() AS files,
+    sum(size) AS bytes,
+    max(modify_date) AS last_modified
+FROM (
+    SELECT
+        scan_date,
+        size,
+        modify_date,
+        multiIf(dateDiff('day', modify_date, scan_date) < 30, 0,
+                dateDiff('day', modify_date, scan_date) < 90, 1,
+                dateDiff('day', modify_date, scan_date) < 180, 2,
+                dateDiff('day', modify_date, scan_date) < 365, 3,
+                dateDiff('day', modify_date, scan_date) < 730, 4,
+                dateDiff('day', modify_date, scan_date) < 1095, 5, 6) AS age_bucket,
+        arrayFilter(x -> x != '', splitByChar('/', path)) AS parts
+    FROM file_scan
+    WHERE filename != '.'
+)
+ARRAY JOIN range(toUInt16(length(parts) + 1)) AS depth
+GROUP BY scan_date, parent_path, depth, directory, age_bucket;
+
+TRUNCATE TABLE file_scan_by_directory;
+INSERT INTO file_scan_by_directory
+SELECT
+    scan_date,
+    if(depth <= 1, if(depth = 0, '', '/'),
+       concat('/', arrayStringConcat(arraySlice(parts, 1, depth - 1), '/'), '/')) AS parent_path,
+    depth,
+    if(depth = 0, '/', concat('/', arrayStringConcat(arraySlice(parts, 1, depth), '/'), '/')) AS directory,
+    age_bucket,
+    count() AS files,
+    sum(size) AS bytes,
+    max(modify_date) AS last_modified
+FROM (
+    SELECT
+        scan_date,
+        size,
+        modify_date,
+        multiIf(dateDiff('day', modify_date, scan_date) < 30, 0,
+                dateDiff('day', modify_date, scan_date) < 90, 1,
+                dateDiff('day', modify_date, scan_date) < 180, 2,
+                dateDiff('day', modify_date, scan_date) < 365, 3,
+                dateDiff('day', modify_date, scan_date) < 730, 4,
+                dateDiff('day', modify_date, scan_date) < 1095, 5, 6) AS age_bucket,
+        arrayFilter(x -> x != '', splitByChar('/', path)) AS parts
+    FROM file_scan
+    WHERE filename != '.'
+)
+ARRAY JOIN range(toUInt16(length(parts) + 1)) AS depth
+GROUP BY scan_date, parent_path, depth, directory, age_bucket;
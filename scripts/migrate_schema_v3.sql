@@ -0,0 +1,244 @@
+-- Migrate file_scan to the v3 layout
+-- v3 interns ACL strings: file_scan stores a UInt64 acl_id (cityHash64 of the ACL text) and acl_dim
+-- (read through the acl_dict dictionary) holds each distinct ACL once, with its access flags parsed.
+-- acl stays queryable as an ALIAS column. Owners are classified once in owner_dim / owner_dict,
+-- and a new file_scan_by_acl rollup backs the security dashboard.
+-- Run it on a database already on the v2 layout (see migrate_schema_v2.sql).
+--
+-- Usage (stop imports first, and make sure there is disk space for a second copy of the table):
+--   cat scripts/migrate_schema_v3.sql | docker exec -i pan-clickhouse clickhouse-client --password clickhouse
+--
+-- The old table is kept as file_scan_v2 for rollback. Drop it once the dashboards look right:
+--   DROP TABLE file_share.file_scan_v2;
+
+USE file_share;
+
+CREATE TABLE IF NOT EXISTS acl_dim (
+    acl_id UInt64 DEFAULT cityHash64(acl),
+    acl String,
+    ace_count UInt16 MATERIALIZED if(acl = '', 0, length(splitByChar(';', acl))),
+    -- Granted to Everyone or Authenticated Users, i.e. readable by any account
+    everyone_access UInt8 MATERIALIZED multiSearchAny(acl, ['Everyone', 'Authenticated Users']),
+    -- Holds an unresolved domain SID, i.e. an entry for a deleted account
+    has_orphaned_sid UInt8 MATERIALIZED match(acl, 'S-1-5-21-[0-9]+-[0-9]+-[0-9]+-[0-9]+')
+) ENGINE = ReplacingMergeTree()
+ORDER BY acl_id;
+
+CREATE DICTIONARY IF NOT EXISTS acl_dict (
+    acl_id UInt64,
+    acl String,
+    ace_count UInt16,
+    everyone_access UInt8,
+    has_orphaned_sid UInt8
+) PRIMARY KEY acl_id
+SOURCE(CLICKHOUSE(DB 'file_share' TABLE 'acl_dim' USER 'default' PASSWORD 'clickhouse'))
+LAYOUT(HASHED())
+LIFETIME(MIN 60 MAX 300);
+
+-- Register the distinct ACLs of the existing scans; the id is derived from the text, as in import_data.py
+INSERT INTO acl_dim (acl)
+SELECT DISTINCT acl FROM file_scan;
+
+SYSTEM RELOAD DICTIONARY acl_dict;
+
+DROP TABLE IF EXISTS file_scan_v3;
+
+CREATE TABLE file_scan_v3 (
+    -- Raw fields from CSV
+    path String CODEC(ZSTD(3)),
+    filename String CODEC(ZSTD(3)),
+    extension LowCardinality(String),
+    size UInt64 CODEC(T64, ZSTD(1)),
+    migrated UInt8,
+    creation_date DateTime CODEC(Delta, ZSTD(1)),
+    modify_date DateTime CODEC(Delta, ZSTD(1)),
+    last_accessed_date DateTime CODEC(Delta, ZSTD(1)),
+    owner LowCardinality(String),
+    acl_id UInt64 CODEC(ZSTD(1)),  -- ACL text and flags are in acl_dim / acl_dict
+    duplicate_hash String CODEC(ZSTD(1)),
+    
+    -- Metadata
+    scan_date Date DEFAULT today(),
+    
+    -- Computed fields (MATERIALIZED = computed once at insert and stored)
+    domain LowCardinality(String) MATERIALIZED splitByChar('\\', owner)[1],
+    username LowCardinality(String) MATERIALIZED splitByChar('\\', owner)[2],
+    is_empty UInt8 MATERIALIZED if(size = 0, 1, 0),
+    is_directory UInt8 MATERIALIZED if(filename = '.', 1, 0),
+    path_depth UInt16 MATERIALIZED length(splitByChar('/', path)) - 1,
+    
+    -- Computed fields (ALIAS = computed on read, since they depend on now() or a dictionary)
+    days_since_modified UInt32 ALIAS dateDiff('day', modify_date, now()),
+    days_since_accessed UInt32 ALIAS dateDiff('day', last_accessed_date, now()),
+    file_age_days UInt32 ALIAS dateDiff('day', creation_date, now()),
+    acl String ALIAS dictGetString('file_share.acl_dict', 'acl', acl_id),
+    
+    -- Data-skipping indexes for the dashboard and AI query filters
+    -- (is_directory is in the sorting key, so it needs no index of its own)
+    INDEX idx_path path TYPE ngrambf_v1(3, 32768, 2, 0) GRANULARITY 1,
+    INDEX idx_extension extension TYPE set(256) GRANULARITY 4,
+    INDEX idx_duplicate_hash duplicate_hash TYPE bloom_filter(0.01) GRANULARITY 4
+    
+) ENGINE = MergeTree()
+PARTITION BY toYYYYMM(scan_date)
+ORDER BY (scan_date, is_directory, owner, modify_date)
+SETTINGS index_granularity = 8192;
+
+INSERT INTO file_scan_v3 (path, filename, extension, size, migrated, creation_date, modify_date, last_accessed_date,
+    owner, acl_id, duplicate_hash, scan_date)
+SELECT path, filename, extension, size, migrated, creation_date, modify_date, last_accessed_date,
+    owner, cityHash64(acl), duplicate_hash, scan_date
+FROM file_scan;
+
+RENAME TABLE file_scan TO file_scan_v2, file_scan_v3 TO file_scan;
+
+-- Materialized views stay bound to the table they were created on, so recreate them
+-- against the new file_scan. The rollup tables keep their rows.
+DROP VIEW IF EXISTS file_scan_by_bucket_mv;
+DROP VIEW IF EXISTS file_scan_by_owner_mv;
+DROP VIEW IF EXISTS file_scan_by_extension_mv;
+DROP VIEW IF EXISTS file_scan_by_directory_mv;
+
+CREATE TABLE IF NOT EXISTS file_scan_by_acl (
+    scan_date Date,
+    is_directory UInt8,
+    acl_id UInt64,
+    files SimpleAggregateFunction(sum, UInt64),
+    bytes SimpleAggregateFunction(sum, UInt64)
+) ENGINE = AggregatingMergeTree()
+PARTITION BY toYYYYMM(scan_date)
+ORDER BY (scan_date, is_directory, acl_id);
+
+CREATE TABLE IF NOT EXISTS owner_dim (
+    owner String,
+    domain LowCardinality(String),
+    owner_type LowCardinality(String)
+) ENGINE = ReplacingMergeTree()
+ORDER BY owner;
+
+CREATE DICTIONARY IF NOT EXISTS owner_dict (
+    owner String,
+    domain String,
+    owner_type String
+) PRIMARY KEY owner
+SOURCE(CLICKHOUSE(DB 'file_share' TABLE 'owner_dim' USER 'default' PASSWORD 'clickhouse'))
+LAYOUT(COMPLEX_KEY_HASHED())
+LIFETIME(MIN 60 MAX 300);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS file_scan_by_bucket_mv TO file_scan_by_bucket AS
+SELECT
+    scan_date,
+    if(filename = '.', 1, 0) AS is_directory,
+    if(position(path, '$RECYCLE.BIN') > 0, 1, 0) AS in_recycle_bin,
+    multiIf(dateDiff('day', modify_date, scan_date) < 30, 0,
+            dateDiff('day', modify_date, scan_date) < 90, 1,
+            dateDiff('day', modify_date, scan_date) < 180, 2,
+            dateDiff('day', modify_date, scan_date) < 365, 3,
+            dateDiff('day', modify_date, scan_date) < 730, 4,
+            dateDiff('day', modify_date, scan_date) < 1095, 5, 6) AS age_bucket,
+    multiIf(size = 0, 0, size < 1024, 1, size < 1048576, 2, size < 10485760, 3,
+            size < 104857600, 4, size < 1073741824, 5, 6) AS size_bucket,
+    count() AS files,
+    sum(size) AS bytes
+FROM file_scan
+GROUP BY scan_date, is_directory, in_recycle_bin, age_bucket, size_bucket;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS file_scan_by_owner_mv TO file_scan_by_owner AS
+SELECT
+    scan_date,
+    if(filename = '.', 1, 0) AS is_directory,
+    owner,
+    count() AS files,
+    sum(size) AS bytes
+FROM file_scan
+GROUP BY scan_date, is_directory, owner;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS file_scan_by_extension_mv TO file_scan_by_extension AS
+SELECT
+    scan_date,
+    if(filename = '.', 1, 0) AS is_directory,
+    extension,
+    multiIf(dateDiff('day', last_accessed_date, scan_date) < 30, 0,
+            dateDiff('day', last_accessed_date, scan_date) < 90, 1,
+            dateDiff('day', last_accessed_date, scan_date) < 180, 2,
+            dateDiff('day', last_accessed_date, scan_date) < 365, 3,
+            dateDiff('day', last_accessed_date, scan_date) < 730, 4,
+            dateDiff('day', last_accessed_date, scan_date) < 1095, 5, 6) AS access_age_bucket,
+    count() AS files,
+    sum(size) AS bytes
+FROM file_scan
+GROUP BY scan_date, is_directory, extension, access_age_bucket;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS file_scan_by_acl_mv TO file_scan_by_acl AS
+SELECT
+    scan_date,
+    if(filename = '.', 1, 0) AS is_directory,
+    acl_id,
+    count() AS files,
+    sum(size) AS bytes
+FROM file_scan
+GROUP BY scan_date, is_directory, acl_id;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS file_scan_by_directory_mv TO file_scan_by_directory AS
+SELECT
+    scan_date,
+    if(depth <= 1, if(depth = 0, '', '/'),
+       concat('/', arrayStringConcat(arraySlice(parts, 1, depth - 1), '/'), '/')) AS parent_path,
+    depth,
+    if(depth = 0, '/', concat('/', arrayStringConcat(arraySlice(parts, 1, depth), '/'), '/')) AS directory,
+    age_bucket,
+    count() AS files,
+    sum(size) AS bytes,
+    max(modify_date) AS last_modified
+FROM (
+    SELECT
+        scan_date,
+        size,
+        modify_date,
+        multiIf(dateDiff('day', modify_date, scan_date) < 30, 0,
+                dateDiff('day', modify_date, scan_date) < 90, 1,
+                dateDiff('day', modify_date, scan_date) < 180, 2,
+                dateDiff('day', modify_date, scan_date) < 365, 3,
+                dateDiff('day', modify_date, scan_date) < 730, 4,
+                dateDiff('day', modify_date, scan_date) < 1095, 5, 6) AS age_bucket,
+        arrayFilter(x -> x != '', splitByChar('/', path)) AS parts
+    FROM file_scan
+    WHERE filename != '.'
+)
+ARRAY JOIN range(toUInt16(length(parts) + 1)) AS depth
+GROUP BY scan_date, parent_path, depth, directory, age_bucket;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS owner_dim_mv TO owner_dim AS
+SELECT DISTINCT
+    toString(owner) AS owner,
+    splitByChar('\\', owner)[1] AS domain,
+    multiIf(owner = '', 'Unknown',
+            owner LIKE 'S-1-%', 'Orphaned (SID)',
+            owner LIKE 'BUILTIN%', 'System (BUILTIN)',
+            owner LIKE 'NT AUTHORITY%', 'System (NT AUTHORITY)',
+            owner LIKE '%-adm', 'Admin Account', 'Regular User') AS owner_type
+FROM file_scan;
+
+-- The new rollup and owner_dim only see inserts from here on, so fill them from the existing scans
+INSERT INTO file_scan_by_acl
+SELECT
+    scan_date,
+    if(filename = '.', 1, 0) AS is_directory,
+    acl_id,
+    count() AS files,
+    sum(size) AS bytes
+FROM file_scan
+GROUP BY scan_date, is_directory, acl_id;
+
+INSERT INTO owner_dim
+SELECT DISTINCT
+    toString(owner) AS owner,
+    splitByChar('\\', owner)[1] AS domain,
+    multiIf(owner = '', 'Unknown',
+            owner LIKE 'S-1-%', 'Orphaned (SID)',
+            owner LIKE 'BUILTIN%', 'System (BUILTIN)',
+            owner LIKE 'NT AUTHORITY%', 'System (NT AUTHORITY)',
+            owner LIKE '%-adm', 'Admin Account', 'Regular User') AS owner_type
+FROM file_scan;
+
+SYSTEM RELOAD DICTIONARY owner_dict;
@@ -0,0 +1,223 @@
+-- Migrate a v3 database to the v4 layout
+-- v4 records every import in the scans table, with the share it came from and whether it was a
+-- --delta import, and adds a share column to file_scan and the rollups. Readers of the latest scan
+-- go through the latest_scans view, so a delta partition is never taken for a whole share and
+-- shares scanned on different days are each read at their own latest scan.
+-- Existing rows get share '' and every existing scan_date is registered as a full scan. If some of
+-- them were --delta imports, mark them afterwards, e.g.
+--   ALTER TABLE file_share.scans UPDATE delta = 1 WHERE scan_date = '2026-05-02';
+-- scan_diff is recreated with a share column, since each share is now compared with its own
+-- previous full scan; rebuild it afterwards with python scripts/import_data.py --diff-only
+-- duplicate_groups is recreated the same way, with duplicate sets per share; rebuild it with --dedup-only
+-- Run it on a database already on the v3 layout (see migrate_schema_v3.sql).
+--
+-- Usage (stop imports first):
+--   cat scripts/migrate_schema_v4.sql | docker exec -i pan-clickhouse clickhouse-client --password clickhouse
+
+USE file_share;
+
+ALTER TABLE file_scan ADD COLUMN share LowCardinality(String) DEFAULT '' AFTER scan_date;
+
+CREATE TABLE IF NOT EXISTS scans (
+    share LowCardinality(String),
+    scan_date Date,
+    delta UInt8,
+    source_file String,
+    rows UInt64,
+    imported_at DateTime DEFAULT now()
+) ENGINE = ReplacingMergeTree(imported_at)
+ORDER BY (share, scan_date);
+
+-- Latest full scan of every share; "current state" queries filter on
+-- (share, scan_date) IN (SELECT share, scan_date FROM file_share.latest_scans)
+CREATE OR REPLACE VIEW latest_scans AS
+SELECT share, max(scan_date) AS scan_date
+FROM scans FINAL
+WHERE delta = 0
+GROUP BY share;
+
+-- Every scan imported so far counts as a full scan of the unnamed share
+INSERT INTO scans (share, scan_date, delta, source_file, rows)
+SELECT '', scan_date, 0, '', count()
+FROM file_scan
+GROUP BY scan_date;
+
+CREATE OR REPLACE VIEW file_scan_enriched AS
+SELECT 
+    path,
+    filename,
+    extension,
+    size,
+    migrated,
+    creation_date,
+    modify_date,
+    last_accessed_date,
+    owner,
+    acl,
+    duplicate_hash,
+    scan_date,
+    share,
+    -- Computed fields explicitly selected
+    splitByChar('\\', owner)[1] AS domain,
+    splitByChar('\\', owner)[2] AS username,
+    dateDiff('day', modify_date, now()) AS days_since_modified,
+    dateDiff('day', last_accessed_date, now()) AS days_since_accessed,
+    dateDiff('day', creation_date, now()) AS file_age_days,
+    if(size = 0, 1, 0) AS is_empty,
+    if(filename = '.', 1, 0) AS is_directory,
+    length(splitByChar('/', path)) - 1 AS path_depth
+FROM file_scan;
+
+-- The rollups keep their rows; share is added to the end of each sorting key
+ALTER TABLE file_scan_by_bucket
+    ADD COLUMN share LowCardinality(String) AFTER scan_date,
+    MODIFY ORDER BY (scan_date, is_directory, in_recycle_bin, age_bucket, size_bucket, share);
+
+ALTER TABLE file_scan_by_owner
+    ADD COLUMN share LowCardinality(String) AFTER scan_date,
+    MODIFY ORDER BY (scan_date, is_directory, owner, share);
+
+ALTER TABLE file_scan_by_extension
+    ADD COLUMN share LowCardinality(String) AFTER scan_date,
+    MODIFY ORDER BY (scan_date, is_directory, extension, access_age_bucket, share);
+
+ALTER TABLE file_scan_by_acl
+    ADD COLUMN share LowCardinality(String) AFTER scan_date,
+    MODIFY ORDER BY (scan_date, is_directory, acl_id, share);
+
+ALTER TABLE file_scan_by_directory
+    ADD COLUMN share LowCardinality(String) AFTER scan_date,
+    MODIFY ORDER BY (scan_date, parent_path, depth, directory, age_bucket, share);
+
+-- Materialized views stay bound to their SELECT, so recreate them to carry share into the rollups
+DROP VIEW IF EXISTS file_scan_by_bucket_mv;
+DROP VIEW IF EXISTS file_scan_by_owner_mv;
+DROP VIEW IF EXISTS file_scan_by_extension_mv;
+DROP VIEW IF EXISTS file_scan_by_acl_mv;
+DROP VIEW IF EXISTS file_scan_by_directory_mv;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS file_scan_by_bucket_mv TO file_scan_by_bucket AS
+SELECT
+    scan_date,
+    share,
+    if(filename = '.', 1, 0) AS is_directory,
+    if(position(path, '$RECYCLE.BIN') > 0, 1, 0) AS in_recycle_bin,
+    multiIf(dateDiff('day', modify_date, scan_date) < 30, 0,
+            dateDiff('day', modify_date, scan_date) < 90, 1,
+            dateDiff('day', modify_date, scan_date) < 180, 2,
+            dateDiff('day', modify_date, scan_date) < 365, 3,
+            dateDiff('day', modify_date, scan_date) < 730, 4,
+            dateDiff('day', modify_date, scan_date) < 1095, 5, 6) AS age_bucket,
+    multiIf(size = 0, 0, size < 1024, 1, size < 1048576, 2, size < 10485760, 3,
+            size < 104857600, 4, size < 1073741824, 5, 6) AS size_bucket,
+    count() AS files,
+    sum(size) AS bytes
+FROM file_scan
+GROUP BY scan_date, share, is_directory, in_recycle_bin, age_bucket, size_bucket;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS file_scan_by_owner_mv TO file_scan_by_owner AS
+SELECT
+    scan_date,
+    share,
+    if(filename = '.', 1, 0) AS is_directory,
+    owner,
+    count() AS files,
+    sum(size) AS bytes
+FROM file_scan
+GROUP BY scan_date, share, is_directory, owner;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS file_scan_by_extension_mv TO file_scan_by_extension AS
+SELECT
+    scan_date,
+    share,
+    if(filename = '.', 1, 0) AS is_directory,
+    extension,
+    multiIf(dateDiff('day', last_accessed_date, scan_date) < 30, 0,
+            dateDiff('day', last_accessed_date, scan_date) < 90, 1,
+            dateDiff('day', last_accessed_date, scan_date) < 180, 2,
+            dateDiff('day', last_accessed_date, scan_date) < 365, 3,
+            dateDiff('day', last_accessed_date, scan_date) < 730, 4,
+            dateDiff('day', last_accessed_date, scan_date) < 1095, 5, 6) AS access_age_bucket,
+    count() AS files,
+    sum(size) AS bytes
+FROM file_scan
+GROUP BY scan_date, share, is_directory, extension, access_age_bucket;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS file_scan_by_acl_mv TO file_scan_by_acl AS
+SELECT
+    scan_date,
+    share,
+    if(filename = '.', 1, 0) AS is_directory,
+    acl_id,
+    count() AS files,
+    sum(size) AS bytes
+FROM file_scan
+GROUP BY scan_date, share, is_directory, acl_id;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS file_scan_by_directory_mv TO file_scan_by_directory AS
+SELECT
+    scan_date,
+    share,
+    if(depth <= 1, if(depth = 0, '', '/'),
+       concat('/', arrayStringConcat(arraySlice(parts, 1, depth - 1), '/'), '/')) AS parent_path,
+    depth,
+    if(depth = 0, '/', concat('/', arrayStringConcat(arraySlice(parts, 1, depth), '/'), '/')) AS directory,
+    age_bucket,
+    count() AS files,
+    sum(size) AS bytes,
+    max(modify_date) AS last_modified
+FROM (
+    SELECT
+        scan_date,
+        share,
+        size,
+        modify_date,
+        multiIf(dateDiff('day', modify_date, scan_date) < 30, 0,
+                dateDiff('day', modify_date, scan_date) < 90, 1,
+                dateDiff('day', modify_date, scan_date) < 180, 2,
+                dateDiff('day', modify_date, scan_date) < 365, 3,
+                dateDiff('day', modify_date, scan_date) < 730, 4,
+                dateDiff('day', modify_date, scan_date) < 1095, 5, 6) AS age_bucket,
+        arrayFilter(x -> x != '', splitByChar('/', path)) AS parts
+    FROM file_scan
+    WHERE filename != '.'
+)
+ARRAY JOIN range(toUInt16(length(parts) + 1)) AS depth
+GROUP BY scan_date, share, parent_path, depth, directory, age_bucket;
+
+-- scan_diff now holds one diff per share; the old rows can't be split by share, so they are dropped
+DROP TABLE IF EXISTS scan_diff;
+
+CREATE TABLE scan_diff (
+    scan_date Date,
+    share LowCardinality(String),
+    previous_scan_date Date,
+    dimension LowCardinality(String),
+    key String,
+    added_files SimpleAggregateFunction(sum, UInt64),
+    added_bytes SimpleAggregateFunction(sum, UInt64),
+    removed_files SimpleAggregateFunction(sum, UInt64),
+    removed_bytes SimpleAggregateFunction(sum, UInt64),
+    changed_files SimpleAggregateFunction(sum, UInt64),
+    changed_bytes SimpleAggregateFunction(sum, Int64)
+) ENGINE = AggregatingMergeTree()
+PARTITION BY toYYYYMM(scan_date)
+ORDER BY (scan_date, share, previous_scan_date, dimension, key);
+
+-- duplicate_groups now holds each share's sets at that share's latest scan; it is rebuilt from file_scan
+DROP TABLE IF EXISTS duplicate_groups;
+
+CREATE TABLE duplicate_groups (
+    scan_date Date,
+    share LowCardinality(String),
+    duplicate_hash String,
+    copies UInt64,
+    file_size UInt64,
+    total_bytes UInt64,
+    reclaimable_bytes UInt64,
+    owners UInt32,
+    sample_paths Array(String),
+    built_at DateTime
+) ENGINE = ReplacingMergeTree(built_at)
+PARTITION BY toYYYYMM(scan_date)
+ORDER BY (scan_date, share, duplicate_hash);
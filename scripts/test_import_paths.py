@@ -0,0 +1,60 @@
+"""
+Check that the row path (parse_row) and the columnar path (build_arrow_table)
+of import_data.py turn the same CSV into the same file_scan rows.
+Run from this directory: python -m unittest test_import_paths
+"""
+
+import csv
+import io
+import unittest
+from datetime import timezone
+
+import import_data
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+
+SAMPLE = '''"/share/Finance/","budget.xlsx",".xlsx",1024,False,1969-12-31T23:00:00Z,2024-03-01T08:00:00.123+02:00,2024-03-02T23:30:00-05:30,"CORP\\alice","O:S-1-5-21D:(A;;FA;;;SY)","abc123"
+/share/HR/,notes.txt,.txt,0,True,2024-03-01 08:00:00,1970-01-01T00:30:00+01:00,2024-03-01T08:00,CORP\\bob,"O:S-1-5-21D:(A;;FA;;;SY)",
+/share/Temp/,"""quoted"".log",.log,,false,,not a date,2024-03-01T08:00:00x,"""CORP\\carol""",,
+'''
+
+
+def stored_datetime(value):
+    """A parse_datetime() value as the DateTime column keeps it: UTC, whole seconds"""
+    return value.astimezone(timezone.utc).replace(tzinfo=None, microsecond=0)
+
+
+@unittest.skipIf(pa is None, "the columnar path needs pyarrow")
+class ImportPathsTest(unittest.TestCase):
+
+    def row_path(self):
+        rows = []
+        for row in csv.DictReader(io.StringIO(SAMPLE), fieldnames=import_data.FIELDNAMES):
+            record = list(import_data.parse_row(row))
+            for name in ('creation_date', 'modify_date', 'last_accessed_date'):
+                i = import_data.COLUMNS.index(name)
+                record[i] = stored_datetime(record[i])
+            record[import_data.ACL_INDEX] = import_data.acl_ids.lookup(None, [record[import_data.ACL_INDEX]])[0]
+            rows.append(tuple(record))
+        return rows
+
+    def columnar_path(self):
+        raw = pa_csv.read_csv(
+            io.BytesIO(SAMPLE.encode('utf-8')),
+            read_options=pa_csv.ReadOptions(column_names=import_data.FIELDNAMES),
+            convert_options=pa_csv.ConvertOptions(column_types={name: pa.string() for name in import_data.FIELDNAMES},
+                                                  strings_can_be_null=False))
+        table = import_data.build_arrow_table(raw)
+        columns = [table[name].to_pylist() for name in import_data.COLUMNS]
+        return list(zip(*columns))
+
+    def test_same_rows(self):
+        self.assertEqual(self.columnar_path(), self.row_path())
+
+
+if __name__ == '__main__':
+    unittest.main()